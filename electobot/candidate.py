@@ -8,15 +8,30 @@ Analysis and prediction tool based on the 2010 UK General Election results
 Candidate data structure
 """
 
+# Electobot imports
+from constants import *
+
 class Candidate(object):
-    """Candidate for a seat."""
+    """Candidate for a seat.  This is a view onto the candidate's entry in a
+    ConstituencyTable, rather than a copy of it.
+    """
+    
+    __slots__ = ["table", "row", "party"]
     
-    def __init__(self, name, party, votes):
-        """Constructor.  Store relevant information."""
+    def __init__(self, table, row, party):
+        """Constructor.  Store where to find the relevant information."""
         
-        self.name = name
+        self.table = table
+        self.row = row
         self.party = party
-        self.votes_2010 = votes
-        self.incumbent = None
         
-        return
\ No newline at end of file
+        return
+    
+    @property
+    def name(self):
+        name = self.table.candidate_names[self.row][self.party]
+        return name if name is not None else "Unknown"
+    
+    @property
+    def votes_2010(self):
+        return self.table.get_party_value("votes_2010", self.row, self.party)
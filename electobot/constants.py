@@ -12,19 +12,36 @@ import math
 import logging
 import os
 
-# Party names
-CON = "Conservative"
-LAB = "Labour"
-LD = "Lib-Dem"
-SNP = "SNP"
-PC = "PC"
-GRN = "Green"
-BNP = "BNP"
-UKP = "UKIP"
-OTH = "Other"
-
-# List of all party names
-PARTY_NAMES = [CON, LAB, LD, SNP, PC, GRN, BNP, UKP, OTH]
+# Parties.  Internally each party is identified by a small integer code, which
+# is also its fixed position in any per-party array.  Party names are only used
+# when reading input and reporting results.
+CON = 0
+LAB = 1
+LD = 2
+SNP = 3
+PC = 4
+GRN = 5
+BNP = 6
+UKP = 7
+OTH = 8
+
+# List of all party codes, in order
+PARTIES = [CON, LAB, LD, SNP, PC, GRN, BNP, UKP, OTH]
+NUM_OF_PARTIES = len(PARTIES)
+
+# Name of each party, indexed by party code
+PARTY_NAMES = ["Conservative",
+               "Labour",
+               "Lib-Dem",
+               "SNP",
+               "PC",
+               "Green",
+               "BNP",
+               "UKIP",
+               "Other"]
+
+# Code of each party, keyed by name
+PARTY_CODES = dict((name, party) for party, name in enumerate(PARTY_NAMES))
 
 # Colours to represent each party, in matplotlib colour identifiers
 PARTY_COLOURS = {CON: "b",
@@ -58,11 +75,85 @@ RESULT_TOLERANCE = 0.03 # In percentage points divided by 100
 SUPPORT_VARIATION = 0.005 # Also in percentage points
 SWING_SCALE_FACTOR = 70.0 # Scale the amount of variance in vote numbers by this
 
+# Simulation engines.  The NumPy engine needs numpy installed.
+PYTHON_ENGINE = "python"
+NUMPY_ENGINE = "numpy"
+ENGINES = [PYTHON_ENGINE, NUMPY_ENGINE]
+
+# Number of elections each engine simulates in one go during a Monte Carlo run.
+# Each block gets its own random number stream, so a seeded run only repeats
+# exactly with the same block size.  Memory use grows with this.
+BLOCK_SIZES = {PYTHON_ENGINE: 1, NUMPY_ENGINE: 100}
+
+# Ways of sampling the elections in a Monte Carlo run.  "random" draws all the
+# random variation independently.  "antithetic" runs blocks of elections in
+# pairs, the second block of each pair mirroring all the random variation of the
+# first.  "halton" spreads the support figures evenly over their range with a
+# randomly shifted Halton sequence, and mirrors the noise in the votes in pairs
+# of blocks as for "antithetic".
+SAMPLING_RANDOM = "random"
+SAMPLING_ANTITHETIC = "antithetic"
+SAMPLING_HALTON = "halton"
+SAMPLING_STRATEGIES = [SAMPLING_RANDOM, SAMPLING_ANTITHETIC, SAMPLING_HALTON]
+
+# Prime bases for the Halton sequence, one for each party in PARTIES.
+HALTON_BASES = [2, 3, 5, 7, 11, 13, 17, 19, 23]
+
+# Importance sampling.  A Monte Carlo run can be aimed at a rare outcome, a
+# party winning a given seat or at least a given number of seats nationally, by
+# tilting the random variation towards it and weighting each result to make up
+# for that.  The party's support modifiers are tilted exponentially at this rate
+# (per SUPPORT_VARIATION), and the noise in its votes in the seat is shifted by
+# this many standard deviations - or, for a national target, in every seat by
+# the smaller amount, so that the weights don't get too spread out.
+IMPORTANCE_SUPPORT_TILT = 0.5
+IMPORTANCE_NOISE_TILT = 1.0
+IMPORTANCE_NATIONAL_NOISE_TILT = 0.05
+
+# Adaptive proposals.  A Monte Carlo run can tilt every party's support
+# modifiers in the same way as importance sampling does, towards the ones that
+# have given acceptable elections so far, so that fewer elections are thrown
+# away as too divergent.  The first this many elections of a run aren't
+# tilted, and the tilts are fitted to the acceptable ones among them.  No tilt
+# is steeper than this (per SUPPORT_VARIATION), so that no weight gets too big.
+ADAPTIVE_PILOT_SIZES = {PYTHON_ENGINE: 50, NUMPY_ENGINE: 2000}
+ADAPTIVE_MAX_TILT = 2.0
+
+# When stopping a Monte Carlo run early on confidence interval width, the fewest
+# results to accept before stopping, and the most to run if the intervals never
+# get narrow enough.
+CI_MIN_RESULTS = 100
+CI_MAX_ITERATIONS = 100000
+
+# Distributed Monte Carlo runs.  The coordinator hands out this many blocks of
+# elections at a time.
+DIST_BLOCKS_PER_TASK = 32
+
+# How often to save Monte Carlo progress to the checkpoint file, if there is
+# one (in seconds)
+CHECKPOINT_INTERVAL = 60
+
+# Flags in the compact result records that the NumPy engine passes between
+# processes
+RECORD_TOO_DIVERGENT = 1
+RECORD_GREENS_HOLD_BRIGHTON = 2
+
 # User agent to use when fetching historical poll data
 USER_AGENT_STR = "Electobot PollScrape http://github.com/ZsigE/electobot"
 
-# Results timeout.  Set this to None on very slow machines.
-RESULTS_TIMEOUT = 10
+# Monte Carlo processes send finished blocks back in batches, at most this
+# many seconds apart while they have more work queued up.
+RESULTS_BATCH_INTERVAL = 1
+
+# Monte Carlo processes send a heartbeat this often (in seconds), saying how
+# many blocks they've finished, so that a slow process can be told apart from
+# one that has hung.  We give up on one that has been busy with the same block
+# for WORKER_TIMEOUT seconds, which has to be longer than any block takes.
+HEARTBEAT_INTERVAL = 5
+WORKER_TIMEOUT = 120
+
+# How often (in seconds) to log the progress of a Monte Carlo run.
+PROGRESS_INTERVAL = 10
 
 # Logging
 LOGS_DIR = "logs"
@@ -11,16 +11,149 @@ Constituency data structure
 # Python imports
 import logging
 import random
+import array
 
 # Electobot imports
 import utils
 from constants import *
+from candidate import Candidate
     
 # Set up logging
 logger = logging.getLogger("electobot.constituency")    
     
+class ConstituencyTable(object):
+    """Column store of the fixed data about every constituency.  Each column
+    is a typed array with an entry per constituency, or for per-party columns a
+    run of NUM_OF_PARTIES entries (indexed by party code) per constituency.
+    
+    None of this changes while elections are simulated, so all the copies of
+    an Election share one table, and each Constituency is just a view onto its
+    row.
+    """
+    
+    # Per-party columns, and the type codes of their arrays.  The last four
+    # are worked out by Constituency.prepare_static_data().
+    party_columns = [("votes_2005", "l"),
+                     ("votes_2010", "l"),
+                     ("support_2005", "d"),
+                     ("support_2010", "d"),
+                     ("abs_swing_05_10", "d"),
+                     ("swing_lengths_05_10", "l")]
+    
+    def __init__(self):
+        """Constructor.  Start with no constituencies."""
+        
+        self.names = []
+        self.rows = {}
+        
+        # Regions are stored as indices into the list of their names, with -1
+        # for a constituency whose region isn't known.
+        self.regions = []
+        self.region_codes = array.array("h")
+        self.turnout_2005 = array.array("d")
+        self.turnout_2010 = array.array("d")
+        for column, typecode in self.party_columns:
+            setattr(self, column, array.array(typecode))
+        
+        # The name of each party's 2010 candidate in each constituency, or
+        # None if it didn't stand.
+        self.candidate_names = []
+        
+        return
+    
+    def __deepcopy__(self, memo):
+        """Don't copy the table, so that copies of an election share it."""
+        
+        return self
+    
+    def add_row(self, name):
+        """Return the row for the named constituency, adding an empty one if
+        there isn't one yet.
+        """
+        
+        if name in self.rows:
+            return self.rows[name]
+        
+        row = len(self.names)
+        self.names.append(name)
+        self.rows[name] = row
+        self.region_codes.append(-1)
+        self.turnout_2005.append(0.0)
+        self.turnout_2010.append(0.0)
+        for column, typecode in self.party_columns:
+            getattr(self, column).extend([0] * NUM_OF_PARTIES)
+        self.candidate_names.append([None] * NUM_OF_PARTIES)
+        
+        return row
+    
+    def get_region(self, row):
+        """Return the name of a constituency's region."""
+        
+        code = self.region_codes[row]
+        if code < 0:
+            return None
+        
+        return self.regions[code]
+    
+    def set_region(self, row, region):
+        """Set the name of a constituency's region."""
+        
+        if region not in self.regions:
+            self.regions.append(region)
+        self.region_codes[row] = self.regions.index(region)
+        
+        return
+    
+    def get_party_values(self, column, row):
+        """Return a constituency's entries in a per-party column as a
+        dictionary keyed on party.
+        """
+        
+        start = row * NUM_OF_PARTIES
+        
+        return dict(zip(PARTIES,
+                        getattr(self, column)[start:start + NUM_OF_PARTIES]))
+    
+    def get_party_row(self, column, row):
+        """Return a constituency's entries in a per-party column as an array
+        indexed by party code.
+        """
+        
+        start = row * NUM_OF_PARTIES
+        
+        return getattr(self, column)[start:start + NUM_OF_PARTIES]
+    
+    def get_party_value(self, column, row, party):
+        """Return one party's entry for a constituency in a per-party
+        column.
+        """
+        
+        return getattr(self, column)[(row * NUM_OF_PARTIES) + party]
+    
+    def set_party_values(self, column, row, values):
+        """Set a constituency's entries in a per-party column from a
+        dictionary keyed on party.  Parties missing from it get zero.
+        """
+        
+        start = row * NUM_OF_PARTIES
+        column = getattr(self, column)
+        for party in PARTIES:
+            column[start + party] = values.get(party, 0)
+            
+        return
+    
 class Constituency(object):
-    """Represents an entire constituency."""
+    """Represents an entire constituency.  The fixed data about it lives in a
+    row of its election's ConstituencyTable; only the data for the election
+    being simulated is kept here.
+    """
+    
+    __slots__ = ["name",
+                 "election",
+                 "row",
+                 "sim_votes",
+                 "winning_party",
+                 "change"]
     
     def __init__(self, name, parent_election):
         """Constructor."""
@@ -28,12 +161,15 @@ class Constituency(object):
         # Constant data
         self.name = name
         self.election = parent_election
-        self.candidates_2010 = {}
-        self.votes_2010 = {}
-        self.votes_2005 = {}
-        self.turnout_2005 = 0.0
-        self.turnout_2010 = 0.0
-        self.region = None
+        self.row = parent_election.table.add_row(name)
+        
+        # Data that we'll use in and get out of the simulation
+        self.reset()
+        
+        return
+    
+    def reset(self):
+        """Clear out the data from the last simulated election."""
         
         # Data that we'll use in the simulation
         self.sim_votes = {}
@@ -44,21 +180,131 @@ class Constituency(object):
         
         return
     
-    def predict_votes(self, predicted_support, use_regional=False):
-        """Make a prediction of the vote distribution in this constituency."""
+    # Views onto the constant data in the table.  The per-party data comes
+    # back as a new dictionary each time, so assign to the view to change it.
+    @property
+    def table(self):
+        return self.election.table
+    
+    @property
+    def region(self):
+        return self.table.get_region(self.row)
+    
+    @region.setter
+    def region(self, region):
+        self.table.set_region(self.row, region)
+    
+    @property
+    def turnout_2005(self):
+        return self.table.turnout_2005[self.row]
+    
+    @turnout_2005.setter
+    def turnout_2005(self, turnout):
+        self.table.turnout_2005[self.row] = turnout
+    
+    @property
+    def turnout_2010(self):
+        return self.table.turnout_2010[self.row]
+    
+    @turnout_2010.setter
+    def turnout_2010(self, turnout):
+        self.table.turnout_2010[self.row] = turnout
+    
+    @property
+    def votes_2005(self):
+        return self.table.get_party_values("votes_2005", self.row)
+    
+    @votes_2005.setter
+    def votes_2005(self, votes):
+        self.table.set_party_values("votes_2005", self.row, votes)
+    
+    @property
+    def votes_2010(self):
+        return self.table.get_party_values("votes_2010", self.row)
+    
+    @votes_2010.setter
+    def votes_2010(self, votes):
+        self.table.set_party_values("votes_2010", self.row, votes)
+    
+    @property
+    def support_2005(self):
+        return self.table.get_party_values("support_2005", self.row)
+    
+    @property
+    def support_2010(self):
+        return self.table.get_party_values("support_2010", self.row)
+    
+    @property
+    def abs_swing_05_10(self):
+        return self.table.get_party_values("abs_swing_05_10", self.row)
+    
+    @property
+    def swing_lengths_05_10(self):
+        return self.table.get_party_values("swing_lengths_05_10", self.row)
+    
+    @property
+    def candidates_2010(self):
+        return [Candidate(self.table, self.row, party) for party in
+                PARTIES]
+    
+    def set_candidate_names(self, names):
+        """Set the names of the 2010 candidates from a dictionary keyed on
+        party.
+        """
+        
+        self.table.candidate_names[self.row] = [names.get(party) for party in
+                                                PARTIES]
+        
+        return
+    
+    def party_votes_2010(self, party):
+        """Return the number of votes one party got here in 2010."""
+        
+        return self.table.get_party_value("votes_2010", self.row, party)
+    
+    def prepare_static_data(self):
+        """Work out everything that depends only on the 2005 and 2010 votes, so
+        that it isn't recalculated for every simulated election.
+        """
         
-        logger.debug("Predicting votes in {0}".format(self.name))
-        # First, calculate the support each party had in the 2005 and 2010
-        # elections.
+        # Calculate the support each party had in the 2005 and 2010 elections.
         support_2005 = utils.calculate_support(self.votes_2005)
         support_2010 = utils.calculate_support(self.votes_2010)
+        self.table.set_party_values("support_2005", self.row, support_2005)
+        self.table.set_party_values("support_2010", self.row, support_2010)
         
-        # Calculate the swing matrix between those two elections.
+        # Calculate the swing matrix between those two elections.  Only the
+        # size of each party's row is used in the simulation, so just keep
+        # that.
         swing_05_10 = utils.calculate_swing(support_2005, support_2010)
+        abs_swing_05_10 = {}
+        swing_lengths_05_10 = {}
+        for party in swing_05_10:
+            abs_swing_05_10[party] = sum([abs(swing) for swing in
+                                          swing_05_10[party].values()])
+            swing_lengths_05_10[party] = len(swing_05_10[party])
+        self.table.set_party_values("abs_swing_05_10",
+                                    self.row,
+                                    abs_swing_05_10)
+        self.table.set_party_values("swing_lengths_05_10",
+                                    self.row,
+                                    swing_lengths_05_10)
+        
+        return
+    
+    def predict_votes(self, predicted_support, use_regional=False, rng=random):
+        """Make a prediction of the vote distribution in this constituency,
+        using the given random number generator.
+        """
         
-        # Now compare the 2010 support to the new national support dictionary  
-        # and calculate a swing matrix for that too.
-        swing_matrix = utils.calculate_swing(support_2010, predicted_support)
+        trace = utils.tracing(logger, self.name)
+        if trace:
+            logger.debug("Predicting votes in {0}".format(self.name))
+        
+        # Compare the 2010 support to the new national support dictionary and
+        # calculate a swing matrix.
+        swing_matrix = utils.calculate_swing(self.support_2010,
+                                             predicted_support)
           
         if use_regional:
             # Extract the swing between the 2010 results for this region and the
@@ -69,8 +315,14 @@ class Constituency(object):
             # national prediction from the parent election.
             general_swing = self.election.swing_matrix
         
+        # Fetch the 2010 votes and past swings once, indexed by party code.
+        votes_2010 = self.table.get_party_row("votes_2010", self.row)
+        abs_swing_05_10 = self.table.get_party_row("abs_swing_05_10", self.row)
+        swing_lengths_05_10 = self.table.get_party_row("swing_lengths_05_10",
+                                                       self.row)
+        
         # Calculate the total number of votes in this constituency in 2010.
-        total_votes_2010 = sum(self.votes_2010.values())
+        total_votes_2010 = sum(votes_2010)
         
         # Now we have to parcel those votes out.  Give each party the amount
         # they got last time, modified by the total national swing towards that
@@ -78,24 +330,29 @@ class Constituency(object):
         for party in swing_matrix.keys():
             vote_diff = int(sum(general_swing[party].values()) *
                             total_votes_2010)
-            logger.debug("{0} vote changes by {1}".format(party, vote_diff))
-            self.sim_votes[party] = self.votes_2010[party] + vote_diff
+            if trace:
+                logger.debug("{0} vote changes by {1}".format(
+                                                             PARTY_NAMES[party],
+                                                             vote_diff))
+            self.sim_votes[party] = votes_2010[party] + vote_diff
             if self.sim_votes[party] < 0:
                 # Support dropped the number of votes below zero.  Fix that.
-                logger.debug("{0} went below zero ({1})".
-                                           format(party, self.sim_votes[party]))
+                if trace:
+                    logger.debug("{0} went below zero ({1})".
+                                           format(PARTY_NAMES[party],
+                                                  self.sim_votes[party]))
                 self.sim_votes[party] = 0
             
         # We now have the mean number of votes we expect each party to receive.
         # Use a normal distribution to select an actual number of votes, with
         # the variance of the distribution scaled to the amount of swing each
         # party generally experiences (as a swingier party is less predictable.)
+        noise_tilt = self.election.noise_tilt.get(self.name, {})
         for party in swing_matrix.keys():
             mean_absolute_swing = ((sum([abs(swing) for swing in
                                         swing_matrix[party].values()]) +
-                                    sum([abs(swing) for swing in
-                                        swing_05_10[party].values()])) /
-                                   (len(swing_05_10[party]) +
+                                    abs_swing_05_10[party]) /
+                                   (swing_lengths_05_10[party] +
                                     len(swing_matrix[party])))
             
             # Normal distributions have about 95% of their values within 2
@@ -107,20 +364,32 @@ class Constituency(object):
             # Apply a scaling factor for tuning.
             stdev = stdev * SWING_SCALE_FACTOR
             
-            # Calculate the tweaked number of votes.
-            self.sim_votes[party] = int(random.normalvariate(
+            # Calculate the tweaked number of votes.  When importance sampling,
+            # the distribution may be shifted, and the election's weight has
+            # to make up for that.
+            shift = noise_tilt.get(party, 0.0) * stdev
+            votes = rng.normalvariate(self.sim_votes[party] + shift, stdev)
+            if shift != 0:
+                self.election.log_weight += utils.normal_tilt_log_weight(
+                                                          votes,
                                                           self.sim_votes[party],
-                                                          stdev))
-            logger.debug("{0} votes in 2010: {1}. Predicted: {2}.".format(party,
-                                                         self.votes_2010[party],
+                                                          stdev,
+                                                          noise_tilt[party])
+            self.sim_votes[party] = int(votes)
+            if trace:
+                logger.debug("{0} votes in 2010: {1}. Predicted: {2}.".
+                                                  format(PARTY_NAMES[party],
+                                                         votes_2010[party],
                                                          self.sim_votes[party]))
 
         return
     
-    def simulate(self):
+    def simulate(self, rng=random):
         """Simulate the result of the election in this constituency."""
         
-        logger.debug("Simulate election in {0}".format(self.name))
+        trace = utils.tracing(logger, self.name)
+        if trace:
+            logger.debug("Simulate election in {0}".format(self.name))
         max_votes = 0
         
         for party in self.sim_votes:
@@ -128,17 +397,18 @@ class Constituency(object):
                 # Two parties have exactly the same vote.  This is highly
                 # unusual, but is legally handled by drawing lots.  Simulate
                 # that here.
-                if random.randrange(2) == 0:
+                if rng.randrange(2) == 0:
                     max_votes = self.sim_votes[party]
                     self.winning_party = party
             elif self.sim_votes[party] > max_votes:
                 max_votes = self.sim_votes[party]
                 self.winning_party = party
                 
-        logger.debug("Winner of {0} is {1} with {2} votes".
-                                                      format(self.name,
-                                                             self.winning_party,
-                                                             max_votes))
+        if trace:
+            logger.debug("Winner of {0} is {1} with {2} votes".format(
+                                               self.name,
+                                               PARTY_NAMES[self.winning_party],
+                                               max_votes))
                 
         return
     
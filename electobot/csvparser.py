@@ -14,6 +14,7 @@ import logging
 
 # Electobot imports
 from electobot.constants import *
+import electobot.utils as utils
 
 # Set up logging
 logger = logging.getLogger("electobot.csvparser")
@@ -90,6 +91,7 @@ class DataRow(dict):
         else:
             assert False, "Invalid year requested for votes: {0}".format(year)
             
+        trace = utils.tracing(logger, self["Seat"])
         for party in cell_key.keys():
             numvotes = self[cell_key[party]]
             if numvotes is not None:
@@ -97,13 +99,15 @@ class DataRow(dict):
             else:
                 numvotes = 0
             
-            logging.debug("{0}: {1} got {2} votes".format(self["Seat"],
-                                                          party,
-                                                          numvotes))
+            if trace:
+                logger.debug("{0}: {1} got {2} votes".format(self["Seat"],
+                                                             PARTY_NAMES[party],
+                                                             numvotes))
             votes[party] = numvotes
         
         # Calculate the number of votes for unlisted parties.
-        logger.debug("Total votes: {0}".format(total_votes))  
+        if trace:
+            logger.debug("Total votes: {0}".format(total_votes))
         votes[OTH] = total_votes - sum(votes.values())
             
         return votes
@@ -0,0 +1,412 @@
+#!/usr/bin/python
+"""
+Electobot
+by Philip Brien (http://github.com/ZsigE)
+
+Analysis and prediction tool based on the 2010 UK General Election results
+
+Distributed Monte Carlo simulation over TCP
+"""
+
+# Python imports
+import logging
+import math
+import threading
+import Queue
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+# Electobot imports
+from electobot.constants import *
+import montecarlo
+import samplers
+import utils
+
+# Set up logging
+logger = logging.getLogger("electobot.distributed")
+
+# Classes
+class Coordinator(object):
+    """Runs a Monte Carlo simulation by handing out ranges of blocks of
+    elections to workers that connect over TCP, and merging the partial
+    results they send back.  Workers can join or leave at any time.
+    """
+    
+    def __init__(self,
+                 election,
+                 address,
+                 authkey,
+                 engine=PYTHON_ENGINE,
+                 block_size=None,
+                 seed=None,
+                 blocks_per_task=DIST_BLOCKS_PER_TASK,
+                 sampling=SAMPLING_RANDOM,
+                 importance=None,
+                 adaptive=False):
+        """Constructor.  Call start() to start listening for workers.  Set
+        'adaptive' to use an adaptive proposal (see
+        montecarlo.MonteCarloPool).
+        """
+        
+        self.election = election
+        self.address = address
+        self.authkey = authkey
+        self.engine = engine
+        if block_size is None:
+            block_size = BLOCK_SIZES[engine]
+        self.block_size = block_size
+        self.seed = montecarlo.choose_seed(seed)
+        self.sampling = sampling
+        self.importance = importance
+        self.adaptive = adaptive
+        self.blocks_per_task = blocks_per_task
+        
+        # With an adaptive proposal, the number of pilot tasks to merge before
+        # fitting it.  The pilot elections are rounded up to whole tasks.
+        self.pilot_tasks = 0
+        if adaptive:
+            self.pilot_tasks = int(math.ceil(
+                                      float(ADAPTIVE_PILOT_SIZES[engine]) /
+                                      (self.block_size * blocks_per_task)))
+        
+        # Each worker has a thread of its own, which takes tasks from one
+        # queue and puts the partial results on another.
+        self.tasks = Queue.Queue()
+        self.results = Queue.Queue()
+        self.num_of_workers = 0
+        self.threads = []
+        self.lock = threading.Lock()
+        self.listener = None
+        self.run_id = 0
+        
+        return
+    
+    def start(self):
+        """Start listening for workers."""
+        
+        self.listener = Listener(self.address, authkey=self.authkey)
+        logger.info("Waiting for workers on {0}:{1}".format(*self.address))
+        thread = threading.Thread(target=self.accept_workers)
+        thread.daemon = True
+        thread.start()
+        
+        return
+    
+    def accept_workers(self):
+        """Accept workers as they connect, and give each one a thread."""
+        
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (EOFError, IOError, AuthenticationError):
+                # Either a bad connection attempt or we've been closed.  Only
+                # the first is worth carrying on for.
+                if self.listener is None:
+                    break
+                logger.warning("Worker failed to connect")
+                continue
+            
+            thread = threading.Thread(target=self.serve_worker, args=(conn,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+            
+        return
+    
+    def serve_worker(self, conn):
+        """Send tasks to one worker and pass on its results until told to stop
+        by a None, or until the worker goes away.
+        """
+        
+        # Tell the worker how to simulate, so that it gives the same results
+        # as any other worker.
+        conn.send((self.engine,
+                   self.block_size,
+                   self.seed,
+                   self.sampling,
+                   self.importance,
+                   self.adaptive))
+        with self.lock:
+            self.num_of_workers += 1
+        logger.info("Worker connected ({0} in total)".format(
+                                                           self.num_of_workers))
+        
+        try:
+            for task in iter(self.tasks.get, None):
+                try:
+                    conn.send(task)
+                    partial = conn.recv()
+                except (EOFError, IOError):
+                    # The worker has gone away, so someone else will have to
+                    # do this task.
+                    logger.warning("Lost a worker")
+                    self.tasks.put(task)
+                    return
+                self.results.put((task[0], task[1], partial))
+            conn.send(None)
+        finally:
+            with self.lock:
+                self.num_of_workers -= 1
+            conn.close()
+        
+        return
+    
+    def run(self,
+            iterations,
+            predicted_support=None,
+            regional_support=None,
+            ci_width=None):
+        """Run a Monte Carlo simulation of at least the given number of
+        acceptable elections, or until the confidence intervals are narrower
+        than ci_width if that is given, and return its MonteCarloResult.  The
+        support figures default to those of the coordinator's election.
+        
+        Workers send back totals for a whole task at a time.  A task that
+        would take us past the number of elections asked for is run again,
+        keeping only as many as are still needed, so the result is made up of
+        the same elections as a local run with the same seed.
+        
+        With an adaptive proposal, no more tasks are handed out after the
+        pilot tasks until they have all been merged and the proposal has been
+        fitted to them.  The pilot is rounded up to whole tasks, so the result
+        isn't the same as that of a local run.
+        """
+        
+        if predicted_support is None:
+            predicted_support = self.election.predicted_support
+        if regional_support is None:
+            regional_support = self.election.regional_support
+        
+        # Results from any earlier run that are still on their way back are
+        # thrown away when they arrive.
+        self.run_id += 1
+        
+        # Partial results can come back in any order, so hold on to them until
+        # we can merge them in task order; that way the result doesn't depend
+        # on which worker did what.  Keep a couple of tasks queued up for each
+        # worker, but don't hand out more than we'll need if all the elections
+        # turn out to be acceptable.
+        mcresult = montecarlo.MonteCarloResult()
+        mcresult.engine = self.engine
+        mcresult.block_size = self.block_size
+        mcresult.sampling = self.sampling
+        mcresult.importance_target = self.importance
+        mcresult.adaptive = self.adaptive
+        pending = {}
+        next_task = 0
+        issued = 0
+        task_size = self.blocks_per_task * self.block_size
+        progress = montecarlo.ProgressReporter(iterations)
+        finished = False
+        while not finished:
+            max_outstanding = 2 * max(self.num_of_workers, 1)
+            while (issued - next_task < max_outstanding and
+                   (mcresult.num_of_results + (issued - next_task) * task_size <
+                                                               iterations) and
+                   not self.waiting_for_proposal(issued, mcresult)):
+                # The next task to be merged knows exactly how many more
+                # elections we need, so it can stop there.
+                limit = None
+                if issued == next_task:
+                    limit = iterations - mcresult.num_of_results
+                self.tasks.put((self.run_id,
+                                issued,
+                                issued * self.blocks_per_task,
+                                self.blocks_per_task,
+                                limit,
+                                predicted_support,
+                                regional_support,
+                                self.task_tilts(issued, mcresult)))
+                issued += 1
+            
+            # Lost workers are noticed by their threads, and their tasks passed
+            # on, so there's no limit on how long we wait; just keep the user
+            # informed.
+            try:
+                run_id, task_num, partial = self.results.get(
+                                                       block=True,
+                                                       timeout=PROGRESS_INTERVAL)
+            except Queue.Empty:
+                logger.info("Waiting for results from {0} workers".format(
+                                                           self.num_of_workers))
+                continue
+            if run_id != self.run_id:
+                continue
+            
+            pending[task_num] = partial
+            while next_task in pending and not finished:
+                partial = pending.pop(next_task)
+                if (mcresult.num_of_results + partial.num_of_results >
+                                                                   iterations):
+                    # This task takes us past what we asked for, so none of
+                    # the later ones are needed.  Run it again, stopping once
+                    # we have enough.
+                    self.discard_tasks()
+                    self.tasks.put((self.run_id,
+                                    next_task,
+                                    next_task * self.blocks_per_task,
+                                    self.blocks_per_task,
+                                    iterations - mcresult.num_of_results,
+                                    predicted_support,
+                                    regional_support,
+                                    self.task_tilts(next_task, mcresult)))
+                    break
+                mcresult.merge(partial)
+                next_task += 1
+                if self.adaptive and next_task == self.pilot_tasks:
+                    mcresult.proposal_tilts = samplers.fit_tilts(
+                                                    mcresult.modifiers,
+                                                    predicted_support.keys())
+                    logger.info("Adaptive proposal tilts: {0}".format(
+                                  utils.by_party_name(mcresult.proposal_tilts)))
+                progress.update(mcresult.num_of_results,
+                                mcresult.num_of_rejected)
+                
+                # Stop when we've got all the results we asked for, or when
+                # the confidence intervals are narrow enough.
+                finished = (mcresult.num_of_results >= iterations)
+                if (ci_width is not None and
+                    mcresult.num_of_results >= CI_MIN_RESULTS and
+                    mcresult.ci_width() < ci_width):
+                    logger.info("Confidence intervals narrower than {0} after "
+                                "{1} results".format(ci_width,
+                                                     mcresult.num_of_results))
+                    finished = True
+        
+        self.discard_tasks()
+        
+        logger.info("{0} results discarded for unacceptable divergence "
+                    "(acceptance rate {1:.1f}%)".format(
+                                           mcresult.num_of_rejected,
+                                           mcresult.acceptance_rate() * 100))
+        mcresult.calculate_statistics()
+        
+        return mcresult
+    
+    def task_tilts(self, task_num, mcresult):
+        """Return the tilts for an adaptive proposal that a task should use:
+        None without an adaptive proposal or if they haven't been fitted yet,
+        and no tilts at all for the pilot tasks.
+        """
+        
+        if not self.adaptive:
+            return None
+        elif task_num < self.pilot_tasks:
+            return {}
+        
+        return mcresult.proposal_tilts
+    
+    def waiting_for_proposal(self, task_num, mcresult):
+        """Return whether a task has to wait for the adaptive proposal to be
+        fitted before it can be handed out.
+        """
+        
+        return self.adaptive and self.task_tilts(task_num, mcresult) is None
+    
+    def discard_tasks(self):
+        """Throw away any tasks that haven't been started."""
+        
+        try:
+            while True:
+                self.tasks.get(block=False)
+        except Queue.Empty:
+            pass
+        
+        return
+    
+    def close(self):
+        """Stop listening for new workers, then tell the ones we have to stop
+        once they've finished what they're doing, and wait for them.
+        """
+        
+        listener = self.listener
+        self.listener = None
+        listener.close()
+        for thread in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+            
+        return
+
+# Functions
+def parse_address(address):
+    """Convert a HOST:PORT string into an address tuple."""
+    
+    host, port = address.rsplit(":", 1)
+    
+    return (host, int(port))
+
+def run_worker(election, address, authkey):
+    """Connect to a coordinator and run the tasks it hands out, using all the
+    cores on this machine, until told to stop.
+    """
+    
+    conn = Client(address, authkey=authkey)
+    engine, block_size, seed, sampling, importance, adaptive = conn.recv()
+    logger.info("Connected to coordinator at {0}:{1}".format(*address))
+    
+    pool = montecarlo.MonteCarloPool(election,
+                                     engine,
+                                     block_size,
+                                     seed,
+                                     sampling=sampling,
+                                     importance=importance,
+                                     adaptive=adaptive)
+    pool.start()
+    try:
+        for task in iter(conn.recv, None):
+            (run_id, task_num, first_block, num_of_blocks, limit,
+             predicted_support, regional_support, tilts) = task
+            logger.info("Running blocks {0} to {1}".format(
+                                            first_block,
+                                            first_block + num_of_blocks - 1))
+            job = montecarlo.MonteCarloJob(limit,
+                                           predicted_support,
+                                           regional_support,
+                                           first_block=first_block,
+                                           num_of_blocks=num_of_blocks,
+                                           proposal_tilts=tilts)
+            for job in pool.run_jobs([job]):
+                pass
+            conn.send(job.result)
+        pool.close()
+    finally:
+        # Make sure we kill all the processes if we're interrupted.
+        pool.terminate()
+        conn.close()
+    
+    return
+
+def run_distributed_montecarlo(election,
+                               iterations,
+                               address,
+                               authkey,
+                               engine=PYTHON_ENGINE,
+                               block_size=None,
+                               seed=None,
+                               ci_width=None,
+                               sampling=SAMPLING_RANDOM,
+                               importance=None,
+                               adaptive=False):
+    """Run a Monte Carlo simulation on whichever workers connect to the given
+    address.  Runs with the same seed, engine and block size give exactly the
+    same results, however many workers share the work.
+    """
+    
+    coordinator = Coordinator(election,
+                              address,
+                              authkey,
+                              engine,
+                              block_size,
+                              seed,
+                              sampling=sampling,
+                              importance=importance,
+                              adaptive=adaptive)
+    coordinator.start()
+    try:
+        mcresult = coordinator.run(iterations, ci_width=ci_width)
+    finally:
+        coordinator.close()
+    
+    return mcresult
@@ -11,15 +11,15 @@ Election structure
 # Python imports
 import os
 import logging
-from operator import attrgetter
+import random
+from operator import itemgetter
 import copy
 
 # Electobot imports
 import electobot.csvparser as csvparser
 import electobot.utils as utils
 from electobot.constants import *
-from electobot.candidate import Candidate
-from electobot.constituency import Constituency
+from electobot.constituency import Constituency, ConstituencyTable
 
 # Set up logging
 logger = logging.getLogger("electobot.election")
@@ -31,18 +31,54 @@ class Election(object):
     def __init__(self):
         """Constructor."""
         
-        # Data used to run the election
+        # Data used to run the election.  The fixed data about each
+        # constituency is kept in the table, which copies of this election
+        # share.
+        self.table = ConstituencyTable()
         self.constituencies = {}
         self.predicted_support = {}
         self.regional_support = {}
         
-        # Data generated by running the election
+        # Shifts to the noise in the votes, in standard deviations, keyed on
+        # constituency and then party, for importance sampling.  The log of
+        # the importance weight that makes up for them (and for any tilt to the
+        # predicted support) is added up in log_weight.
+        self.noise_tilt = {}
+        self.log_weight = 0.0
+        
+        # Totals from the 2010 data, worked out by prepare_base_data()
+        self.support_2010 = {}
+        self.regional_votes_2010 = {}
+        
+        # Data generated by running the election.  This, the result and the
+        # log_weight are all that running an election changes; see reset().
         self.parties = {}
         self.swing_matrix = {}
+        self.regional_swing = {}
         
         # Data generated by analyzing the results
         self.result = None
         
+        # Array form of the election data, built when the NumPy engine is
+        # first used.
+        self.vectorized = None
+        
+        return
+    
+    def reset(self):
+        """Clear out everything left over from the last run of this election,
+        so that it can be run again without taking a fresh copy of it.  The
+        Result of the last run is left untouched for whoever holds it.
+        """
+        
+        for const in self.constituencies.itervalues():
+            const.reset()
+        self.parties = {}
+        self.swing_matrix = {}
+        self.regional_swing = {}
+        self.log_weight = 0.0
+        self.result = None
+        
         return
         
     def populate_from_csv(self, csv_filename=HARVARD_CSV):
@@ -54,28 +90,21 @@ class Election(object):
            
         for row in rows:
             const = row["Seat"]
-            logger.debug("Found seat {0}".format(const))
+            if utils.tracing(logger, const):
+                logger.debug("Found seat {0}".format(const))
             if const not in self.constituencies:
                 c = Constituency(const, self)
                 self.constituencies[const] = c
             else:
                 c = self.constituencies[const]
             c.region = row["Region"]
-            candidates_2010 = row.candidates()
+            c.set_candidate_names(row.candidates())
             c.votes_2005 = row.votes(2005)
             c.votes_2010 = row.votes(2010)
             c.turnout_2005 = float(row["Turn05"])
             c.turnout_2010 = float(row["Turn10"])
-
-            # Copy the votes into the Candidate structures.
-            c.candidates_2010 = []
-            for party in c.votes_2010.keys():
-                if party in candidates_2010.keys():
-                    name = candidates_2010[party]
-                else:
-                    name = "Unknown"
-                candidate = Candidate(name, party, c.votes_2010[party])
-                c.candidates_2010.append(candidate)
+        
+        self.prepare_base_data()
                             
         return
     
@@ -88,11 +117,43 @@ class Election(object):
         
         for const_name in self.constituencies.keys():
             const = self.constituencies[const_name]
-            del const.votes_2010[OTH]
-            non_other_votes = sum(const.votes_2010.values())
-            const.votes_2010[OTH] = total_votes[const_name] - non_other_votes
+            votes_2010 = const.votes_2010
+            del votes_2010[OTH]
+            non_other_votes = sum(votes_2010.values())
+            votes_2010[OTH] = total_votes[const_name] - non_other_votes
+            const.votes_2010 = votes_2010
+        
+        self.prepare_base_data()
             
         return
+    
+    def prepare_base_data(self):
+        """Work out everything that depends only on the 2005 and 2010 data.
+        This must be called whenever that data changes.
+        """
+        
+        for const in self.constituencies.values():
+            const.prepare_static_data()
+        
+        # Total up the 2010 votes nationally and in each region.
+        self.support_2010 = self.calculate_overall_support(2010)
+        self.regional_votes_2010 = {}
+        for const in self.constituencies.values():
+            if const.region not in self.regional_votes_2010:
+                self.regional_votes_2010[const.region] = copy.copy(
+                                                               const.votes_2010)
+            else:
+                regional_votes = self.regional_votes_2010[const.region]
+                for party in const.votes_2010:
+                    if party not in regional_votes:
+                        regional_votes[party] = const.votes_2010[party]
+                    else:
+                        regional_votes[party] += const.votes_2010[party]
+            
+        # Any array form of the old data is now out of date.
+        self.vectorized = None
+        
+        return
 
     def prepare_predicted_support(self, support_dict):
         """Do some tidy-up work on the predicted support so we can use it."""
@@ -138,33 +199,20 @@ class Election(object):
                     
         return support
                 
-    def predict_votes(self):
+    def predict_votes(self, rng=random):
         """Predict the numbers of votes in each constituency."""
         
-        # Calculate the overall swing matrix.
+        # Calculate the overall swing matrix against the 2010 totals.
         logger.debug("Calculating national swing matrix")
-        support_2010 = self.calculate_overall_support(2010)
-        self.swing_matrix = utils.calculate_swing(support_2010,
+        self.swing_matrix = utils.calculate_swing(self.support_2010,
                                                   self.predicted_support)
         
         # Calculate the regional swing matrix as well.
-        regional_votes = {}
-        for const in self.constituencies.values():
-            if const.region not in regional_votes:
-                regional_votes[const.region] = copy.copy(const.votes_2010)
-            else:
-                for party in const.votes_2010:
-                    if party not in regional_votes[const.region]:
-                        regional_votes[const.region][party] = \
-                                                         const.votes_2010[party]
-                    else:
-                        regional_votes[const.region][party] += \
-                                                         const.votes_2010[party]
         self.regional_swing = {}
         for region in self.regional_support.keys():
             self.regional_swing[region] = utils.calculate_swing(
-                                                  regional_votes[region],
-                                                  self.regional_support[region])
+                                          self.regional_votes_2010[region],
+                                          self.regional_support[region])
         
         # Now use that to predict each constituency's vote distribution.
         for const_name in self.constituencies:
@@ -173,19 +221,20 @@ class Election(object):
                 # We have region-specific support information for this 
                 # constituency.  Predict based on that for greater accuracy.
                 const.predict_votes(self.regional_support[const.region],
-                                    use_regional=True)
+                                    use_regional=True,
+                                    rng=rng)
             else:
                 # No region-specific support, just use the national support.
-                const.predict_votes(self.predicted_support)
+                const.predict_votes(self.predicted_support, rng=rng)
             
         return
     
-    def simulate(self):
+    def simulate(self, rng=random):
         """Simulate the outcome of this election."""
         
         for const_name in self.constituencies:
             const = self.constituencies[const_name]
-            const.simulate()
+            const.simulate(rng)
             
             # Add the seat to the winning party's total.
             if const.winning_party in self.parties.keys():          
@@ -203,96 +252,16 @@ class Election(object):
         # Create a new Result structure to hold these results.
         self.result = Result()
         
-        # First determine the largest party.
-        party_list = sorted(self.parties.values(),
-                            key=attrgetter('seats'),
-                            reverse=True)
-        self.result.largest_party = party_list[0].name
-        self.result.most_seats_won = party_list[0].seats
-
         # Save off the numbers of seats gained by all parties.
         for party in self.parties:
             self.result.seats[party] = self.parties[party].seats
             
         # Record zero seats for any party that didn't get any.
-        for party in (set(PARTY_NAMES) - set(self.parties)):
+        for party in (set(PARTIES) - set(self.parties)):
             self.result.seats[party] = 0
-                
-        # Now determine whether the largest party is past or behind the winning
-        # line (and by how much).
-        self.result.margin_of_victory = (self.result.most_seats_won - 
-                                         NEEDED_FOR_MAJORITY)
-        if self.result.margin_of_victory >= 0:
-            self.result.summary = "{0} victory (majority {1})".format(
-                                                  self.result.largest_party,
-                                                  self.result.margin_of_victory)
-            self.result.winner = self.result.largest_party
-        else:
-            self.result.summary = "Hung Parliament ({0} needs {1})".format(
-                                            self.result.largest_party,
-                                            (0 - self.result.margin_of_victory))
-            
-            # Work out the coalitions that could conceivably take power.  The
-            # expected rules for this are as follows:
-            # - A coalition always has CON or LAB as the senior partner
-            # - Both CON and LAB will take LD as their preferred junior partner
-            # - Only CON will take UKP as a junior partner
-            # - Only LAB will take GRN as a junior partner
-            # - LD and GRN will not join a coalition that includes UKP
-            # - SNP will join neither a LAB nor a CON coalition
-            # - PC will join only a LAB coalition
-            # - OTH will join anyone
-            # - Both LAB and CON prefer named parties to OTH
-            if (self.result.seats[CON] + self.result.seats[LD] >=
-                NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("CON-LD")
-            elif (self.result.seats[CON] + self.result.seats[UKP] >=
-                  NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("CON-UKP")    
-            elif (self.result.seats[CON] + self.result.seats[LD] + 
-                  self.result.seats[OTH] >= NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("CON-LD-OTH")
-            elif (self.result.seats[CON] + self.result.seats[OTH] >=
-                  NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("CON-OTH")    
-            elif (self.result.seats[CON] + self.result.seats[UKP] + 
-                  self.result.seats[OTH] >= NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("CON-UKP-OTH")
-                
-            if (self.result.seats[LAB] + self.result.seats[LD] >=
-                NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("LAB-LD")
-            elif (self.result.seats[LAB] + self.result.seats[LD] + 
-                  self.result.seats[PC] >= NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("LAB-LD-PC")    
-            elif (self.result.seats[LAB] + self.result.seats[LD] + 
-                  self.result.seats[GRN] >= NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("LAB-LD-GRN")
-            elif (self.result.seats[LAB] + self.result.seats[LD] + 
-                  self.result.seats[GRN] + self.result.seats[PC] >= 
-                  NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("LAB-LD-PC-GRN")
-            elif (self.result.seats[LAB] + self.result.seats[PC] >=
-                  NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("LAB-PC")
-            elif (self.result.seats[LAB] + self.result.seats[LD] +
-                  self.result.seats[OTH] >= NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("LAB-LD-OTH")
-            elif (self.result.seats[LAB] + self.result.seats[LD] + 
-                  self.result.seats[PC] + self.result.seats[OTH] >= 
-                  NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("LAB-LD-PC-OTH")    
-            elif (self.result.seats[LAB] + self.result.seats[LD] + 
-                  self.result.seats[GRN] + self.result.seats[OTH] >= 
-                  NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("LAB-LD-GRN-OTH")
-            elif (self.result.seats[LAB] + self.result.seats[LD] + 
-                  self.result.seats[GRN] + self.result.seats[PC] + 
-                  self.result.seats[OTH] >= NEEDED_FOR_MAJORITY):
-                self.result.possible_coalitions.append("LAB-LD-PC-GRN-OTH")
-                
-            if len(self.result.possible_coalitions) == 0:
-                self.result.possible_coalitions = ["NONE"]
+        
+        # Work out the overall outcome from those seat numbers.
+        self.result.analyze_seats()
             
         # Which seats, if any, did UKIP/the Lib Dems win in this election?
         for const_name in self.constituencies:
@@ -309,15 +278,7 @@ class Election(object):
             self.result.greens_hold_brighton = False
             
         # Was the party with the most seats the popular vote winner?
-        votes = {}
-        for const_name in self.constituencies:
-            const = self.constituencies[const_name]
-            for party in const.sim_votes.keys():
-                if party not in votes.keys():
-                    votes[party] = const.sim_votes[party]
-                else:
-                    votes[party] += const.sim_votes[party]
-        
+        votes = self.total_votes()
         most_votes = 0
         self.result.most_votes_party = None
         for party in votes.keys():
@@ -333,7 +294,7 @@ class Election(object):
         # are the UKIP stealth targets, where they could win much more
         # easily than expected.
         no_ukips = [self.constituencies[cons] for cons in self.constituencies if 
-                    self.constituencies[cons].votes_2010[UKP] == 0]
+                    self.constituencies[cons].party_votes_2010(UKP) == 0]
         con_win_no_ukip = [cons for cons in no_ukips if 
                             cons.winning_party == CON]
         for cons in con_win_no_ukip:
@@ -351,14 +312,41 @@ class Election(object):
         # Was the vote distribution sufficiently close to the initial support
         # figures?
         overall_support = utils.calculate_support(votes)
-        support_2010 = self.calculate_overall_support(2010)
         self.result.support = overall_support
+        self.result.result_too_divergent = self.check_divergence(
+                                                                overall_support)
+        
+        return
+    
+    def total_votes(self):
+        """Add up the simulated votes for each party across the country."""
+        
+        votes = {}
+        for const_name in self.constituencies:
+            const = self.constituencies[const_name]
+            for party in const.sim_votes.keys():
+                if party not in votes.keys():
+                    votes[party] = const.sim_votes[party]
+                else:
+                    votes[party] += const.sim_votes[party]
+                    
+        return votes
+    
+    def check_divergence(self, overall_support):
+        """Return whether the overall support from the simulated votes is too
+        far from the predicted support for the result to stand.
+        """
+        
+        too_divergent = False
+        trace = utils.tracing(logger)
         for party in self.predicted_support:
             divergence = abs(self.predicted_support[party] - 
                              overall_support[party])
-            logger.debug("{0} support was {1}, predicted {2}, actual {3}, "
-                         "divergence {4}".format(party,
-                                                 support_2010[party],
+            if trace:
+                logger.debug("{0} support was {1}, predicted {2}, actual "
+                             "{3}, divergence {4}".format(
+                                                 PARTY_NAMES[party],
+                                                 self.support_2010[party],
                                                  self.predicted_support[party],
                                                  overall_support[party],
                                                  divergence))
@@ -366,26 +354,61 @@ class Election(object):
                 # This party's result is too far away from its predicted
                 # support.  This result can't stand.
                 logger.debug("Result too far from prediction!")
-                self.result.result_too_divergent = True
+                too_divergent = True
         
-        return
+        return too_divergent
+    
+    def vectorize(self):
+        """Return the array form of this election's data for the NumPy engine,
+        creating it if necessary.
+        """
+        
+        if self.vectorized is None:
+            # Import here so that numpy is only needed if it's actually used.
+            import electobot.vectorized as vectorized
+            self.vectorized = vectorized.VectorizedElection(self)
+            
+        return self.vectorized
     
-    def run(self):
-        """Run the whole election."""
+    def run(self, engine=PYTHON_ENGINE, rng=None, reject_divergent=False):
+        """Run the whole election, using the given simulation engine.  If a
+        random number generator is provided, it must be one from
+        utils.make_rng() for the same engine.
+        
+        If reject_divergent is set, a result that is too divergent to stand is
+        abandoned as soon as the votes are known, without working out who won
+        (Python engine only).
+        """
         
-        self.predict_votes()
-        self.simulate()
-        self.analyze()
+        if engine == NUMPY_ENGINE:
+            self.result = self.vectorize().run(self.predicted_support,
+                                               self.regional_support,
+                                               rng)
+        else:
+            assert engine == PYTHON_ENGINE, \
+                                  "Unknown simulation engine: {0}".format(engine)
+            if rng is None:
+                rng = random
+            self.predict_votes(rng)
+            if reject_divergent:
+                overall_support = utils.calculate_support(self.total_votes())
+                if self.check_divergence(overall_support):
+                    self.result = Result()
+                    self.result.support = overall_support
+                    self.result.result_too_divergent = True
+                    return
+            self.simulate(rng)
+            self.analyze()
         
         return
 
 class Party(object):
     """Political party.  Used to classify Candidates."""
     
-    def __init__(self, name):
-        """Constructor.  Store just the name."""
+    def __init__(self, code):
+        """Constructor.  Store just the party code."""
         
-        self.name = name
+        self.code = code
         self.seats = 0
         
         return
@@ -415,4 +438,101 @@ class Result(object):
         
         # Internal diagnostics
         self.support = None
-        self.result_too_divergent = False
\ No newline at end of file
+        self.result_too_divergent = False
+        
+        # How much this result counts for, when importance sampling, and the
+        # amounts its support figures were tweaked by, in party code order,
+        # when using an adaptive proposal
+        self.weight = 1
+        self.modifiers = None
+        
+        return
+
+    def analyze_seats(self):
+        """Work out the largest party, the margin of victory and any feasible
+        coalitions from the numbers of seats won by each party.
+        """
+        
+        # First determine the largest party.
+        party_list = sorted(self.seats.items(),
+                            key=itemgetter(1),
+                            reverse=True)
+        self.largest_party = party_list[0][0]
+        self.most_seats_won = party_list[0][1]
+        
+        # Now determine whether the largest party is past or behind the winning
+        # line (and by how much).
+        self.margin_of_victory = self.most_seats_won - NEEDED_FOR_MAJORITY
+        if self.margin_of_victory >= 0:
+            self.summary = "{0} victory (majority {1})".format(
+                                              PARTY_NAMES[self.largest_party],
+                                              self.margin_of_victory)
+            self.winner = self.largest_party
+        else:
+            self.summary = "Hung Parliament ({0} needs {1})".format(
+                                              PARTY_NAMES[self.largest_party],
+                                              (0 - self.margin_of_victory))
+            
+            # Work out the coalitions that could conceivably take power.  The
+            # expected rules for this are as follows:
+            # - A coalition always has CON or LAB as the senior partner
+            # - Both CON and LAB will take LD as their preferred junior partner
+            # - Only CON will take UKP as a junior partner
+            # - Only LAB will take GRN as a junior partner
+            # - LD and GRN will not join a coalition that includes UKP
+            # - SNP will join neither a LAB nor a CON coalition
+            # - PC will join only a LAB coalition
+            # - OTH will join anyone
+            # - Both LAB and CON prefer named parties to OTH
+            if (self.seats[CON] + self.seats[LD] >=
+                NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("CON-LD")
+            elif (self.seats[CON] + self.seats[UKP] >=
+                  NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("CON-UKP")    
+            elif (self.seats[CON] + self.seats[LD] + 
+                  self.seats[OTH] >= NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("CON-LD-OTH")
+            elif (self.seats[CON] + self.seats[OTH] >=
+                  NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("CON-OTH")    
+            elif (self.seats[CON] + self.seats[UKP] + 
+                  self.seats[OTH] >= NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("CON-UKP-OTH")
+                
+            if (self.seats[LAB] + self.seats[LD] >=
+                NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("LAB-LD")
+            elif (self.seats[LAB] + self.seats[LD] + 
+                  self.seats[PC] >= NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("LAB-LD-PC")    
+            elif (self.seats[LAB] + self.seats[LD] + 
+                  self.seats[GRN] >= NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("LAB-LD-GRN")
+            elif (self.seats[LAB] + self.seats[LD] + 
+                  self.seats[GRN] + self.seats[PC] >= 
+                  NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("LAB-LD-PC-GRN")
+            elif (self.seats[LAB] + self.seats[PC] >=
+                  NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("LAB-PC")
+            elif (self.seats[LAB] + self.seats[LD] +
+                  self.seats[OTH] >= NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("LAB-LD-OTH")
+            elif (self.seats[LAB] + self.seats[LD] + 
+                  self.seats[PC] + self.seats[OTH] >= 
+                  NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("LAB-LD-PC-OTH")    
+            elif (self.seats[LAB] + self.seats[LD] + 
+                  self.seats[GRN] + self.seats[OTH] >= 
+                  NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("LAB-LD-GRN-OTH")
+            elif (self.seats[LAB] + self.seats[LD] + 
+                  self.seats[GRN] + self.seats[PC] + 
+                  self.seats[OTH] >= NEEDED_FOR_MAJORITY):
+                self.possible_coalitions.append("LAB-LD-PC-GRN-OTH")
+                
+            if len(self.possible_coalitions) == 0:
+                self.possible_coalitions = ["NONE"]
+        
+        return
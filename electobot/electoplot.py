@@ -31,9 +31,10 @@ def create_pie_chart(results, filepath):
     
     # Convert the results dictionary into arrays for matplotlib.
     items = sorted(results.iteritems(), key=itemgetter(1), reverse=True)
-    partynames = [item[0] for item in items]
+    parties = [item[0] for item in items]
+    partynames = [PARTY_NAMES[party] for party in parties]
     numofseats = [item[1] for item in items]
-    colours = [PARTY_COLOURS[party] for party in partynames]
+    colours = [PARTY_COLOURS[party] for party in parties]
     
     # Generate the chart.
     plt.figure(figsize=(8, 8))
@@ -96,11 +97,11 @@ def create_line_range_chart(savedpolls,
     dates = [poll.date for poll in polls_to_chart]
     party_mean_seats = {}
     party_seat_error = {}
-    for party in PARTY_NAMES:
+    for party in PARTIES:
         party_mean_seats[party] = []
         party_seat_error[party] = []
     for poll in polls_to_chart:
-        for party in PARTY_NAMES:
+        for party in PARTIES:
             party_mean_seats[party].append(poll.result.mean_seats[party])
             
             # Error bars will be at +-2*standard deviation, as this gives us 95%
@@ -113,8 +114,8 @@ def create_line_range_chart(savedpolls,
     # Generate points with error bars for all parties.  Suppress the line, as
     # this is misleading or multiple polls from the same day, but add markers 
     # instead.
-    for party in PARTY_NAMES:
-        logger.debug("Adding line for {0}".format(party))
+    for party in PARTIES:
+        logger.debug("Adding line for {0}".format(PARTY_NAMES[party]))
         logger.debug("  Line colour: {0}".format(PARTY_COLOURS[party]))
         axes.errorbar(dates, 
                       party_mean_seats[party],
@@ -122,7 +123,7 @@ def create_line_range_chart(savedpolls,
                       color=PARTY_COLOURS[party],
                       linestyle="None",
                       marker=".",
-                      label=party)
+                      label=PARTY_NAMES[party])
      
     # Tweak the axis limits to ensure the y-axis starts at 0 and there's a gap
     # after the last results (scaled down for fewer results).
@@ -186,7 +187,9 @@ def create_poll_summary_barchart(mc_results, filepath):
     # Tweak the axes - the y-axis starts at 0, and the x-axis labels are the
     # party names.
     plt.ylim(ymin=0)
-    plt.xticks([num + 0.5 for num in x_indices], parties, size="x-small")
+    plt.xticks([num + 0.5 for num in x_indices],
+               [PARTY_NAMES[party] for party in parties],
+               size="x-small")
     plt.tick_params(bottom="off")
     
     # Add a credit line (remove this if you're forking the code, obviously)
@@ -9,16 +9,25 @@ Monte Carlo simulation tools
 """
 
 # Python imports
+import os
 import logging
+import math
 import copy
 import random
 import multiprocessing
+import threading
+import Queue
+import datetime
 import csv
+import time
+import gzip
+import cPickle as pickle
 from operator import itemgetter
 
 # Electobot imports
 from electobot.constants import *
 import utils
+import samplers
     
 # Set up logging
 logger = logging.getLogger("electobot.montecarlo")
@@ -27,14 +36,59 @@ logger = logging.getLogger("electobot.montecarlo")
 class MonteCarlo(object):
     """Monte Carlo simulation of multiple elections."""
     
-    def __init__(self, election, results_queue):
-        """Constructor, also prepares election structure for simulation."""
+    def __init__(self,
+                 election,
+                 tasks_queue,
+                 results_queue,
+                 engine=PYTHON_ENGINE,
+                 block_size=None,
+                 worker_id=0,
+                 sampling=SAMPLING_RANDOM,
+                 importance=None,
+                 adaptive=False):
+        """Constructor, also prepares election structure for simulation.  To
+        importance sample, give the target to aim for (see
+        samplers.target_seats()).
+        Set 'adaptive' if the tasks give tilts for an adaptive proposal (see
+        MonteCarloPool).
+        """
         
-        # Save off the results queue.
+        # Save off the queues, the engine to simulate with and how to sample
+        # the elections.
+        self.tasks = tasks_queue
         self.results = results_queue
+        self.worker_id = worker_id
+        self.engine = engine
+        self.sampling = sampling
+        self.importance = importance
+        self.adaptive = adaptive
+        if block_size is None:
+            block_size = BLOCK_SIZES[engine]
+        self.block_size = block_size
         
-        # Create a copy of the election so that we don't modify the original.
-        self.reference_election = copy.deepcopy(election)
+        if self.engine == NUMPY_ENGINE:
+            # The NumPy engine never modifies the election's data, so it can
+            # read the array form of it directly rather than taking a copy.
+            # It just needs its own copy of the support figures.
+            self.reference_election = None
+            self.vectorized = election.vectorize()
+            self.predicted_support = copy.deepcopy(election.predicted_support)
+            self.regional_support = copy.deepcopy(election.regional_support)
+            self.noise_tilt = None
+            if importance is not None:
+                self.noise_tilt = self.vectorized.noise_tilt_array(
+                                 samplers.noise_tilts(importance,
+                                                      self.vectorized.names))
+        else:
+            # Create a copy of the election so that we don't modify the
+            # original.  Each simulated election just resets and reruns this
+            # one copy, so the support figures to tweak are kept separately.
+            self.reference_election = copy.deepcopy(election)
+            self.predicted_support = copy.deepcopy(election.predicted_support)
+            if importance is not None:
+                self.reference_election.noise_tilt = samplers.noise_tilts(
+                                  importance,
+                                  self.reference_election.constituencies.keys())
         
         return
     
@@ -42,37 +96,878 @@ class MonteCarlo(object):
         """Call straight through to the run method."""
         self.run()
     
-    def get_modified_support(self):
+    def get_modified_support(self, rng=random, modifiers=None):
         """Return a tweaked copy of the support dictionary."""
         
-        predicted_support = copy.deepcopy(self.reference_election.
-                                                              predicted_support)
-        
-        # Poll results are always given to within a margin of error.  That
-        # means we can push each value up to SUPPORT_VARIATION percentage
-        # points in either direction and still be faithful to the provided poll
-        # numbers.
-        for party in predicted_support.keys():
-            modifier = random.uniform(-SUPPORT_VARIATION, SUPPORT_VARIATION)
-            predicted_support[party] += modifier
-            
-        return predicted_support
+        return modify_support(self.predicted_support,
+                              rng,
+                              modifiers)
     
     def run(self):
-        """Run full Monte Carlo simulations until stopped."""
+        """Run each block of elections that comes in on the tasks queue until
+        told to stop by a None.  Each task gives the job and block numbers, the
+        seed, the national and regional support to simulate with and the tilts
+        for an adaptive proposal, if there are any yet.
+        
+        Finished blocks are sent back on the results queue in batches, each
+        along with its job and block numbers.  A batch goes back whenever
+        there's no more work waiting, or every RESULTS_BATCH_INTERVAL seconds
+        while there is.  Every message is tagged with our worker ID and says
+        how many blocks we've finished and whether we're busy with another,
+        and an empty batch is sent every HEARTBEAT_INTERVAL seconds so that
+        the pool can tell if we've stopped getting anywhere.
+        """
         
+        self.blocks_done = 0
+        self.busy = False
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=self.send_heartbeats,
+                                     args=(stop_heartbeat,))
+        heartbeat.daemon = True
+        heartbeat.start()
+        
+        batch = []
+        last_sent = time.time()
         while True:
-            # Create a copy of the reference election to work with.
-            this_election = copy.deepcopy(self.reference_election)
+            try:
+                task = self.tasks.get(block=False)
+            except Queue.Empty:
+                # Send back what we've got before waiting for more work, so
+                # that nothing is held up on our account.
+                self.send_batch(batch)
+                batch = []
+                last_sent = time.time()
+                self.busy = False
+                task = self.tasks.get()
+            if task is None:
+                break
+            self.busy = True
+            batch.append(self.run_task(task))
+            self.blocks_done += 1
+            if time.time() - last_sent >= RESULTS_BATCH_INTERVAL:
+                self.send_batch(batch)
+                batch = []
+                last_sent = time.time()
+        self.send_batch(batch)
+        
+        stop_heartbeat.set()
+        heartbeat.join()
+            
+        return
+    
+    def run_task(self, task):
+        """Run one block of elections and return it with its job and block
+        numbers.
+        """
+        
+        job, block, seed, predicted_support, regional_support, tilts = task
+        self.set_support(predicted_support, regional_support)
+        
+        # Every block has its own random number stream, so the results don't
+        # depend on which process happens to run it.  Likewise, Halton points
+        # are picked by the number of the election within the whole run.
+        rng = samplers.block_rng(seed, block, self.engine, self.sampling)
+        modifiers = None
+        if self.sampling == SAMPLING_HALTON:
+            modifiers = samplers.halton_modifiers(block * self.block_size,
+                                                  self.block_size,
+                                                  samplers.halton_shift(seed))
+        
+        # When importance sampling, tilt the target party's support, and with
+        # an adaptive proposal, tilt every party's support as the proposal
+        # says.  Only the support of parties we have figures for can be
+        # tilted.
+        log_weights = None
+        if self.importance is not None or self.adaptive:
+            if modifiers is None:
+                modifiers = samplers.random_modifiers(rng,
+                                                      self.block_size,
+                                                      self.engine)
+            tilts = dict(tilts or {})
+            if self.importance is not None:
+                tilts[self.importance[0]] = IMPORTANCE_SUPPORT_TILT
+            log_weights = samplers.tilt_modifiers(
+                                   modifiers,
+                                   dict((party, tilt) for party, tilt in
+                                        tilts.items() if
+                                        party in predicted_support))
+                
+        if self.engine == NUMPY_ENGINE:
+            res = self.run_numpy_block(rng, modifiers, log_weights)
+        else:
+            res = self.run_python_block(rng, modifiers, log_weights)
+            
+        return (job, block, res)
+    
+    def send_batch(self, batch):
+        """Send a batch of finished blocks back, if there are any."""
+        
+        if len(batch) > 0:
+            self.results.put((self.worker_id,
+                              batch,
+                              self.blocks_done,
+                              self.busy))
+            
+        return
+    
+    def send_heartbeats(self, stop):
+        """Send an empty batch every HEARTBEAT_INTERVAL seconds until told to
+        stop.  These come from a thread of their own, so they only show that
+        the main loop is getting somewhere by the number of blocks it has
+        finished.
+        """
+        
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            self.results.put((self.worker_id,
+                              [],
+                              self.blocks_done,
+                              self.busy))
+            
+        return
+    
+    def set_support(self, predicted_support, regional_support):
+        """Set the support figures to simulate with."""
+        
+        self.predicted_support = predicted_support
+        if self.engine == NUMPY_ENGINE:
+            self.regional_support = regional_support
+        else:
+            self.reference_election.regional_support = regional_support
+            
+        return
+    
+    def run_python_block(self, rng, modifiers=None, log_weights=None):
+        """Run a block of elections with the Python engine and return a list of
+        their Results.  If given, 'modifiers' has the support modifiers for
+        each election (see modify_support()); otherwise they're drawn at
+        random.  When importance sampling, 'log_weights' has the log of the
+        importance weight for each election's support, and each Result gets
+        its final weight.
+        """
+        
+        results = []
+        this_election = self.reference_election
+        for ii in range(self.block_size):
+            # Clear out the last election run, rather than copying the whole
+            # reference election again.
+            this_election.reset()
         
             # Tweak the poll numbers a bit to give us some variety.
-            this_election.predicted_support = self.get_modified_support()
+            if modifiers is None:
+                this_election.predicted_support = self.get_modified_support(rng)
+            else:
+                this_election.predicted_support = self.get_modified_support(
+                                                                  rng,
+                                                                  modifiers[ii])
+        
+            # Now run this election and store its Result, which is made
+            # afresh for each run.  There's no point finishing off elections
+            # that are too divergent to use.
+            if log_weights is not None:
+                this_election.log_weight = log_weights[ii]
+            this_election.run(self.engine, rng, reject_divergent=True)
+            if log_weights is not None:
+                this_election.result.weight = math.exp(this_election.log_weight)
+            if self.adaptive:
+                this_election.result.modifiers = modifiers[ii]
+            results.append(this_election.result)
+            
+        return results
+    
+    def run_numpy_block(self, rng, modifiers=None, log_weights=None):
+        """Run a block of elections with the NumPy engine, simulating them all
+        at once, and return them as a string of compact records.  'modifiers'
+        and 'log_weights' are as for run_python_block().
+        """
+        
+        import electobot.vectorized as vectorized
+        
+        support, present = vectorized.perturb_support(self.predicted_support,
+                                                      self.block_size,
+                                                      rng,
+                                                      modifiers)
+        
+        # Send the whole block back as compact records rather than as Result
+        # objects, which are expensive to pickle.
+        records = self.vectorized.run_block_records(support,
+                                                    present,
+                                                    self.regional_support,
+                                                    rng,
+                                                    self.noise_tilt,
+                                                    log_weights)
+        if self.adaptive:
+            records["modifiers"] = modifiers
+                
+        return records.tostring()
+
+class MonteCarloPool(object):
+    """Pool of processes that run Monte Carlo simulations between them.  Work
+    is handed out in numbered blocks of elections, and only as much of it as is
+    needed.  The processes last until close() is called, so one pool can run
+    simulations for any number of sets of support figures.
+    """
+    
+    def __init__(self,
+                 election,
+                 engine=PYTHON_ENGINE,
+                 block_size=None,
+                 seed=None,
+                 num_of_workers=None,
+                 checkpoint_file=None,
+                 checkpoint_interval=CHECKPOINT_INTERVAL,
+                 sampling=SAMPLING_RANDOM,
+                 importance=None,
+                 adaptive=False):
+        """Constructor.  Call start() to get the processes going.  'sampling'
+        is one of SAMPLING_STRATEGIES.  To importance sample, give the target
+        to aim for (see samplers.target_seats()); the results are then
+        weighted.
+        
+        If 'adaptive' is set, each job uses an adaptive proposal.  Its first
+        ADAPTIVE_PILOT_SIZES elections are run as usual, and the support
+        modifiers of the rest are tilted (see samplers.tilt_modifiers())
+        towards those of the acceptable elections among them.  The pilot
+        elections are kept, and every result is weighted to make up for the
+        tilt, so the totals are the same on average as without it.
+        
+        If a checkpoint file is given, the progress of every unfinished job is
+        saved to it every checkpoint_interval seconds, so that it can be picked
+        up again by resume() if the run is interrupted.
+        """
+        
+        self.election = election
+        self.engine = engine
+        self.sampling = sampling
+        self.importance = importance
+        self.adaptive = adaptive
+        if block_size is None:
+            block_size = BLOCK_SIZES[engine]
+        self.block_size = block_size
+        
+        self.seed = choose_seed(seed)
+        if num_of_workers is None:
+            num_of_workers = multiprocessing.cpu_count()
+        self.num_of_workers = num_of_workers
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.processes = []
+        
+        # The number of blocks each process has told us it has finished, and
+        # when we last saw it finish one or have nothing to do.
+        self.blocks_done = []
+        self.last_progress = []
+        
+        # Snapshots of unfinished jobs' results, keyed on their support
+        # figures (see MonteCarloJob.key()).
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint = {}
+        
+        return
+    
+    def resume(self):
+        """Load the checkpoint file, if there is one, so that jobs carry on
+        from where they had got to when it was saved.
+        """
+        
+        if self.checkpoint_file is None or not os.path.exists(
+                                                          self.checkpoint_file):
+            logger.info("No checkpoint to resume from")
+            return
+        
+        self.checkpoint = load_checkpoint(self.checkpoint_file)
+        logger.info("Resuming {0} jobs from checkpoint".format(
+                                                          len(self.checkpoint)))
+        
+        return
+    
+    def save_checkpoint(self, jobs):
+        """Save snapshots of the given running jobs to the checkpoint file,
+        along with those of any jobs from an earlier checkpoint that haven't
+        been started yet.
+        """
+        
+        checkpoint = dict(self.checkpoint)
+        for job in jobs:
+            checkpoint[job.key()] = job.snapshot()
+        save_checkpoint(self.checkpoint_file, checkpoint)
+        logger.debug("Saved checkpoint of {0} jobs".format(len(checkpoint)))
+        
+        return
+    
+    def start(self):
+        """Create and start the processes ready to run the simulation."""
+        
+        # With the NumPy engine, all the processes can read the same copy of
+        # the election data from shared memory.
+        if self.engine == NUMPY_ENGINE:
+            self.election.vectorize().share()
+            
+        for ii in range(self.num_of_workers):
+            mc = MonteCarlo(self.election,
+                            self.tasks,
+                            self.results,
+                            self.engine,
+                            self.block_size,
+                            worker_id=ii,
+                            sampling=self.sampling,
+                            importance=self.importance,
+                            adaptive=self.adaptive)
+            proc = multiprocessing.Process(target=mc)
+            self.processes.append(proc)
+            self.blocks_done.append(0)
+            self.last_progress.append(time.time())
+            proc.start()
+            
+        return
+    
+    def get_results(self):
+        """Wait for the next batch of finished blocks and return it.  Give up
+        if any of the processes has died, or if one has been busy with the
+        same block for longer than WORKER_TIMEOUT.  Every process says how
+        many blocks it has finished at least every HEARTBEAT_INTERVAL seconds,
+        so this catches one that has hung, or has gone silent, as well as one
+        that has died.
+        """
+        
+        while True:
+            try:
+                worker_id, batch, blocks_done, busy = self.results.get(
+                                                    block=True,
+                                                    timeout=HEARTBEAT_INTERVAL)
+            except Queue.Empty:
+                worker_id, batch = None, []
+            now = time.time()
+            if worker_id is not None:
+                if blocks_done != self.blocks_done[worker_id] or not busy:
+                    self.last_progress[worker_id] = now
+                self.blocks_done[worker_id] = blocks_done
+            
+            for ii, proc in enumerate(self.processes):
+                if not proc.is_alive():
+                    logger.error("Monte Carlo process {0} died (exit code "
+                                 "{1})".format(ii, proc.exitcode))
+                    raise RuntimeError("Monte Carlo process died")
+                elif now - self.last_progress[ii] > WORKER_TIMEOUT:
+                    logger.error("Monte Carlo process {0} hasn't finished a "
+                                 "block in {1} seconds".format(ii,
+                                                               WORKER_TIMEOUT))
+                    raise RuntimeError("Monte Carlo process stopped responding")
+                
+            if len(batch) > 0:
+                return batch
+    
+    def run(self,
+            iterations,
+            predicted_support=None,
+            regional_support=None,
+            ci_width=None,
+            previous=None):
+        """Run a Monte Carlo simulation of the given number of acceptable
+        elections and return its MonteCarloResult.  The support figures
+        default to those of the pool's election.
+        
+        If ci_width is given, stop early once all the 95% confidence intervals
+        are narrower than that (see MonteCarloResult.ci_width()), so that
+        'iterations' is just the most elections to run.  If 'previous' is
+        given, top up that earlier result (see MonteCarloJob).
+        """
+        
+        if predicted_support is None:
+            predicted_support = self.election.predicted_support
+        if regional_support is None:
+            regional_support = self.election.regional_support
+        job = MonteCarloJob(iterations,
+                            predicted_support,
+                            regional_support,
+                            ci_width,
+                            previous=previous)
+        for job in self.run_jobs([job]):
+            pass
+            
+        return job.result
+    
+    def run_jobs(self, jobs):
+        """Run several Monte Carlo simulations, given as MonteCarloJobs, side
+        by side.  Each job is yielded, with its result filled in, as soon as it
+        has finished.  Carry on to the end so that the pool is left ready for
+        more work.
+        
+        Jobs are started in order.  Each one can have blocks in progress on up
+        to as many processes as there are, and the pool keeps up to twice that
+        many blocks in progress altogether, so later jobs get started whenever
+        the earlier ones can't keep all the processes busy.
+        """
+        
+        waiting = iter(jobs)
+        running = {}
+        next_job_id = 0
+        outstanding = 0
+        max_outstanding = 2 * self.num_of_workers
+        last_checkpoint = time.time()
+        
+        # The processes may have been idle since the last run, and we only
+        # count them as getting somewhere once we've read their heartbeats.
+        self.last_progress = [time.time()] * len(self.processes)
+        while True:
+            # Hand out work to running jobs first, then start new ones if
+            # there's still room.
+            for job_id in sorted(running.keys()):
+                outstanding += self.issue_blocks(job_id,
+                                                 running[job_id],
+                                                 max_outstanding - outstanding)
+            while outstanding < max_outstanding:
+                job = next(waiting, None)
+                if job is None:
+                    break
+                self.start_job(job)
+                if job.finished:
+                    self.checkpoint.pop(job.key(), None)
+                    job.finish()
+                    yield job
+                    continue
+                running[next_job_id] = job
+                outstanding += self.issue_blocks(next_job_id,
+                                                 job,
+                                                 max_outstanding - outstanding)
+                next_job_id += 1
+                
+            # Running jobs always want more work until they've finished, so
+            # if none is in progress then there's nothing left to do.
+            if outstanding == 0:
+                break
+            
+            for job_id, block, res in self.get_results():
+                outstanding -= 1
+                if job_id not in running:
+                    # Left over from a job that has already finished.
+                    continue
+                job = running[job_id]
+                job.add_block(block, res, self.election)
+                job.progress.update(job.num_of_results, job.too_divergent)
+                if job.finished:
+                    del running[job_id]
+                    self.checkpoint.pop(job.key(), None)
+                    job.finish()
+                    yield job
+                
+            if (self.checkpoint_file is not None and
+                time.time() - last_checkpoint >= self.checkpoint_interval):
+                self.save_checkpoint(running.values())
+                last_checkpoint = time.time()
+                
+        # Everything has finished, so there's nothing left to resume.
+        if (self.checkpoint_file is not None and
+            len(self.checkpoint) == 0 and
+            os.path.exists(self.checkpoint_file)):
+            os.remove(self.checkpoint_file)
+            
+        return
+    
+    def can_carry_on(self, result):
+        """Return whether this pool can add more results to an earlier
+        MonteCarloResult, which it can only do if the results were sampled in
+        the same way.  Results saved by older versions don't say how they were
+        sampled, so they can't be carried on from.
+        """
+        
+        return (getattr(result, "engine", None) == self.engine and
+                getattr(result, "block_size", None) == self.block_size and
+                getattr(result, "sampling", None) == self.sampling and
+                getattr(result, "importance_target", None) ==
+                                                            self.importance and
+                getattr(result, "adaptive", False) == self.adaptive)
+    
+    def start_job(self, job):
+        """Get a job ready to hand out its work."""
+        
+        if job.key() in self.checkpoint:
+            job.resume_from(self.checkpoint[job.key()])
+        
+        # Results can only be carried on from if they were sampled the same
+        # way as we're about to sample; otherwise the new results would reuse
+        # random numbers, or mix weighted and unweighted counts.
+        if job.resumed:
+            assert self.can_carry_on(job.result), \
+                "Can't carry on from results sampled with different settings"
+        if job.seed is None:
+            job.seed = self.seed
+        job.result.engine = self.engine
+        job.result.block_size = self.block_size
+        job.result.sampling = self.sampling
+        job.result.importance_target = self.importance
+        job.result.adaptive = self.adaptive
+        if self.adaptive:
+            job.pilot_blocks = int(math.ceil(
+                                   float(ADAPTIVE_PILOT_SIZES[self.engine]) /
+                                   self.block_size))
+            job.fit_proposal()
+        job.progress = ProgressReporter(job.iterations,
+                                        job.num_of_results,
+                                        job.too_divergent)
+        
+        # A job that was resumed with all the results it asks for already has
+        # nothing left to do.
+        if job.iterations is not None and job.num_of_results >= job.iterations:
+            job.finished = True
+        
+        return
+    
+    def issue_blocks(self, job_id, job, room):
+        """Hand out as many blocks of a job as it needs, up to 'room' of them,
+        and return how many were handed out.
+        """
+        
+        issued = 0
+        while (issued < room and
+               job.outstanding() < self.num_of_workers and
+               job.wants_block(self.block_size)):
+            self.tasks.put((job_id,
+                            job.issued,
+                            job.seed,
+                            job.predicted_support,
+                            job.regional_support,
+                            job.result.proposal_tilts))
+            job.issued += 1
+            issued += 1
+            
+        return issued
+    
+    def close(self):
+        """Tell the processes to stop once they've finished their work, and
+        wait for them to do so.
+        """
+        
+        for proc in self.processes:
+            self.tasks.put(None)
+            
+        # Keep emptying the results queue while we wait; a process can't exit
+        # until everything it has sent, heartbeats included, has been read.
+        for proc in self.processes:
+            while proc.is_alive():
+                try:
+                    while True:
+                        self.results.get(block=False)
+                except Queue.Empty:
+                    proc.join(1)
+        self.processes = []
+        self.blocks_done = []
+        self.last_progress = []
+            
+        return
+    
+    def terminate(self):
+        """Stop the processes immediately."""
+        
+        for proc in self.processes:
+            proc.terminate()
+        self.processes = []
+        self.blocks_done = []
+        self.last_progress = []
+        
+        return
+
+class MonteCarloJob(object):
+    """A Monte Carlo simulation to be run by a MonteCarloPool, and its
+    progress so far.
+    """
+    
+    def __init__(self,
+                 iterations,
+                 predicted_support,
+                 regional_support,
+                 ci_width=None,
+                 first_block=0,
+                 num_of_blocks=None,
+                 seed=None,
+                 previous=None,
+                 proposal_tilts=None):
+        """Constructor.  The job runs until it has the given number of
+        acceptable results, or until its confidence intervals are narrower
+        than ci_width if that is given (see MonteCarloPool.run()).
+        
+        Alternatively, pass None for iterations and give num_of_blocks to run
+        exactly that many blocks, starting from first_block, and keep every
+        acceptable result from them.  Given both, the job stops at whichever
+        comes first.
+        
+        The seed defaults to that of the pool that runs the job.  To top up an
+        earlier MonteCarloResult for the same support figures, pass it as
+        'previous'.  The job then carries on from it, with fresh random number
+        streams, until it has 'iterations' results in total.
+        
+        With an adaptive proposal, the job fits the tilts for it once the
+        pilot blocks are in, unless they're given as 'proposal_tilts'.
+        """
+        
+        self.iterations = iterations
+        self.predicted_support = predicted_support
+        self.regional_support = regional_support
+        self.ci_width = ci_width
+        self.seed = seed
+        self.result = MonteCarloResult()
+        self.num_of_results = 0
+        self.too_divergent = 0
+        self.finished = False
+        self.progress = None
+        self.resumed = False
+        
+        # With an adaptive proposal, the number of pilot blocks to run before
+        # fitting it (see fit_proposal()).
+        self.pilot_blocks = None
+        
+        # Blocks can come back in any order, so hold on to them until we can
+        # add them to the totals in block order; that way the results we keep
+        # don't depend on the timing of the processes.
+        self.pending = {}
+        self.next_block = first_block
+        self.issued = first_block
+        self.end_block = None
+        if num_of_blocks is not None:
+            self.end_block = first_block + num_of_blocks
+        
+        if previous is not None:
+            self.resume_from(previous)
+        if proposal_tilts is not None:
+            self.result.proposal_tilts = proposal_tilts
+        
+        return
+    
+    def key(self):
+        """Return a key identifying this job by its support figures."""
+        
+        return (tuple(sorted(self.predicted_support.items())),
+                tuple(sorted((region, tuple(sorted(support.items())))
+                             for region, support in
+                             self.regional_support.items())))
+    
+    def resume_from(self, result):
+        """Carry on from an earlier MonteCarloResult for the same support
+        figures, using the blocks after the ones it used.  The job must not
+        have started yet.
+        """
+        
+        self.result = copy.deepcopy(result)
+        self.resumed = True
+        self.num_of_results = result.num_of_results
+        self.too_divergent = result.num_of_rejected
+        self.next_block = result.next_block
+        self.issued = result.next_block
+        if result.seed is not None:
+            self.seed = result.seed
+        
+        return
+    
+    def snapshot(self):
+        """Return a copy of the results so far, which another job can carry
+        on from (see resume_from()).
+        """
+        
+        snapshot = copy.deepcopy(self.result)
+        snapshot.num_of_rejected = self.too_divergent
+        snapshot.seed = self.seed
+        snapshot.next_block = self.next_block
+        
+        return snapshot
+    
+    def outstanding(self):
+        """Return the number of blocks handed out but not yet added in."""
+        
+        return self.issued - self.next_block
+    
+    def wants_block(self, block_size):
+        """Return whether this job might need another block, assuming that all
+        the ones in progress turn out to be acceptable.
+        """
+        
+        if self.finished:
+            return False
+        elif self.end_block is not None and self.issued >= self.end_block:
+            return False
+        elif (self.pilot_blocks is not None and
+              self.result.proposal_tilts is None and
+              self.issued >= self.pilot_blocks):
+            # The rest of the blocks have to wait for the proposal.
+            return False
+        elif self.iterations is None:
+            return True
+        
+        return (self.num_of_results + self.outstanding() * block_size <
+                                                                self.iterations)
+    
+    def wanted(self):
+        """Return how many more acceptable results this job needs, or None if
+        it needs all of them.
+        """
+        
+        if self.iterations is None:
+            return None
+        
+        return self.iterations - self.num_of_results
+    
+    def add_block(self, block, res, election):
+        """Add a finished block to the job, and any blocks it was holding up
+        to the totals.
+        """
+        
+        self.pending[block] = res
+        while self.next_block in self.pending and not self.finished:
+            accepted, divergent = self.add_results(
+                                        self.pending.pop(self.next_block),
+                                        self.wanted(),
+                                        election)
+            self.num_of_results += accepted
+            self.too_divergent += divergent
+            self.next_block += 1
+            self.fit_proposal()
+            
+            # Stop when we've got all the results or blocks we asked for, or
+            # when the confidence intervals are narrow enough.
+            self.finished = (self.iterations is not None and
+                             self.num_of_results >= self.iterations)
+            if self.end_block is not None and self.next_block >= self.end_block:
+                self.finished = True
+            if (self.ci_width is not None and
+                self.num_of_results >= CI_MIN_RESULTS and
+                self.result.ci_width() < self.ci_width):
+                logger.info("Confidence intervals narrower than {0} after {1} "
+                            "results".format(self.ci_width,
+                                             self.num_of_results))
+                self.finished = True
+                
+        return
+    
+    def fit_proposal(self):
+        """Fit the tilts for an adaptive proposal to the support modifiers of
+        the acceptable elections so far, once all the pilot blocks are in.
+        """
+        
+        if (self.pilot_blocks is None or
+            self.result.proposal_tilts is not None or
+            self.next_block < self.pilot_blocks):
+            return
+        
+        self.result.proposal_tilts = samplers.fit_tilts(
+                                                self.result.modifiers,
+                                                self.predicted_support.keys())
+        logger.info("Adaptive proposal tilts: {0}".format(
+                              utils.by_party_name(self.result.proposal_tilts)))
         
-            # Now run this election and store its Result.  We copy it so that
-            # the election itself can be immediately GCed.
-            this_election.run()
-            self.results.put(copy.deepcopy(this_election.result))
+        return
+    
+    def add_results(self, res, wanted, election):
+        """Add up to 'wanted' acceptable results from a block to the totals,
+        or all of them if 'wanted' is None.  Return the number of results added
+        and the number found to be too divergent.
+        """
+        
+        too_divergent = 0
+        if isinstance(res, str):
+            # A block of compact records from the NumPy engine.
+            vectorized = election.vectorized
+            records = vectorized.decode_records(res)
+            divergent = (records["flags"] & RECORD_TOO_DIVERGENT) != 0
             
+            # As with the Python engine, stop looking at the records once
+            # we've got as many acceptable ones as we want, so that the
+            # divergent ones after that don't count as rejected.
+            acceptable = (~divergent).nonzero()[0]
+            if wanted is not None and len(acceptable) >= wanted:
+                end = acceptable[wanted - 1] + 1 if wanted > 0 else 0
+                records = records[:end]
+                divergent = divergent[:end]
+            too_divergent += int(divergent.sum())
+            records = records[~divergent]
+            self.result.analyze_records(records, vectorized)
+            return len(records), too_divergent
+        
+        accepted = 0
+        for result in res:
+            if wanted is not None and accepted >= wanted:
+                break
+            elif not result.result_too_divergent:
+                self.result.add_result(result)
+                accepted += 1
+            else:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Too divergent.")
+                    logger.debug(str(utils.by_party_name(result.support)))
+                too_divergent += 1
+        
+        return accepted, too_divergent
+    
+    def finish(self):
+        """Work out the final statistics once the job has finished."""
+        
+        self.result.num_of_rejected = self.too_divergent
+        self.result.seed = self.seed
+        self.result.next_block = self.next_block
+        logger.info("{0} results discarded for unacceptable divergence "
+                    "(acceptance rate {1:.1f}%)".format(
+                                        self.too_divergent,
+                                        self.result.acceptance_rate() * 100))
+        self.result.calculate_statistics()
+        
+        return
+
+class ProgressReporter(object):
+    """Logs how a Monte Carlo simulation is getting on, at most once every
+    PROGRESS_INTERVAL seconds.
+    """
+    
+    def __init__(self,
+                 iterations,
+                 num_of_results=0,
+                 num_of_rejected=0,
+                 interval=PROGRESS_INTERVAL):
+        """Constructor.  Give the number of acceptable results wanted (or None
+        if there's no set number) and, if the simulation is carrying on from
+        earlier results, how many of them there were.
+        """
+        
+        self.iterations = iterations
+        self.interval = interval
+        self.start_time = time.time()
+        self.last_report = self.start_time
+        self.start_results = num_of_results
+        self.start_rejected = num_of_rejected
+        
+        return
+    
+    def update(self, num_of_results, num_of_rejected):
+        """Log the progress so far if it's time to."""
+        
+        now = time.time()
+        if now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        
+        # Rates only count the elections simulated since we started.
+        elapsed = now - self.start_time
+        accepted = num_of_results - self.start_results
+        simulated = accepted + num_of_rejected - self.start_rejected
+        if num_of_results + num_of_rejected > 0:
+            acceptance_rate = (float(num_of_results) /
+                               (num_of_results + num_of_rejected))
+        else:
+            acceptance_rate = 0
+        
+        if self.iterations is None:
+            so_far = "{0} results".format(num_of_results)
+        else:
+            so_far = "{0} of {1} results".format(num_of_results,
+                                                 self.iterations)
+        if self.iterations is None or accepted == 0:
+            eta = "unknown"
+        else:
+            eta = datetime.timedelta(seconds=int(
+                     (self.iterations - num_of_results) * elapsed / accepted))
+        logger.info("Progress: {0} ({1:.1f} elections/s, {2:.1f}% accepted, "
+                    "ETA {3})".format(so_far,
+                                      simulated / elapsed,
+                                      acceptance_rate * 100,
+                                      eta))
+        
         return
 
 class MonteCarloResult(object):
@@ -91,11 +986,41 @@ class MonteCarloResult(object):
         self.stddev_seats = {}
         self.largest_party_counts = {}
         self.mean_margin_of_victory = 0
+        self.stddev_margin_of_victory = 0
         self.most_seats_won = 0
         self.most_seats_won_party = None
         self.greens_hold_brighton_count = 0
         self.seat_winner_is_pop_winner_count = 0
-        self.margins_of_victory = []
+        self.margins_of_victory = utils.RunningStats()
+        self.num_of_rejected = 0
+        
+        # When importance sampling, the target the results were aimed at (see
+        # samplers.target_seats()).  Every count is then a total of the
+        # results' weights, and the effective sample size comes from the totals
+        # of the weights and of their squares.  For a national target, the
+        # total weight of the results that hit it is kept too; a seat target's
+        # is in const_wins.
+        self.importance_target = None
+        self.target_hits = 0
+        self.total_weight = 0
+        self.sq_weights = 0
+        
+        # With an adaptive proposal (see MonteCarloPool), the tilts it uses,
+        # once they've been fitted, and the RunningStats of the support
+        # modifiers of the results, keyed on party.  The results are then
+        # weighted too.
+        self.adaptive = False
+        self.proposal_tilts = None
+        self.modifiers = {}
+        
+        # Where the random numbers for these results came from and how they
+        # were sampled, so that more results can be added later without
+        # reusing any of them.  Blocks up to next_block have been used.
+        self.seed = None
+        self.next_block = 0
+        self.engine = None
+        self.block_size = None
+        self.sampling = None
         self.ukip_seats = {}
         self.libdem_seats = {}
         self.ukip_stealth_targets = {}
@@ -108,103 +1033,381 @@ class MonteCarloResult(object):
         """Analyze the results."""
         
         for result in results:
-            self.num_of_results += 1
-            if result.winner in self.win_counts:
-                self.win_counts[result.winner] += 1
-            else:
-                self.win_counts[result.winner] = 1
-            
-            for party in result.seats.keys():
-                if party in self.seats.keys():
-                    self.seats[party].append(result.seats[party])
-                else:
-                    self.seats[party] = [result.seats[party]]
+            self.add_result(result)
                 
-            if result.largest_party in self.largest_party_counts:
-                self.largest_party_counts[result.largest_party] += 1
+        self.calculate_statistics()
+            
+        return
+    
+    def add_result(self, result):
+        """Add a single Result to the totals.  Call calculate_statistics()
+        once all the results are in.
+        """
+        
+        weight = 1
+        if self.weighted():
+            weight = result.weight
+        self.add_outcome(result, weight)
+        
+        if self.adaptive:
+            for party in PARTIES:
+                if party not in self.modifiers:
+                    self.modifiers[party] = utils.RunningStats()
+                self.modifiers[party].add(result.modifiers[party], weight)
+        
+        for const_name in result.ukip_seats:
+            if const_name not in self.ukip_seats:
+                self.ukip_seats[const_name] = weight
             else:
-                self.largest_party_counts[result.largest_party] = 1
+                self.ukip_seats[const_name] += weight
+        
+        for const_name in result.libdem_seats:
+            if const_name not in self.libdem_seats:
+                self.libdem_seats[const_name] = weight
+            else:
+                self.libdem_seats[const_name] += weight
+        
+        for tgt in result.ukip_stealth_targets:
+            if tgt not in self.ukip_stealth_targets:
+                self.ukip_stealth_targets[tgt] = utils.RunningStats()
+            self.ukip_stealth_targets[tgt].add(result.ukip_stealth_targets[tgt],
+                                               weight)
                 
-            self.margins_of_victory.append(result.margin_of_victory)
+        for const in result.const_winners.keys():
+            if const not in self.const_wins:
+                self.const_wins[const] = {}
+            winner = result.const_winners[const]
+            if winner in self.const_wins[const]:
+                self.const_wins[const][winner] += weight
+            else:
+                self.const_wins[const][winner] = weight
+        
+        return
+    
+    def analyze_records(self, records, election):
+        """Add an array of compact result records from the NumPy engine to the
+        totals.  'election' is the VectorizedElection that produced them.
+        Call calculate_statistics() once all the results are in.
+        """
+        
+        import numpy as np
+        
+        # Unless we're importance sampling or using an adaptive proposal,
+        # every result counts once.
+        if self.weighted():
+            weights = records["weight"]
+        else:
+            weights = np.ones(len(records), dtype=int)
             
-            if result.most_seats_won > self.most_seats_won:
-                self.most_seats_won = result.most_seats_won
-                self.most_seats_won_party = result.largest_party
-                
-            if result.greens_hold_brighton:
-                self.greens_hold_brighton_count += 1
-                
-            if result.seat_winner_is_pop_winner:
-                self.seat_winner_is_pop_winner_count += 1
-                
-            for const_name in result.ukip_seats:
-                if const_name not in self.ukip_seats:
-                    self.ukip_seats[const_name] = 1
-                else:
-                    self.ukip_seats[const_name] += 1
-            
-            for const_name in result.libdem_seats:
-                if const_name not in self.libdem_seats:
-                    self.libdem_seats[const_name] = 1
-                else:
-                    self.libdem_seats[const_name] += 1
-            
-            for tgt in result.ukip_stealth_targets:
-                if tgt in self.ukip_stealth_targets:
-                    self.ukip_stealth_targets[tgt].append(result.
-                                                      ukip_stealth_targets[tgt])
-                else:
-                    self.ukip_stealth_targets[tgt] = [result.
-                                                      ukip_stealth_targets[tgt]]
-
-            for coal in result.possible_coalitions:
-                if coal in self.possible_coalitions:
-                    self.possible_coalitions[coal] += 1
-                else:
-                    self.possible_coalitions[coal] = 1
-                    
-            for const in result.const_winners.keys():
-                if const not in self.const_wins:
-                    self.const_wins[const] = {}
-                winner = result.const_winners[const]
-                if winner in self.const_wins[const]:
-                    self.const_wins[const][winner] += 1
-                else:
-                    self.const_wins[const][winner] = 1
+        self.add_record_outcomes(records, weights, election)
+        
+        if self.adaptive:
+            for party in PARTIES:
+                if party not in self.modifiers:
+                    self.modifiers[party] = utils.RunningStats()
+                self.modifiers[party].add_array(records["modifiers"][:, party],
+                                                weights)
+            
+        # Count up the winners of each seat across all the records at once.
+        winners = records["winners"]
+        for party in PARTIES:
+            wins = ((winners == party) *
+                    weights[:, np.newaxis]).sum(axis=0)
+            for ii in wins.nonzero()[0]:
+                const_name = election.names[ii]
+                if const_name not in self.const_wins:
+                    self.const_wins[const_name] = {}
+                self.const_wins[const_name][party] = (
+                            self.const_wins[const_name].get(party, 0) +
+                            wins[ii].item())
+                if party == UKP:
+                    self.ukip_seats[const_name] = (
+                            self.ukip_seats.get(const_name, 0) + wins[ii].item())
+                elif party == LD:
+                    self.libdem_seats[const_name] = (
+                          self.libdem_seats.get(const_name, 0) + wins[ii].item())
+        
+        # Zero margins mark seats that weren't stealth targets that time.
+        for ii, margins in enumerate(records["stealth_margins"].T):
+            is_target = (margins > 0)
+            if is_target.any():
+                tgt = election.names[election.stealth_seats[ii]]
+                if tgt not in self.ukip_stealth_targets:
+                    self.ukip_stealth_targets[tgt] = utils.RunningStats()
+                self.ukip_stealth_targets[tgt].add_array(margins[is_target],
+                                                         weights[is_target])
+        
+        return
+    
+    def add_record_outcomes(self, records, weights, election):
+        """Add the national outcomes of an array of compact result records to
+        the totals, with the given array of importance weights.  This works
+        the outcomes out from the records' fields in the same way as
+        add_outcome() does from each Result, but for all the records at once.
+        """
+        
+        import numpy as np
+        
+        if len(records) == 0:
+            return
+        
+        seats = records["seats"].astype(int)
+        self.num_of_results += len(records)
+        self.total_weight += weights.sum().item()
+        self.sq_weights += (weights * weights).sum().item()
+        
+        # Ties for the largest party go to the lowest party code, as they do
+        # in Result.analyze_seats.
+        largest_party = np.argmax(seats, axis=1)
+        most_seats_won = seats.max(axis=1)
+        margins_of_victory = most_seats_won - NEEDED_FOR_MAJORITY
+        has_majority = (margins_of_victory >= 0)
+        
+        for party in PARTIES:
+            self.seats.setdefault(party, utils.RunningStats()).add_array(
+                                                             seats[:, party],
+                                                             weights)
+            is_largest = (largest_party == party)
+            if is_largest.any():
+                add_counts(self.largest_party_counts,
+                           {party: weights[is_largest].sum().item()})
+            wins = is_largest & has_majority
+            if wins.any():
+                add_counts(self.win_counts,
+                           {party: weights[wins].sum().item()})
+        if not has_majority.all():
+            add_counts(self.win_counts,
+                       {None: weights[~has_majority].sum().item()})
+        
+        self.margins_of_victory.add_array(margins_of_victory, weights)
+        
+        seats_needed = self.target_seats()
+        if seats_needed is not None:
+            hits = (seats[:, self.importance_target[0]] >= seats_needed)
+            self.target_hits += weights[hits].sum().item()
+        
+        # The first record with the most seats won is the one that would have
+        # set the record if they'd been added one by one.
+        best = np.argmax(most_seats_won)
+        if most_seats_won[best] > self.most_seats_won:
+            self.most_seats_won = most_seats_won[best].item()
+            self.most_seats_won_party = largest_party[best].item()
+        
+        greens_hold_brighton = ((records["flags"] &
+                                 RECORD_GREENS_HOLD_BRIGHTON) != 0)
+        self.greens_hold_brighton_count += (
+                                  weights[greens_hold_brighton].sum().item())
+        seat_winner_is_pop_winner = (largest_party ==
+                                     records["most_votes_party"])
+        self.seat_winner_is_pop_winner_count += (
+                                  weights[seat_winner_is_pop_winner].sum().item())
+        
+        coalitions = election.record_coalitions(seats)
+        for coal in coalitions:
+            if coalitions[coal].any():
+                add_counts(self.possible_coalitions,
+                           {coal: weights[coalitions[coal]].sum().item()})
+        
+        return
+    
+    def add_outcome(self, result, weight=1):
+        """Add the national outcome of a single Result to the totals, with the
+        given importance weight.
+        """
+        
+        self.num_of_results += 1
+        self.total_weight += weight
+        self.sq_weights += weight * weight
+        if result.winner in self.win_counts:
+            self.win_counts[result.winner] += weight
+        else:
+            self.win_counts[result.winner] = weight
+        
+        for party in result.seats.keys():
+            if party not in self.seats:
+                self.seats[party] = utils.RunningStats()
+            self.seats[party].add(result.seats[party], weight)
+            
+        if result.largest_party in self.largest_party_counts:
+            self.largest_party_counts[result.largest_party] += weight
+        else:
+            self.largest_party_counts[result.largest_party] = weight
+            
+        self.margins_of_victory.add(result.margin_of_victory, weight)
+        
+        seats_needed = self.target_seats()
+        if (seats_needed is not None and
+            result.seats.get(self.importance_target[0], 0) >= seats_needed):
+            self.target_hits += weight
+        
+        if result.most_seats_won > self.most_seats_won:
+            self.most_seats_won = result.most_seats_won
+            self.most_seats_won_party = result.largest_party
+            
+        if result.greens_hold_brighton:
+            self.greens_hold_brighton_count += weight
+            
+        if result.seat_winner_is_pop_winner:
+            self.seat_winner_is_pop_winner_count += weight
+            
+        for coal in result.possible_coalitions:
+            if coal in self.possible_coalitions:
+                self.possible_coalitions[coal] += weight
+            else:
+                self.possible_coalitions[coal] = weight
                 
-        # Calculate the mean and standard deviation of the number of seats for
-        # each party.
+        return
+    
+    def merge(self, other):
+        """Add the totals from another MonteCarloResult, such as one from a
+        different process, to this one.  Call calculate_statistics() once all
+        the results are in.
+        """
+        
+        self.num_of_results += other.num_of_results
+        self.num_of_rejected += other.num_of_rejected
+        self.total_weight += other.total_weight
+        self.sq_weights += other.sq_weights
+        if self.importance_target is None:
+            self.importance_target = other.importance_target
+        self.target_hits += other.target_hits
+        if self.seed is None:
+            self.seed = other.seed
+        if self.engine is None:
+            self.engine = other.engine
+            self.block_size = other.block_size
+            self.sampling = other.sampling
+            self.adaptive = other.adaptive
+        self.next_block = max(self.next_block, other.next_block)
+        add_counts(self.win_counts, other.win_counts)
+        add_counts(self.largest_party_counts, other.largest_party_counts)
+        add_counts(self.possible_coalitions, other.possible_coalitions)
+        add_counts(self.ukip_seats, other.ukip_seats)
+        add_counts(self.libdem_seats, other.libdem_seats)
+        for const in other.const_wins.keys():
+            if const not in self.const_wins:
+                self.const_wins[const] = {}
+            add_counts(self.const_wins[const], other.const_wins[const])
+            
+        for party in other.seats.keys():
+            if party not in self.seats:
+                self.seats[party] = utils.RunningStats()
+            self.seats[party].merge(other.seats[party])
+        self.margins_of_victory.merge(other.margins_of_victory)
+        for tgt in other.ukip_stealth_targets.keys():
+            if tgt not in self.ukip_stealth_targets:
+                self.ukip_stealth_targets[tgt] = utils.RunningStats()
+            self.ukip_stealth_targets[tgt].merge(other.ukip_stealth_targets[tgt])
+        for party in other.modifiers.keys():
+            if party not in self.modifiers:
+                self.modifiers[party] = utils.RunningStats()
+            self.modifiers[party].merge(other.modifiers[party])
+            
+        if other.most_seats_won > self.most_seats_won:
+            self.most_seats_won = other.most_seats_won
+            self.most_seats_won_party = other.most_seats_won_party
+        self.greens_hold_brighton_count += other.greens_hold_brighton_count
+        self.seat_winner_is_pop_winner_count += (other.
+                                                seat_winner_is_pop_winner_count)
+        
+        return
+    
+    def calculate_statistics(self):
+        """Fill in the mean and standard deviation of the number of seats for
+        each party, and of the margin of victory, from the running totals.
+        """
+        
         for party in self.seats.keys():
-            self.mean_seats[party] = (sum(self.seats[party]) / 
-                                      float(len(self.seats[party])))
-            self.stddev_seats[party] = utils.std_dev(self.seats[party])
+            self.mean_seats[party] = self.seats[party].mean
+            self.stddev_seats[party] = self.seats[party].std_dev()
+            
+        self.mean_margin_of_victory = self.margins_of_victory.mean
+        self.stddev_margin_of_victory = self.margins_of_victory.std_dev()
             
         return
     
+    def ci_width(self):
+        """Return the width of the widest 95% confidence interval on the mean
+        number of seats for any party (in seats) or on the chance of any
+        outcome (in percentage points).
+        """
+        
+        if self.num_of_results == 0:
+            return float("inf")
+        
+        widths = []
+        for party in self.seats.keys():
+            widths.append(4 * self.seats[party].std_error())
+        for winner in self.win_counts.keys():
+            chance = float(self.win_counts[winner]) / self.total_weight
+            widths.append(4 * math.sqrt(chance * (1 - chance) /
+                                        self.effective_sample_size()) * 100)
+            
+        return max(widths)
+    
+    def weighted(self):
+        """Return whether the results are weighted, i.e. whether they were
+        importance sampled or sampled with an adaptive proposal.
+        """
+        
+        return self.importance_target is not None or self.adaptive
+    
+    def target_seats(self):
+        """Return the number of seats the importance sampling target needs its
+        party to win, or None if the results weren't aimed at a national
+        target.
+        """
+        
+        if self.importance_target is None:
+            return None
+        
+        return samplers.target_seats(self.importance_target)
+    
+    def effective_sample_size(self):
+        """Return the effective number of results, allowing for their
+        importance weights.  Without importance sampling this is just the
+        number of results.
+        """
+        
+        if self.num_of_results == 0:
+            return 0.0
+        
+        return utils.effective_sample_size(self.total_weight, self.sq_weights)
+    
+    def acceptance_rate(self):
+        """Return the fraction of simulated elections that were close enough
+        to the support figures to be used.
+        """
+        
+        total = self.num_of_results + self.num_of_rejected
+        if total == 0:
+            return 0.0
+        
+        return float(self.num_of_results) / total
+    
     def report(self, summary_file=None):
         """Report overall results."""
         
-        # Get the mean and standard deviation of the margin of victory.
-        mean_margin_of_victory = (sum(self.margins_of_victory) /
-                                  float(self.num_of_results))
-        margin_stddev = utils.std_dev(self.margins_of_victory)
+        mean_margin_of_victory = self.mean_margin_of_victory
+        margin_stddev = self.stddev_margin_of_victory
         
-        # Report the results from this analysis.
+        # Report the results from this analysis.  Entries are sorted by name
+        # before being sorted by count so that ties are always listed in the
+        # same order, whatever order the counts were accumulated in.
         print "Winning percentages:"
-        for party in sorted(self.win_counts.iteritems(),
-                            key=itemgetter(1), 
+        win_names = {None: "[Hung Parliament]"}
+        win_names.update(enumerate(PARTY_NAMES))
+        for party in sorted(sorted(self.win_counts.keys(),
+                                   key=win_names.get),
+                            key=self.win_counts.get,
                             reverse=True):
-            if party[0] is None:
-                party_name = "[Hung Parliament]"
-            else:
-                party_name = party[0]
-            print "  {0}: {1}%".format(party_name,
-                                get_result_percentage(self.win_counts[party[0]],
-                                                      self.num_of_results))
+            print "  {0}: {1}%".format(win_names[party],
+                                get_result_percentage(self.win_counts[party],
+                                                      self.total_weight))
             
         if len(self.possible_coalitions) > 0:
             print "Feasible coalitions in hung parliaments:"
-            for coal in sorted(self.possible_coalitions.items(),
+            for coal in sorted(sorted(self.possible_coalitions.items()),
                                key=itemgetter(1),
                                reverse=True):
                 print "  {0} ({1:.1f}%)".format(coal[0],
@@ -212,18 +1415,20 @@ class MonteCarloResult(object):
                                   sum(self.possible_coalitions.values())) * 100)
         
         print "Largest-party percentages:"
-        for party in sorted(self.largest_party_counts.keys()):
-            print "  {0}: {1}%".format(party,
+        for party in sorted(self.largest_party_counts.keys(),
+                            key=PARTY_NAMES.__getitem__):
+            print "  {0}: {1}%".format(PARTY_NAMES[party],
                                        get_result_percentage(
                                                self.largest_party_counts[party],
-                                               self.num_of_results))
+                                               self.total_weight))
             
         print "Mean number of seats per-party (95% confidence intervals):"
-        for party in sorted(self.mean_seats.keys(), 
+        for party in sorted(sorted(self.mean_seats.keys(),
+                                   key=PARTY_NAMES.__getitem__),
                             key=self.mean_seats.get,
                             reverse=True):
             print "  {0}: {1} ({2:.2f}-{3:.2f})".format(
-                                               party,
+                                               PARTY_NAMES[party],
                                                self.mean_seats[party],
                                                (self.mean_seats[party] -
                                                 (2 * self.stddev_seats[party])),
@@ -236,31 +1441,55 @@ class MonteCarloResult(object):
                                 (mean_margin_of_victory - (2 * margin_stddev)),
                                 (mean_margin_of_victory + (2 * margin_stddev))))
 
+        print ("Acceptance rate: {0:.1f}% ({1} of {2} simulated elections "
+               "used)".format(self.acceptance_rate() * 100,
+                              self.num_of_results,
+                              self.num_of_results + self.num_of_rejected))
+        
+        if self.importance_target is not None:
+            party = self.importance_target[0]
+            seats_needed = self.target_seats()
+            if seats_needed is None:
+                const_name = self.importance_target[1]
+                outcome = "win {0}".format(const_name)
+                hits = self.const_wins.get(const_name, {}).get(party, 0)
+            else:
+                outcome = "win at least {0} seats".format(seats_needed)
+                hits = self.target_hits
+            print ("Importance sampled: {0} {1} in {2:.3g}% of runs "
+                   "(effective sample size {3:.0f})".format(
+                                PARTY_NAMES[party],
+                                outcome,
+                                get_result_percentage(hits, self.total_weight),
+                                self.effective_sample_size()))
+        elif self.adaptive:
+            print ("Adaptive proposal: effective sample size {0:.0f}".format(
+                                                 self.effective_sample_size()))
+
         print ("Greens hold Brighton Pavilion in "
                "{0}% of runs".format(get_result_percentage(
                                                 self.greens_hold_brighton_count,
-                                                self.num_of_results)))
+                                                self.total_weight)))
         
         if len(self.ukip_seats) > 0:
             print "Most common UKIP wins:"
         printed = 0
-        for seat in sorted(self.ukip_seats.items(),
+        for seat in sorted(sorted(self.ukip_seats.items()),
                            key=lambda x: x[1],
                            reverse=True):
             if printed >= 20:
                 break
             print "  {0} (won in {1:.1f}% of simulations)".format(seat[0],
-                                       (float(seat[1])/self.num_of_results)*100)
+                                       (float(seat[1])/self.total_weight)*100)
             printed += 1
         
         if len(self.ukip_stealth_targets) > 0:
             print "Most common UKIP stealth targets:"
-        for tgt in sorted(self.ukip_stealth_targets.items(),
-                          key=lambda x: sum(x[1]),
+        for tgt in sorted(sorted(self.ukip_stealth_targets.items()),
+                          key=lambda x: x[1].total(),
                           reverse=True):
             print "  {0} (mean CON majority {1:.1f})".format(tgt[0],
-                                                            (float(sum(tgt[1]))/
-                                                            len(tgt[1])))
+                                                             tgt[1].mean)
             
         # If requested, save off the summary of who's won each seat.
         if summary_file is not None:
@@ -270,7 +1499,7 @@ class MonteCarloResult(object):
             csvwriter.writerow(headers)
             for const in sorted(self.const_wins.keys()):
                 row = [const]
-                for party in PARTY_NAMES:
+                for party in PARTIES:
                     if party in self.const_wins[const]:
                         row.append(self.const_wins[const][party])
                     else:
@@ -281,60 +1510,118 @@ class MonteCarloResult(object):
         
         return
 
-def make_and_run_montecarlo(election, results_queue):
-    """Run a single election for the Monte Carlo simulation."""
+def choose_seed(seed=None):
+    """Pick a seed for a Monte Carlo run if we weren't given one, and log it so
+    that the run can be repeated.
+    """
+    
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
+    logger.info("Monte Carlo seed: {0}".format(seed))
     
-    # This function is at the top level of the module rather than part of the
-    # MonteCarlo class because Python's multiprocessing module, in its ineffable
-    # wisdom, won't let you use a class method as the function you pass to the
-    # threads.  I don't get it either.
-    mc = MonteCarlo(election, results_queue)
-    mc.run()
+    return seed
+
+def load_checkpoint(filename):
+    """Load a checkpoint saved by save_checkpoint()."""
+    
+    with gzip.open(filename, "rb") as checkpoint_file:
+        checkpoint = pickle.load(checkpoint_file)
+        
+    return checkpoint
+
+def save_checkpoint(filename, checkpoint):
+    """Save a checkpoint, i.e. a dictionary of snapshots of jobs' results
+    keyed on the jobs' support figures (see MonteCarloJob.key() and
+    MonteCarloJob.snapshot()), to a file.
+    """
+    
+    # Write to a temporary file first so that we never leave a half-written
+    # checkpoint behind.
+    temp_filename = filename + ".tmp"
+    with gzip.open(temp_filename, "wb") as checkpoint_file:
+        pickle.dump(checkpoint, checkpoint_file)
+    os.rename(temp_filename, filename)
+    
+    return
+
+def add_counts(totals, counts):
+    """Add a dictionary of counts into a dictionary of totals."""
     
+    for key in counts.keys():
+        if key in totals:
+            totals[key] += counts[key]
+        else:
+            totals[key] = counts[key]
+            
     return
 
+def modify_support(support, rng=random, modifiers=None):
+    """Return a tweaked copy of a support dictionary.  If given, 'modifiers'
+    is a list of the amounts to tweak each party's support by, in party code
+    order; otherwise they're drawn at random.
+    """
+    
+    modified_support = dict(support)
+    
+    # Poll results are always given to within a margin of error.  That means
+    # we can push each value up to SUPPORT_VARIATION percentage points in
+    # either direction and still be faithful to the provided poll numbers.
+    for party in modified_support.keys():
+        if modifiers is None:
+            modifier = rng.uniform(-SUPPORT_VARIATION, SUPPORT_VARIATION)
+        else:
+            modifier = modifiers[party]
+        modified_support[party] += modifier
+        
+    return modified_support
+
 def get_result_percentage(result, total_results):
     """Return the result as a percentage of all results."""
     
     return (float(result) / total_results) * 100
 
-def run_multithreaded_montecarlo(election, iterations):
-    """Run a Monte Carlo simulation using multiple threads to save time."""
+def run_multithreaded_montecarlo(election,
+                                 iterations,
+                                 engine=PYTHON_ENGINE,
+                                 block_size=None,
+                                 seed=None,
+                                 ci_width=None,
+                                 checkpoint_file=None,
+                                 resume=False,
+                                 sampling=SAMPLING_RANDOM,
+                                 importance=None,
+                                 adaptive=False):
+    """Run a Monte Carlo simulation using multiple threads to save time.  Runs
+    with the same seed, engine and block size give exactly the same results,
+    however many processes share the work.  To run several simulations in a
+    row, use a MonteCarloPool directly instead.
     
-    # Create a queue to hold the results.
-    results_queue = multiprocessing.Queue()
+    If ci_width is given, stop early once the confidence intervals are that
+    narrow (see MonteCarloPool.run()).  Progress is saved regularly to the
+    checkpoint file, if one is given, and picked up again from there if
+    'resume' is set.  'sampling' is one of SAMPLING_STRATEGIES.  To
+    importance sample, give the target to aim for (see
+    samplers.target_seats()).  Set 'adaptive' to use an adaptive proposal (see
+    MonteCarloPool).
+    """
     
-    # Create and start some processes ready to run the simulation.
-    processes = []
+    pool = MonteCarloPool(election,
+                          engine,
+                          block_size,
+                          seed,
+                          checkpoint_file=checkpoint_file,
+                          sampling=sampling,
+                          importance=importance,
+                          adaptive=adaptive)
+    if resume:
+        pool.resume()
+    pool.start()
     try:
-        for ii in range(multiprocessing.cpu_count()):
-            mc = MonteCarlo(election, results_queue)
-            proc = multiprocessing.Process(target=mc)
-            processes.append(proc)
-            proc.start()
-        
-        # Monitor the results queue so we can see them coming in.
-        results = []
-        too_divergent = 0
-        while len(results) < iterations:
-            logger.info("Results so far: {0} of {1}".format(len(results),
-                                                            iterations))
-            res = results_queue.get(block=True, timeout=RESULTS_TIMEOUT)
-            if not res.result_too_divergent:
-                results.append(res)
-            else:
-                logger.debug("Too divergent.")
-                logger.debug(str(res.support))
-                too_divergent += 1
-        logger.info("{0} results discarded for unacceptable "
-                    "divergence".format(too_divergent))
-    finally: 
-        # Make sure we kill all the processes if we're interrupted.   
-        for proc in processes:
-            proc.terminate()
-    
-    # All results are in, so now we can analyze them.
-    mcresult = MonteCarloResult()
-    mcresult.analyze(results)
+        mcresult = pool.run(iterations, ci_width=ci_width)
+        pool.close()
+    finally:
+        # Make sure we kill all the processes if we're interrupted.  If not,
+        # they've already stopped and there's nothing left to do.
+        pool.terminate()
     
-    return mcresult
\ No newline at end of file
+    return mcresult
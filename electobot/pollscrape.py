@@ -175,4 +175,31 @@ class PollScrape(object):
             
             
             
-    
\ No newline at end of file
+    
+
+# Functions
+def convert_party_names(polls):
+    """Convert saved polls from older versions, whose support figures and
+    results are keyed on party name, to be keyed on party code instead.  Polls
+    that already use party codes are left as they are.
+    """
+    
+    for poll in polls:
+        poll.support = utils.by_party_code(poll.support)
+        result = getattr(poll, "result", None)
+        if result is None:
+            continue
+        for attr in ["win_counts",
+                     "seats",
+                     "mean_seats",
+                     "stddev_seats",
+                     "largest_party_counts"]:
+            setattr(result, attr, utils.by_party_code(getattr(result, attr)))
+        result.most_seats_won_party = PARTY_CODES.get(
+                                                  result.most_seats_won_party,
+                                                  result.most_seats_won_party)
+        for const in result.const_wins:
+            result.const_wins[const] = utils.by_party_code(
+                                                       result.const_wins[const])
+    
+    return
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""
+Electobot
+by Philip Brien (http://github.com/ZsigE)
+
+Analysis and prediction tool based on the 2010 UK General Election results
+
+Answering single-election queries with the election data kept loaded
+"""
+
+# Python imports
+import logging
+import json
+
+# Electobot imports
+import electobot.utils as utils
+from electobot.constants import *
+
+# Set up logging
+logger = logging.getLogger("electobot.query")
+
+# Functions
+def parse_support(support):
+    """Convert a dictionary of percentage support keyed on party name, as
+    given in a query, into one keyed on party code.  Raises ValueError if
+    they can't be used.
+    """
+    
+    if not isinstance(support, dict):
+        raise ValueError("Support must be an object keyed on party name")
+    
+    parsed = {}
+    for party_name in support:
+        if party_name not in PARTY_CODES or PARTY_CODES[party_name] == OTH:
+            raise ValueError("Unknown party: {0}".format(party_name))
+        if not isinstance(support[party_name], (int, long, float)):
+            raise ValueError("Support for {0} must be a number".format(
+                                                                   party_name))
+        parsed[PARTY_CODES[party_name]] = float(support[party_name])
+    
+    return parsed
+
+def run_query(election, query, engine=PYTHON_ENGINE, seed=None):
+    """Simulate a single election for a query and return the answer.  The
+    query gives the percentage support for each party under "support", and
+    optionally support in Scotland under "scotland" and a "seed" to override
+    the default one.  The answer is the same as for a single election run
+    from the command line with the same support and seed.  Raises ValueError
+    if the query can't be answered.
+    """
+    
+    if not isinstance(query, dict) or "support" not in query:
+        raise ValueError("Query must be an object with a \"support\" entry")
+    
+    election.reset()
+    election.predicted_support = election.prepare_predicted_support(
+                                               parse_support(query["support"]))
+    election.regional_support = {}
+    if query.get("scotland") is not None:
+        election.regional_support = {"Scotland":
+                                     election.prepare_predicted_support(
+                                             parse_support(query["scotland"]))}
+    
+    seed = query.get("seed", seed)
+    rng = None
+    if seed is not None:
+        if not isinstance(seed, (int, long)):
+            raise ValueError("Seed must be an integer")
+        rng = utils.make_rng(seed, 0, engine)
+    
+    election.run(engine, rng)
+    result = election.result
+    
+    answer = {"summary": result.summary,
+              "winner": (PARTY_NAMES[result.winner] if result.winner is not None
+                         else None),
+              "largest_party": PARTY_NAMES[result.largest_party],
+              "margin_of_victory": result.margin_of_victory,
+              "seats": utils.by_party_name(result.seats),
+              "support": utils.by_party_name(result.support),
+              "possible_coalitions": result.possible_coalitions,
+              "ukip_stealth_targets": result.ukip_stealth_targets}
+    
+    return answer
+
+def serve(election, instream, outstream, engine=PYTHON_ENGINE, seed=None):
+    """Answer queries, one JSON object per line of 'instream', with one JSON
+    object per line of 'outstream', until 'instream' runs out.  A query that
+    can't be answered gets an object with an "error" entry instead.
+    
+    The election data is only loaded once, and the election is reset rather
+    than copied for each query, so each one is answered as fast as a single
+    election can be simulated.
+    """
+    
+    # Build the array form of the data up front, so that the first query
+    # isn't any slower than the rest.
+    if engine == NUMPY_ENGINE:
+        election.vectorize()
+    logger.info("Ready for queries")
+    
+    for line in iter(instream.readline, ""):
+        if line.strip() == "":
+            continue
+        try:
+            answer = run_query(election, json.loads(line), engine, seed)
+        except ValueError as err:
+            # A query we can't answer, or a line that isn't JSON.  Say so and
+            # carry on with the next one.
+            answer = {"error": str(err)}
+        logger.debug("Query {0} answered with {1}".format(line.strip(),
+                                                          answer))
+        outstream.write(json.dumps(answer, sort_keys=True) + "\n")
+        outstream.flush()
+    
+    return
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+"""
+Electobot
+by Philip Brien (http://github.com/ZsigE)
+
+Analysis and prediction tool based on the 2010 UK General Election results
+
+Sampling strategies for Monte Carlo simulations
+"""
+
+# Python imports
+import logging
+import math
+
+# Electobot imports
+from electobot.constants import *
+import utils
+
+# Set up logging
+logger = logging.getLogger("electobot.samplers")
+
+# Classes
+class MirroredRandom(object):
+    """Wrapper round a random.Random that reflects every uniform and normal
+    variate it gives about the middle of its distribution.  Given the same
+    stream as another generator, it gives the antithetic of each of that
+    generator's draws.  Anything else is passed straight through.
+    """
+    
+    def __init__(self, rng):
+        """Constructor."""
+        
+        self.rng = rng
+        
+        return
+    
+    def __getattr__(self, name):
+        """Pass anything we don't mirror through to the generator."""
+        
+        return getattr(self.rng, name)
+    
+    def uniform(self, a, b):
+        """Mirrored version of random.Random.uniform."""
+        
+        return a + b - self.rng.uniform(a, b)
+    
+    def normalvariate(self, mu, sigma):
+        """Mirrored version of random.Random.normalvariate."""
+        
+        return (2 * mu) - self.rng.normalvariate(mu, sigma)
+
+class MirroredRandomState(MirroredRandom):
+    """MirroredRandom for a NumPy RandomState."""
+    
+    def uniform(self, low=0.0, high=1.0, size=None):
+        """Mirrored version of RandomState.uniform."""
+        
+        return low + high - self.rng.uniform(low, high, size)
+    
+    def normal(self, loc=0.0, scale=1.0, size=None):
+        """Mirrored version of RandomState.normal."""
+        
+        return (2 * loc) - self.rng.normal(loc, scale, size)
+
+# Functions
+def block_rng(seed, block, engine, sampling=SAMPLING_RANDOM):
+    """Return the random number generator for a numbered block of a Monte Carlo
+    run.  With every strategy but SAMPLING_RANDOM, blocks go in pairs: each odd
+    block uses the same stream as the block before it, mirrored.
+    """
+    
+    if sampling == SAMPLING_RANDOM:
+        return utils.make_rng(seed, block, engine)
+    
+    rng = utils.make_rng(seed, block - (block % 2), engine)
+    if block % 2 == 1:
+        if engine == NUMPY_ENGINE:
+            rng = MirroredRandomState(rng)
+        else:
+            rng = MirroredRandom(rng)
+            
+    return rng
+
+def radical_inverse(index, base):
+    """Return the index'th number of the van der Corput sequence in the given
+    base, by reflecting its digits about the decimal point.
+    """
+    
+    inverse = 0.0
+    fraction = 1.0 / base
+    while index > 0:
+        inverse += (index % base) * fraction
+        index //= base
+        fraction /= base
+        
+    return inverse
+
+def halton_shift(seed):
+    """Return the random shift to apply to the Halton sequence for a run with
+    the given seed, one number for each party.
+    """
+    
+    rng = utils.make_rng(seed, "halton", PYTHON_ENGINE)
+    
+    return [rng.random() for party in PARTIES]
+
+def halton_modifiers(first, count, shift):
+    """Return the support modifiers for 'count' elections, starting with the
+    first'th election of a run, as a list with one list of modifiers in
+    party code order for each election.
+    
+    The modifiers are points of a Halton sequence, which fills the space of
+    possible modifiers much more evenly than independent random draws.  The
+    whole sequence is shifted by 'shift' (see halton_shift()), wrapping round,
+    so that each seed gives a different but equally even set of points.
+    """
+    
+    modifiers = []
+    
+    # The first point of the sequence is all zeroes, so skip it.
+    for index in range(first + 1, first + count + 1):
+        election_modifiers = []
+        for base, offset in zip(HALTON_BASES, shift):
+            point = (radical_inverse(index, base) + offset) % 1.0
+            election_modifiers.append(SUPPORT_VARIATION * ((2 * point) - 1))
+        modifiers.append(election_modifiers)
+        
+    return modifiers
+
+def random_modifiers(rng, count, engine):
+    """Return the support modifiers for 'count' elections, drawn at random as
+    by montecarlo.modify_support(), in the same form as halton_modifiers().
+    """
+    
+    if engine == NUMPY_ENGINE:
+        return rng.uniform(-SUPPORT_VARIATION,
+                           SUPPORT_VARIATION,
+                           (count, NUM_OF_PARTIES)).tolist()
+    
+    return [[rng.uniform(-SUPPORT_VARIATION, SUPPORT_VARIATION) for party in
+             PARTIES] for ii in range(count)]
+
+def target_seats(target):
+    """Return the number of seats an importance sampling target needs its
+    party to win nationally, or None if the target is a single constituency.
+    Targets are (party, constituency name) or (party, number of seats).
+    """
+    
+    if isinstance(target[1], int):
+        return target[1]
+    
+    return None
+
+def noise_tilts(target, const_names):
+    """Return the shifts to the noise in the votes, in the form of
+    Election.noise_tilt, for importance sampling towards the given target.
+    A national target shifts the party's votes in every one of 'const_names'.
+    """
+    
+    party = target[0]
+    if target_seats(target) is None:
+        return {target[1]: {party: IMPORTANCE_NOISE_TILT}}
+    
+    return dict((const_name, {party: IMPORTANCE_NATIONAL_NOISE_TILT}) for
+                const_name in const_names)
+
+def tilt_modifiers(modifiers, tilts):
+    """Tilt the support modifiers, as returned by halton_modifiers() or
+    random_modifiers(), for importance sampling or an adaptive proposal.
+    'tilts' gives the rate to tilt each party's modifiers at, keyed on party;
+    a positive rate tilts them towards the top of their range and a negative
+    one towards the bottom.  The modifiers are changed in place, and the log
+    of the importance weight for each election is returned.
+    
+    The modifiers are uniformly distributed, and are tilted onto a density
+    proportional to exp(tilt * modifier / SUPPORT_VARIATION) over the same
+    range by transforming them through its inverse CDF.
+    """
+    
+    log_weights = [0.0] * len(modifiers)
+    for party, tilt in tilts.items():
+        if tilt == 0:
+            continue
+        low = math.exp(-tilt)
+        high = math.exp(tilt)
+        log_normalizer = math.log((high - low) / (2 * tilt))
+        for ii, election_modifiers in enumerate(modifiers):
+            point = ((election_modifiers[party] + SUPPORT_VARIATION) /
+                     (2 * SUPPORT_VARIATION))
+            modifier = (SUPPORT_VARIATION *
+                        math.log(low + point * (high - low)) / tilt)
+            election_modifiers[party] = modifier
+            log_weights[ii] += log_normalizer - (tilt * modifier /
+                                                 SUPPORT_VARIATION)
+        
+    return log_weights
+
+def tilted_mean(tilt):
+    """Return the mean of support modifiers tilted at the given rate (see
+    tilt_modifiers()), as a fraction of SUPPORT_VARIATION.
+    """
+    
+    if tilt == 0:
+        return 0.0
+    
+    return (1 / math.tanh(tilt)) - (1 / tilt)
+
+def fit_tilts(modifiers, parties):
+    """Fit an adaptive proposal: return the tilts for each of the given
+    parties (see tilt_modifiers()) that give their support modifiers the same
+    means as in 'modifiers', which has the RunningStats of the modifiers of
+    the acceptable elections so far, keyed on party.
+    """
+    
+    tilts = {}
+    for party in parties:
+        if party not in modifiers:
+            tilts[party] = 0.0
+            continue
+        mean = modifiers[party].mean / SUPPORT_VARIATION
+        
+        # The mean only goes up with the tilt, so home in on it by bisection.
+        low = -ADAPTIVE_MAX_TILT
+        high = ADAPTIVE_MAX_TILT
+        for ii in range(50):
+            tilt = (low + high) / 2
+            if tilted_mean(tilt) < mean:
+                low = tilt
+            else:
+                high = tilt
+        tilts[party] = (low + high) / 2
+        
+    return tilts
@@ -11,124 +11,302 @@ Utility functions
 # Python imports
 import logging
 import math
+import random
+import hashlib
+
+# Electobot imports
+from constants import NUMPY_ENGINE, PARTY_NAMES, PARTY_CODES
     
 # Set up logging
 logger = logging.getLogger("electobot.utils")    
 
+# Constituencies to trace in debug logging.  If this is empty, debug logging
+# covers everything.
+trace_seats = set()
+
+def set_trace_seats(seats):
+    """Limit debug tracing in the simulation to the named constituencies."""
+    
+    trace_seats.clear()
+    trace_seats.update(seats)
+    
+    return
+
+def tracing(log, seat=None):
+    """Return whether the given logger should log debug messages about the
+    given constituency (or about no constituency in particular).  Hot paths
+    check this once, up front, so that they don't build messages that would be
+    thrown away.
+    """
+    
+    if not log.isEnabledFor(logging.DEBUG):
+        return False
+    elif len(trace_seats) > 0:
+        return seat in trace_seats
+    
+    return True
+
 def calculate_support(votes):
     """Given a number of votes for each party, calculate the percentage support
     enjoyed by each party.
     """
     
+    trace = tracing(logger)
     support = {}
     for party in votes.keys():
         support[party] = float(votes[party]) / sum(votes.values())
-        logger.debug("Support for {0}: {1}".format(party, support[party]))
+        if trace:
+            logger.debug("Support for {0}: {1}".format(PARTY_NAMES[party],
+                                                       support[party]))
         
     return support
 
+def by_party_name(values):
+    """Return a copy of a dictionary keyed on party code, keyed on party name
+    instead, for display.
+    """
+    
+    return dict((PARTY_NAMES[party], value) for party, value in
+                values.iteritems())
+
+def by_party_code(values):
+    """Return a copy of a dictionary keyed on party name, keyed on party code
+    instead.  Any keys that aren't party names are kept as they are.
+    """
+    
+    return dict((PARTY_CODES.get(key, key), value) for key, value in
+                values.iteritems())
+
 def calculate_swing(support_before, support_after):
     """Given levels of support for each party in before and after states, 
-    generate a swing matrix.
+    generate a swing matrix.  This is a dictionary view of the matrix from
+    calculate_swing_matrix, keyed by party code.
     """
     
-    # First work out the absolute swing - that is, whether support for each 
-    # party has gone up or down.
-    abs_swing = {}
-    for party in support_before.keys():
-        if party in support_after.keys():
-            abs_swing[party] = support_after[party] - support_before[party]     
+    # Put the parties in a fixed order.  Any party with no support level
+    # provided afterwards is treated as having zero swing, and any new party
+    # as if all its support swung into place.
+    old_parties = support_before.keys()
+    new_parties = [party for party in support_after if
+                   party not in support_before]
+    parties = old_parties + new_parties
+    before = support_before.values() + [0] * len(new_parties)
+    after = ([support_after[party] if party in support_after else
+              support_before[party] for party in old_parties] +
+             [support_after[party] for party in new_parties])
+    abs_swing = calculate_absolute_swing(before, after)
+    matrix = swing_matrix_from_absolute(abs_swing)
+    
+    # Each party's row only includes the parties that swung the other way or
+    # not at all (a zero-swing party's row includes everyone).
+    all_columns = range(len(parties))
+    not_up = [ii for ii in all_columns if abs_swing[ii] <= 0]
+    not_down = [ii for ii in all_columns if abs_swing[ii] >= 0]
+    swing_matrix = {}
+    for to_party, to_swing, row in zip(parties, abs_swing, matrix):
+        if to_swing > 0:
+            columns = not_up
+        elif to_swing < 0:
+            columns = not_down
         else:
-            # No support level provided for this party - treat this as a zero
-            # swing.
-            abs_swing[party] = 0
-        logger.debug("{0} absolute swing is {1}".format(party,
-                                                        abs_swing[party])) 
-           
-    # Now fill in any new parties as if all their support swung into place.
-    for party in (set(support_after.keys()) - set(support_before.keys())):
-        abs_swing[party] = support_after[party]
-        logger.debug("{0} absolute swing is {1}".format(party,
-                                                        abs_swing[party])) 
-        
-    # Sort parties into those with positive and negative swings.  Zero swings
-    # count as neither.
-    positive_swings = {party:abs_swing[party] for party in abs_swing.keys() if 
-                                                           abs_swing[party] > 0}
-    negative_swings = {party:abs_swing[party] for party in abs_swing.keys() if 
-                                                           abs_swing[party] < 0}
-    zero_swings = {party:0 for party in abs_swing.keys() if 
-                                                          abs_swing[party] == 0}
-    
-    # Calculate the relative support for each of the parties in the positive and
-    # negative groups.
-    positive_support = {}
-    for party in positive_swings.keys():
-        positive_support[party] = (positive_swings[party] /
-                                   sum(positive_swings.values()))
-        logger.debug("{0} has {1} proportion of all positive support".
-                                         format(party, positive_support[party]))
-    negative_support = {}
-    for party in negative_swings.keys():
-        negative_support[party] = (negative_swings[party] /
-                                   sum(negative_swings.values()))
-        logger.debug("{0} has {1} proportion of all negative support".
-                                         format(party, negative_support[party]))
-    
-    # Create the swing matrix.  Basic rule is that parties with positive swing
-    # must have taken that swing from parties with negative swing.  We don't
-    # know how much came from each party, so take it proportional to each
-    # party's support.
+            columns = all_columns
+        swing_matrix[to_party] = dict([(parties[ii], row[ii]) for
+                                       ii in columns])
+            
+    return swing_matrix
+
+def calculate_absolute_swing(support_before, support_after):
+    """Given lists of support for each party (in the same fixed order) in
+    before and after states, work out whether support for each party has gone
+    up or down.
+    """
+    
+    return [after - before for before, after in zip(support_before,
+                                                    support_after)]
+
+def calculate_swing_matrix(support_before, support_after):
+    """Given lists of support for each party (in the same fixed order) in 
+    before and after states, generate a swing matrix as a list of rows.  Entry
+    [ii][jj] is the swing to party ii from party jj.
+    """
+    
+    return swing_matrix_from_absolute(calculate_absolute_swing(support_before,
+                                                               support_after))
+
+def swing_matrix_from_absolute(abs_swing):
+    """Generate the swing matrix, as for calculate_swing_matrix, from the list
+    of each party's absolute swing.
+    """
+    
+    # Calculate the relative support for each of the parties with positive
+    # and negative swings.  Zero swings count as neither.
+    total_positive = sum([swing for swing in abs_swing if swing > 0])
+    total_negative = sum([swing for swing in abs_swing if swing < 0])
+    positive_share = [(swing / total_positive) if swing > 0 else 0 for
+                      swing in abs_swing]
+    negative_share = [(swing / total_negative) if swing < 0 else 0 for
+                      swing in abs_swing]
+    
+    # Basic rule is that parties with positive swing must have taken that
+    # swing from parties with negative swing.  We don't know how much came from
+    # each party, so take it proportional to each party's support - and parcel
+    # out negative swing as being "from" the positive-swing parties in the
+    # same way.  That makes the matrix the outer product of each party's swing
+    # with the shares of the parties on the other side.
     #
     # (Technically, this is not true in the real world.  Any number of Labour
     # voters might switch to Conservative, and Labour's support could still rise
     # if they get their votes from other parties.  But it all looks the same to
     # the statistics, so screw it.)
-    swing_matrix = {}
-    for to_party in positive_swings.keys():
-        swing = abs_swing[to_party]
-        swing_matrix[to_party] = {}
-        for from_party in negative_swings.keys():
-            swing_matrix[to_party][from_party] = (swing * 
-                                                  negative_support[from_party])
-            logger.debug("Swing from {0} to {1}: {2}".
-                                     format(from_party, 
-                                            to_party,
-                                            swing_matrix[to_party][from_party]))
-        for from_party in zero_swings.keys():
-            swing_matrix[to_party][from_party] = 0
-            logger.debug("Swing from {0} to {1}: {2}".
-                                     format(from_party, 
-                                            to_party,
-                                            swing_matrix[to_party][from_party]))
-    
-    # Parcel out negative swing as being "from" the positive-swing parties in 
-    # the same way.
-    for to_party in negative_swings.keys():
-        swing = abs_swing[to_party]
-        swing_matrix[to_party] = {}
-        for from_party in positive_swings.keys():
-            swing_matrix[to_party][from_party] = (swing * 
-                                                  positive_support[from_party])
-            logger.debug("Swing from {0} to {1}: {2}".
-                                     format(from_party, 
-                                            to_party,
-                                            swing_matrix[to_party][from_party]))
-        for from_party in zero_swings.keys():
-            swing_matrix[to_party][from_party] = 0  
-            logger.debug("Swing from {0} to {1}: {2}".
-                                     format(from_party, 
-                                            to_party,
-                                            swing_matrix[to_party][from_party]))          
-    
-    # Record that zero-swing parties haven't swung to or from anyone.
-    for to_party in zero_swings.keys():
-        swing_matrix[to_party] = {}
-        for from_party in (abs_swing.keys()):
-            swing_matrix[to_party][from_party] = 0
-            
+    swing_matrix = []
+    for swing in abs_swing:
+        if swing > 0:
+            swing_matrix.append([swing * share for share in negative_share])
+        elif swing < 0:
+            swing_matrix.append([swing * share for share in positive_share])
+        else:
+            # Zero-swing parties haven't swung to or from anyone.
+            swing_matrix.append([0] * len(abs_swing))
+    
     return swing_matrix
         
+class RunningStats(object):
+    """Running count, mean and standard deviation of a stream of values, which
+    may be weighted.  This uses Welford's algorithm, so the values themselves
+    don't need to be kept.
+    """
+    
+    def __init__(self):
+        """Constructor.  Start with no values."""
+        
+        self.count = 0  # Total weight of the values
+        self.sq_weights = 0  # Sum of the squared weights
+        self.mean = 0.0
+        self.sq_dev = 0.0  # Sum of weighted squared deviations from the mean
+        
+        return
+    
+    def add(self, value, weight=1):
+        """Add a value to the stream."""
+        
+        self.count += weight
+        self.sq_weights += weight * weight
+        delta = value - self.mean
+        self.mean += delta * weight / self.count
+        self.sq_dev += weight * delta * (value - self.mean)
+        
+        return
+    
+    def add_array(self, values, weights):
+        """Add a NumPy array of values, with an array of their weights, to the
+        stream all at once.
+        """
+        
+        batch = RunningStats()
+        batch.count = weights.sum().item()
+        if batch.count == 0:
+            return
+        batch.sq_weights = (weights * weights).sum().item()
+        batch.mean = float((values * weights).sum()) / batch.count
+        deviations = values - batch.mean
+        batch.sq_dev = (weights * deviations * deviations).sum().item()
+        self.merge(batch)
+        
+        return
+    
+    def merge(self, other):
+        """Add all the values from another RunningStats to this one, as if
+        they'd been added one by one (give or take rounding errors).
+        """
+        
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.sq_dev += (other.sq_dev +
+                        delta * delta * self.count * other.count / count)
+        self.count = count
+        self.sq_weights += other.sq_weights
+        
+        return
+    
+    def total(self):
+        """Return the sum of all the values."""
+        
+        return self.mean * self.count
+    
+    def std_dev(self):
+        """Return the standard deviation of the values, calculated in the same
+        way as std_dev().
+        """
+        
+        if self.count == 0:
+            return 0.0
+        
+        return math.sqrt(self.sq_dev / self.count)
+    
+    def effective_count(self):
+        """Return the effective number of values, i.e. the number of unweighted
+        values that would give a mean as precise as this one.  Without weights
+        this is just the count.
+        """
+        
+        if self.count == 0:
+            return 0.0
+        
+        return effective_sample_size(self.count, self.sq_weights)
+    
+    def std_error(self):
+        """Return the standard error of the mean of the values."""
+        
+        if self.count == 0:
+            return float("inf")
+        
+        return self.std_dev() / math.sqrt(self.effective_count())
+
+def effective_sample_size(total_weight, sq_weights):
+    """Return Kish's effective sample size for a set of weighted samples, given
+    the sum of their weights and the sum of their squared weights.
+    """
+    
+    return float(total_weight) * total_weight / sq_weights
+
+def normal_tilt_log_weight(value, mean, stdev, tilt):
+    """Return the log of the importance weight for a value drawn from a normal
+    distribution whose mean was shifted by 'tilt' standard deviations, to make
+    up for the shift.
+    """
+    
+    deviation = (value - mean) / stdev
+    
+    return (tilt * tilt / 2) - (tilt * deviation)
+
+def stream_seed(seed, stream):
+    """Derive the seed for one numbered random number stream from the seed for
+    a whole run.  Hashing the two together gives streams that are independent
+    of each other, however many of them there are.
+    """
+    
+    digest = hashlib.sha256("{0}:{1}".format(seed, stream)).hexdigest()
+    
+    return long(digest, 16)
+
+def make_rng(seed, stream, engine):
+    """Return a random number generator for the given stream of a run with the
+    given seed, of the right kind for the given simulation engine.
+    """
+    
+    if engine == NUMPY_ENGINE:
+        # NumPy generators take their seed as an array of 32-bit words.
+        import numpy as np
+        
+        seed = stream_seed(seed, stream)
+        words = [(seed >> (32 * ii)) & 0xffffffff for ii in range(8)]
+        return np.random.RandomState(words)
+    
+    return random.Random(stream_seed(seed, stream))
+
 def std_dev(array):
     """Python 2.7 does not include a standard deviation function, which is kind
     of ludicrous.  Re-implement a simplified version of the NumPy one.
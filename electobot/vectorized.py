@@ -0,0 +1,568 @@
+#!/usr/bin/python
+"""
+Electobot
+by Philip Brien (http://github.com/ZsigE)
+
+Analysis and prediction tool based on the 2010 UK General Election results
+
+Vectorized election engine, working on NumPy arrays of votes
+"""
+
+# Python imports
+import logging
+import ctypes
+from multiprocessing.sharedctypes import RawArray
+
+# Third-party imports
+import numpy as np
+
+# Electobot imports
+from electobot.constants import *
+from electobot.election import Result
+
+# Set up logging
+logger = logging.getLogger("electobot.vectorized")
+
+# The coalitions that Result.analyze_seats considers for a hung parliament,
+# in the order it tries them.  Only the first feasible one with each senior
+# partner counts.
+CON_COALITIONS = [("CON-LD", [CON, LD]),
+                  ("CON-UKP", [CON, UKP]),
+                  ("CON-LD-OTH", [CON, LD, OTH]),
+                  ("CON-OTH", [CON, OTH]),
+                  ("CON-UKP-OTH", [CON, UKP, OTH])]
+LAB_COALITIONS = [("LAB-LD", [LAB, LD]),
+                  ("LAB-LD-PC", [LAB, LD, PC]),
+                  ("LAB-LD-GRN", [LAB, LD, GRN]),
+                  ("LAB-LD-PC-GRN", [LAB, LD, PC, GRN]),
+                  ("LAB-PC", [LAB, PC]),
+                  ("LAB-LD-OTH", [LAB, LD, OTH]),
+                  ("LAB-LD-PC-OTH", [LAB, LD, PC, OTH]),
+                  ("LAB-LD-GRN-OTH", [LAB, LD, GRN, OTH]),
+                  ("LAB-LD-PC-GRN-OTH", [LAB, LD, PC, GRN, OTH])]
+
+# Classes
+class VectorizedElection(object):
+    """Array form of an Election.  Holds the 2005 and 2010 votes as
+    (constituencies x parties) arrays, with the parties in party code order,
+    and runs the same model as Constituency.predict_votes and
+    Constituency.simulate for every seat at once.
+    """
+    
+    # The base data arrays, which never change once they've been created.
+    base_arrays = ["votes_2005",
+                   "votes_2010",
+                   "total_votes_2010",
+                   "support_2010",
+                   "national_support_2010",
+                   "abs_swing_05_10",
+                   "swing_lengths_05_10",
+                   "region_index",
+                   "regional_votes_2010",
+                   "no_ukip_2010"]
+
+    def __init__(self, election):
+        """Constructor.  Convert the election's data into arrays and work out
+        everything that doesn't depend on the predicted support.
+        """
+
+        self.names = sorted(election.constituencies.keys())
+        constituencies = [election.constituencies[name] for name in self.names]
+
+        # Votes for each party in each constituency.
+        self.votes_2005 = np.array([[const.votes_2005[party] for party in
+                                     PARTIES] for const in constituencies],
+                                   dtype=float)
+        self.votes_2010 = np.array([[const.votes_2010[party] for party in
+                                     PARTIES] for const in constituencies],
+                                   dtype=float)
+        self.total_votes_2010 = self.votes_2010.sum(axis=1)
+        self.support_2010 = calculate_support(self.votes_2010)
+        self.national_support_2010 = calculate_support(
+                                                    self.votes_2010.sum(axis=0))
+
+        # The 2005-2010 swing never changes, so its contribution to the
+        # mean absolute swing can be worked out now.
+        swing_05_10, self.swing_lengths_05_10 = swing_terms(
+                                          calculate_support(self.votes_2005),
+                                          self.support_2010,
+                                          np.ones(NUM_OF_PARTIES, dtype=bool))
+        self.abs_swing_05_10 = np.abs(swing_05_10)
+
+        # Regions, and the total 2010 votes in each of them.
+        self.regions = sorted(set(const.region for const in constituencies))
+        self.region_index = np.array([self.regions.index(const.region) for
+                                      const in constituencies])
+        self.regional_votes_2010 = np.array([
+                      self.votes_2010[self.region_index == ii].sum(axis=0) for
+                      ii in range(len(self.regions))])
+
+        # Seats of special interest when analyzing the results.
+        self.no_ukip_2010 = (self.votes_2010[:, UKP] == 0)
+        self.stealth_seats = np.flatnonzero(self.no_ukip_2010)
+        self.brighton = self.names.index("Brighton Pavilion")
+
+        # Layout of the compact records used to pass results between
+        # processes: the seats won by each party, the index of the winning
+        # party in each constituency, the winning margin in each possible UKIP
+        # stealth target (zero if it isn't a target this time), the index of
+        # the party with the most votes, a set of RECORD_ flags, the
+        # importance weight of the election and, with an adaptive proposal,
+        # the modifiers to its support.
+        self.record_dtype = np.dtype([
+                          ("seats", "<i2", (NUM_OF_PARTIES,)),
+                          ("winners", "u1", (len(self.names),)),
+                          ("stealth_margins", "<i4", (len(self.stealth_seats),)),
+                          ("most_votes_party", "u1"),
+                          ("flags", "u1"),
+                          ("weight", "<f8"),
+                          ("modifiers", "<f4", (NUM_OF_PARTIES,))])
+        
+        # Shared memory blocks holding the base data, if it has been shared.
+        self.shared = None
+
+        return
+
+    def __deepcopy__(self, memo):
+        """Deep copy support.  Nothing in here changes once it's been created,
+        so copies of an Election can all use the same one.
+        """
+
+        return self
+
+    def __getstate__(self):
+        """Pickle support.  If the base data is in shared memory, pass on the
+        shared memory blocks rather than copies of the arrays.
+        """
+
+        state = self.__dict__.copy()
+        if self.shared is not None:
+            for name in self.base_arrays:
+                del state[name]
+
+        return state
+
+    def __setstate__(self, state):
+        """Unpickle support.  Attach to the shared base data if there is any.
+        """
+
+        self.__dict__.update(state)
+        if self.shared is not None:
+            for name in self.base_arrays:
+                block, dtype, shape = self.shared[name]
+                setattr(self, name, shared_array_view(block, dtype, shape))
+
+        return
+
+    def share(self):
+        """Move the base data into shared memory, so that Monte Carlo worker
+        processes can all read one copy of it rather than each having their
+        own.  The arrays are read-only from then on.
+        """
+
+        if self.shared is not None:
+            return
+
+        self.shared = {}
+        for name in self.base_arrays:
+            array = getattr(self, name)
+            block = RawArray(ctypes.c_char, max(array.nbytes, 1))
+            view = shared_array_view(block, array.dtype, array.shape)
+            view.flags.writeable = True
+            view[...] = array
+            view.flags.writeable = False
+            self.shared[name] = (block, array.dtype, array.shape)
+            setattr(self, name, view)
+
+        return
+
+    def predict_votes(self, support, present, regional_support, rng=np.random):
+        """Predict the vote distribution in every constituency for a block of
+        elections.  'support' is an (elections x parties) array of national
+        support and 'present' shows which parties have support figures.
+        Returns an (elections x constituencies x parties) array of votes.
+        """
+
+        mean_votes, stdev = self.vote_distribution(support,
+                                                   present,
+                                                   regional_support)
+
+        return np.trunc(rng.normal(mean_votes, stdev))
+
+    def predict_tilted_votes(self,
+                             support,
+                             present,
+                             regional_support,
+                             noise_tilt,
+                             rng=np.random):
+        """Version of predict_votes() for importance sampling, shifting the
+        noise in the votes by 'noise_tilt' (a constituencies x parties array,
+        in standard deviations).  Returns the votes and the log of the
+        importance weight that makes up for the shift in each election.
+        """
+
+        mean_votes, stdev = self.vote_distribution(support,
+                                                   present,
+                                                   regional_support)
+        votes = rng.normal(mean_votes + (noise_tilt * stdev), stdev)
+
+        # Only votes that were actually shifted affect the weights.
+        tilted = (noise_tilt * stdev) != 0
+        deviation = (votes - mean_votes) / np.where(tilted, stdev, 1)
+        log_weights = np.where(tilted,
+                               (noise_tilt * noise_tilt / 2) -
+                               (noise_tilt * deviation),
+                               0).sum(axis=(1, 2))
+
+        return np.trunc(votes), log_weights
+
+    def noise_tilt_array(self, noise_tilt):
+        """Convert shifts to the noise in the votes, in the form of
+        Election.noise_tilt, into an array for predict_tilted_votes().
+        """
+
+        tilt_array = np.zeros((len(self.names), NUM_OF_PARTIES))
+        for const_name in noise_tilt:
+            for party in noise_tilt[const_name]:
+                tilt_array[self.names.index(const_name),
+                           party] = noise_tilt[const_name][party]
+
+        return tilt_array
+
+    def vote_distribution(self, support, present, regional_support):
+        """Work out the mean and standard deviation of the votes for each
+        party in every constituency for a block of elections (see
+        predict_votes()).
+        """
+
+        num_of_seats = len(self.names)
+
+        # Work out the general swing for each seat - national, unless we have
+        # support figures for its region.
+        national_swing = swing_terms(self.national_support_2010,
+                                     support,
+                                     present)[0]
+        general_swing = np.repeat(national_swing[:, np.newaxis, :],
+                                  num_of_seats,
+                                  axis=1)
+        target_support = np.repeat(support[:, np.newaxis, :],
+                                   num_of_seats,
+                                   axis=1)
+        target_present = np.tile(present, (num_of_seats, 1))
+        for region in regional_support:
+            region_support, region_present = support_to_array(
+                                                      regional_support[region])
+            region_ii = self.regions.index(region)
+            in_region = (self.region_index == region_ii)
+            general_swing[:, in_region] = swing_terms(
+                                           self.regional_votes_2010[region_ii],
+                                           region_support,
+                                           region_present)[0]
+            target_support[:, in_region] = region_support
+            target_present[in_region] = region_present
+
+        # Give each party the votes it got last time, modified by the general
+        # swing towards that party, but never less than zero.
+        mean_votes = self.votes_2010 + np.trunc(
+                       general_swing * self.total_votes_2010[:, np.newaxis])
+        mean_votes = np.maximum(mean_votes, 0)
+
+        # Pick the actual number of votes from a normal distribution, with the
+        # standard deviation scaled to how swingy each party is in each seat.
+        local_swing, local_lengths = swing_terms(self.support_2010,
+                                                 target_support,
+                                                 target_present)
+        mean_absolute_swing = ((np.abs(local_swing) + self.abs_swing_05_10) /
+                               (local_lengths + self.swing_lengths_05_10))
+        stdev = 0.5 * mean_votes * mean_absolute_swing * SWING_SCALE_FACTOR
+
+        return mean_votes, stdev
+
+    def simulate(self, sim_votes, rng=np.random):
+        """Find the index of the winning party in each constituency."""
+
+        # Exact ties are settled by drawing lots.  The vote counts are whole
+        # numbers, so adding a random fraction to each one breaks ties without
+        # changing who wins anywhere else.
+        return np.argmax(sim_votes + rng.random_sample(sim_votes.shape),
+                         axis=-1)
+
+    def check_divergence(self, support, present, sim_votes):
+        """Work out whether each election in a block is too divergent to stand,
+        i.e. whether the overall support from its votes is too far from the
+        support figures for any party we had figures for.  Returns the mask of
+        divergent elections and the overall support in each election.
+        """
+
+        overall_support = calculate_support(sim_votes.sum(axis=1))
+        divergent = ((np.abs(support - overall_support) >
+                      RESULT_TOLERANCE) & present).any(axis=1)
+
+        return divergent, overall_support
+
+    def make_records(self, sim_votes, winners, divergent):
+        """Summarize each election in a block as a compact record (see
+        record_dtype).
+        """
+
+        records = np.zeros(len(winners), dtype=self.record_dtype)
+        records["seats"] = (winners[..., np.newaxis] ==
+                            np.arange(NUM_OF_PARTIES)).sum(axis=1)
+        records["winners"] = winners
+
+        # Who won the popular vote?
+        records["most_votes_party"] = np.argmax(sim_votes.sum(axis=1), axis=1)
+
+        # UKIP stealth targets are heavy Conservative wins where UKIP didn't
+        # stand in 2010.  Record the margin in each of those seats, or zero
+        # where it isn't a target.
+        ranked = np.sort(sim_votes, axis=-1)
+        margins = ranked[..., -1] - ranked[..., -2]
+        stealth_targets = ((winners == CON) & (margins > 1000))
+        records["stealth_margins"] = np.where(stealth_targets,
+                                              margins,
+                                              0)[:, self.stealth_seats]
+
+        greens_hold_brighton = (winners[:, self.brighton] == GRN)
+        records["flags"] = ((divergent * RECORD_TOO_DIVERGENT) |
+                            (greens_hold_brighton *
+                             RECORD_GREENS_HOLD_BRIGHTON))
+
+        return records
+
+    def record_outcome(self, record):
+        """Build a Result from a compact record, filling in everything except
+        the details of individual seats.
+        """
+
+        result = Result()
+        for party, seats in zip(PARTIES, record["seats"].tolist()):
+            result.seats[party] = seats
+        result.analyze_seats()
+
+        # Was the party with the most seats the popular vote winner?
+        result.most_votes_party = record["most_votes_party"].item()
+        result.seat_winner_is_pop_winner = (result.largest_party ==
+                                            result.most_votes_party)
+
+        flags = record["flags"]
+        result.greens_hold_brighton = bool(flags & RECORD_GREENS_HOLD_BRIGHTON)
+        result.result_too_divergent = bool(flags & RECORD_TOO_DIVERGENT)
+
+        return result
+
+    def record_coalitions(self, seats):
+        """Work out the possible coalitions for a whole array of records' seats
+        at once, in the same way as Result.analyze_seats.  Return a dictionary
+        of boolean arrays, keyed on coalition name, saying which records have
+        that coalition as a possibility.
+        """
+
+        hung = (seats.max(axis=1) < NEEDED_FOR_MAJORITY)
+        coalitions = {}
+        any_feasible = np.zeros(len(seats), dtype=bool)
+        for options in [CON_COALITIONS, LAB_COALITIONS]:
+            untried = hung.copy()
+            for name, parties in options:
+                feasible = untried & (seats[:, parties].sum(axis=1) >=
+                                      NEEDED_FOR_MAJORITY)
+                coalitions[name] = feasible
+                untried &= ~feasible
+            any_feasible |= (hung & ~untried)
+        coalitions["NONE"] = hung & ~any_feasible
+
+        return coalitions
+
+    def decode_records(self, data):
+        """Convert a string of packed records back into an array of them."""
+
+        return np.frombuffer(data, dtype=self.record_dtype)
+
+    def analyze(self, support, present, sim_votes, winners):
+        """Build a Result for each election in a block from the simulated
+        votes and winners.
+        """
+
+        divergent, overall_support = self.check_divergence(support,
+                                                           present,
+                                                           sim_votes)
+        records = self.make_records(sim_votes, winners, divergent)
+
+        results = []
+        for record, row_support in zip(records, overall_support):
+            result = self.record_outcome(record)
+
+            # Record the winner of each constituency, and which ones were won
+            # by UKIP and the Lib Dems.
+            winners = record["winners"]
+            result.const_winners = dict(zip(self.names, winners.tolist()))
+            result.ukip_seats = [self.names[ii] for ii in
+                                 np.flatnonzero(winners == UKP)]
+            result.libdem_seats = [self.names[ii] for ii in
+                                   np.flatnonzero(winners == LD)]
+
+            margins = record["stealth_margins"]
+            for ii in np.flatnonzero(margins):
+                name = self.names[self.stealth_seats[ii]]
+                result.ukip_stealth_targets[name] = int(margins[ii])
+
+            result.support = dict(zip(PARTIES, row_support.tolist()))
+            if result.result_too_divergent:
+                logger.debug("Result too far from prediction!")
+
+            results.append(result)
+
+        return results
+
+    def run_block(self, support, present, regional_support, rng=np.random):
+        """Run a block of elections, one for each row of the support array,
+        and return a list of their Results.
+        """
+
+        sim_votes = self.predict_votes(support, present, regional_support, rng)
+        winners = self.simulate(sim_votes, rng)
+
+        return self.analyze(support, present, sim_votes, winners)
+
+    def run_block_records(self,
+                          support,
+                          present,
+                          regional_support,
+                          rng=np.random,
+                          noise_tilt=None,
+                          log_weights=None):
+        """Run a block of elections, one for each row of the support array,
+        and return an array of compact records of their results.  Elections
+        that are too divergent to stand are abandoned as soon as the votes are
+        known, and their records only have the RECORD_TOO_DIVERGENT flag set.
+
+        For importance sampling, give the shifts to the noise in the votes as
+        an array from noise_tilt_array(), and the log of the importance weight
+        that makes up for any tilt to the support of each election; the
+        records then carry the final weights.
+        """
+
+        if noise_tilt is None:
+            sim_votes = self.predict_votes(support,
+                                           present,
+                                           regional_support,
+                                           rng)
+        else:
+            sim_votes, noise_log_weights = self.predict_tilted_votes(
+                                                               support,
+                                                               present,
+                                                               regional_support,
+                                                               noise_tilt,
+                                                               rng)
+            if log_weights is None:
+                log_weights = noise_log_weights
+            else:
+                log_weights = np.asarray(log_weights) + noise_log_weights
+        divergent = self.check_divergence(support, present, sim_votes)[0]
+
+        records = np.zeros(len(support), dtype=self.record_dtype)
+        records["flags"] = divergent * RECORD_TOO_DIVERGENT
+        accepted = np.flatnonzero(~divergent)
+        if len(accepted) > 0:
+            sim_votes = sim_votes[accepted]
+            winners = self.simulate(sim_votes, rng)
+            records[accepted] = self.make_records(sim_votes,
+                                                  winners,
+                                                  divergent[accepted])
+        if log_weights is None:
+            records["weight"] = 1
+        else:
+            records["weight"] = np.exp(log_weights)
+
+        return records
+
+    def run(self, predicted_support, regional_support, rng=None):
+        """Run a single election and return its Result."""
+
+        if rng is None:
+            rng = np.random
+        support, present = support_to_array(predicted_support)
+
+        return self.run_block(support[np.newaxis, :],
+                              present,
+                              regional_support,
+                              rng)[0]
+
+# Functions
+def calculate_support(votes):
+    """Array version of utils.calculate_support.  The last axis of the votes
+    array is the party.
+    """
+
+    return votes / votes.sum(axis=-1)[..., np.newaxis]
+
+def support_to_array(support):
+    """Convert a support dictionary into an array in party code order, plus a
+    mask showing which parties actually have a support figure.
+    """
+
+    values = np.zeros(NUM_OF_PARTIES)
+    present = np.zeros(NUM_OF_PARTIES, dtype=bool)
+    for party in support:
+        values[party] = support[party]
+        present[party] = True
+
+    return values, present
+
+def shared_array_view(block, dtype, shape):
+    """Return a read-only array view onto a shared memory block."""
+
+    view = np.frombuffer(block, dtype=dtype, count=int(np.prod(shape)))
+    view = view.reshape(shape)
+    view.flags.writeable = False
+
+    return view
+
+def perturb_support(predicted_support, size, rng=np.random, modifiers=None):
+    """Array version of MonteCarlo.get_modified_support.  Returns a block of
+    'size' tweaked copies of the support dictionary as an (elections x parties)
+    array, plus the mask of parties that have support figures.  If given,
+    'modifiers' is a list of lists of the amounts to tweak each election's
+    support by, in party code order; otherwise they're drawn at random.
+    """
+
+    support, present = support_to_array(predicted_support)
+    if modifiers is None:
+        modifiers = rng.uniform(-SUPPORT_VARIATION,
+                                SUPPORT_VARIATION,
+                                (size, NUM_OF_PARTIES))
+    else:
+        modifiers = np.array(modifiers)
+
+    return support + (modifiers * present), present
+
+def swing_terms(support_before, support_after, present):
+    """Work out the parts of the utils.calculate_swing matrix that the model
+    actually uses, without building the matrix itself.  Returns the sum of
+    each party's row of the matrix and the number of entries in that row.
+
+    The last axis of each array is the party.  Parties with no 'after' figure
+    (as shown by the 'present' mask) count as having no swing.
+    """
+
+    swing = np.where(present, support_after - support_before, 0.0)
+    positive = swing > 0
+    negative = swing < 0
+    num_positive = positive.sum(axis=-1)[..., np.newaxis]
+    num_negative = negative.sum(axis=-1)[..., np.newaxis]
+
+    # A party with positive swing takes it proportionally from each of the
+    # parties with negative swing (and vice versa), so its row adds up to its
+    # own swing - unless there is nobody on the other side to take it from.
+    has_partners = np.where(positive, num_negative > 0, num_positive > 0)
+    row_sums = np.where(has_partners, swing, 0.0)
+
+    # Rows cover every party except those on the same side, apart from
+    # zero-swing parties, whose rows cover everyone.
+    row_lengths = np.where(positive,
+                           NUM_OF_PARTIES - num_positive,
+                           np.where(negative,
+                                    NUM_OF_PARTIES - num_negative,
+                                    NUM_OF_PARTIES))
+
+    return row_sums, row_lengths
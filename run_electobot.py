@@ -21,6 +21,7 @@ import electobot.election as election
 from electobot.constants import *
 import electobot.montecarlo as montecarlo
 import electobot.pollscrape as pollscrape
+import electobot.utils as utils
 
 # Set up logging
 logger = logging.getLogger("electobot")
@@ -46,6 +47,14 @@ def run_electobot():
                         action="store_true",
                         default=False,
                         dest="debug")
+    parser.add_argument("--trace-seat",
+                        help="Switch on debug logging, but only trace the "
+                             "simulation in this constituency (may be given "
+                             "more than once)",
+                        action="append",
+                        default=[],
+                        metavar="NAME",
+                        dest="trace_seats")
     
     fileopts = parser.add_argument_group("File options")
     fileopts.add_argument("--loadfile", "-p",
@@ -56,6 +65,18 @@ def run_electobot():
                           help="Filename for saving results data",
                           action="store",
                           dest="savefile")
+    fileopts.add_argument("--checkpoint-file",
+                          help="File for saving the progress of Monte Carlo "
+                               "simulations (by default, progress isn't "
+                               "saved)",
+                          action="store",
+                          default=None,
+                          dest="checkpoint_file")
+    fileopts.add_argument("--resume",
+                          help="Carry on Monte Carlo simulations from the "
+                               "checkpoint file given by --checkpoint-file",
+                          action="store_true",
+                          dest="resume")
     fileopts.add_argument("--summary-file", 
                           help="Filename for saving summary data",
                           action="store",
@@ -67,16 +88,120 @@ def run_electobot():
                          help="Simulate a single election",
                          action="store_true",
                          dest="single_election")
+    simopts.add_argument("--query",
+                         help="Keep the election data loaded and simulate a "
+                              "single election for each query read from "
+                              "stdin, one JSON object per line, such as "
+                              "{\"support\": {\"Labour\": 35, "
+                              "\"Conservative\": 33}}. Answers are written "
+                              "to stdout, one JSON object per line",
+                         action="store_true",
+                         dest="query")
     simopts.add_argument("--montecarlo", "-m",
-                         help="Run a Monte Carlo simulation",
+                         help="Run a Monte Carlo simulation (with --ci-width, "
+                              "the most iterations to run)",
                          action="store",
                          type=int,
                          default=0,
                          dest="iterations")
+    simopts.add_argument("--ci-width",
+                         help="Run a Monte Carlo simulation until every 95%% "
+                              "confidence interval on mean seats (in seats) "
+                              "and win chances (in percentage points) is "
+                              "narrower than this",
+                         action="store",
+                         type=float,
+                         default=None,
+                         dest="ci_width")
     simopts.add_argument("--new-polls", "-e",
                          help="Simulate based on any new polling data",
                          action="store_true",
                          dest="newpolls")
+    simopts.add_argument("--top-up",
+                         help="With --new-polls, also run more iterations for "
+                              "saved polls with fewer results than asked for, "
+                              "adding to their existing results (only for "
+                              "polls run with the same engine, block size, "
+                              "sampling, importance target and adaptive "
+                              "proposal setting)",
+                         action="store_true",
+                         dest="topup")
+    simopts.add_argument("--engine",
+                         help="Simulation engine to use (options: {0}). The "
+                              "numpy engine requires numpy.".format(
+                                                           ", ".join(ENGINES)),
+                         action="store",
+                         choices=ENGINES,
+                         default=PYTHON_ENGINE,
+                         dest="engine")
+    simopts.add_argument("--block-size",
+                         help="Number of elections each process simulates "
+                              "at once in a Monte Carlo run (default depends "
+                              "on the engine)",
+                         action="store",
+                         type=int,
+                         default=None,
+                         dest="block_size")
+    simopts.add_argument("--sampling",
+                         help="How to sample the elections in a Monte Carlo "
+                              "run (options: {0}). The antithetic and halton "
+                              "strategies give more accurate results for the "
+                              "same number of iterations".format(
+                                               ", ".join(SAMPLING_STRATEGIES)),
+                         action="store",
+                         choices=SAMPLING_STRATEGIES,
+                         default=SAMPLING_RANDOM,
+                         dest="sampling")
+    simopts.add_argument("--adaptive-proposal",
+                         help="Tilt the support figures of most of the "
+                              "elections in a Monte Carlo run towards those "
+                              "of acceptable elections in a pilot run, and "
+                              "weight the results to make up for it, so that "
+                              "fewer simulated elections are discarded as too "
+                              "far from the polls",
+                         action="store_true",
+                         dest="adaptive")
+    simopts.add_argument("--importance",
+                         help="Aim a Monte Carlo run at a rare outcome, and "
+                              "weight the results to make up for it. TARGET "
+                              "is a constituency for the party to win, "
+                              "'majority', or a number of seats for it to win "
+                              "at least",
+                         action="store",
+                         default=None,
+                         metavar="PARTY:TARGET",
+                         dest="importance")
+    simopts.add_argument("--seed",
+                         help="Seed for the random number generators. Runs "
+                              "with the same seed, engine, block size and "
+                              "sampling strategy give identical results",
+                         action="store",
+                         type=int,
+                         default=None,
+                         dest="seed")
+    
+    distopts = parser.add_argument_group("Distributed simulation options")
+    distopts.add_argument("--coordinator",
+                          help="Run a Monte Carlo simulation on workers that "
+                               "connect to this HOST:PORT",
+                          action="store",
+                          default=None,
+                          metavar="HOST:PORT",
+                          dest="coordinator")
+    distopts.add_argument("--worker",
+                          help="Run Monte Carlo simulations for the "
+                               "coordinator at this HOST:PORT",
+                          action="store",
+                          default=None,
+                          metavar="HOST:PORT",
+                          dest="worker")
+    distopts.add_argument("--authkey",
+                          help="Secret key that workers need to connect to "
+                               "the coordinator (required with --coordinator "
+                               "and --worker)",
+                          action="store",
+                          default=None,
+                          dest="authkey")
     
     partyopts = parser.add_argument_group("Party support options")
     partyopts.add_argument("--conservative", "-t",
@@ -215,10 +340,21 @@ def run_electobot():
 
     opts = parser.parse_args()
         
-    if opts.debug:
+    if opts.debug or len(opts.trace_seats) > 0:
         logger.setLevel(logging.DEBUG)
     else:
         logger.setLevel(LOG_LEVEL)
+    utils.set_trace_seats(opts.trace_seats)
+    
+    if opts.coordinator is not None or opts.worker is not None:
+        # Whatever comes over a distributed connection gets unpickled, so
+        # anyone with the key can run code on the other end.  There's no
+        # default key for that reason; it has to be a shared secret.
+        assert opts.authkey is not None, \
+            "--authkey is needed with --coordinator or --worker"
+    if opts.resume:
+        assert opts.checkpoint_file is not None, \
+            "--checkpoint-file is needed with --resume"
     
     if opts.charttype == "line":
         # Generating a line chart from saved data.
@@ -230,6 +366,7 @@ def run_electobot():
             loadfile = open(opts.pickle, "r")
         savedpolls = pickle.load(loadfile)
         loadfile.close()
+        pollscrape.convert_party_names(savedpolls)
         
         # Do the plotting import here to avoid making matplotlib a dependency
         # unless absolutely necessary.
@@ -274,12 +411,41 @@ def run_electobot():
         # Guardian data instead.
         elect.add_total_2010_votes()
         
-        if opts.newpolls:
+        # Work out which outcome, if any, to aim the Monte Carlo runs at.
+        importance = None
+        if opts.importance is not None:
+            party_name, event = opts.importance.split(":", 1)
+            assert party_name in PARTY_CODES, \
+                "Unknown party: {0}".format(party_name)
+            if event == "majority":
+                importance = (PARTY_CODES[party_name], NEEDED_FOR_MAJORITY)
+            elif event.isdigit():
+                importance = (PARTY_CODES[party_name], int(event))
+            else:
+                assert event in elect.constituencies, \
+                    "Unknown constituency: {0}".format(event)
+                importance = (PARTY_CODES[party_name], event)
+        
+        if opts.worker is not None:
+            # Run simulations for a coordinator elsewhere until it's done.
+            import electobot.distributed as distributed
+            distributed.run_worker(elect,
+                                   distributed.parse_address(opts.worker),
+                                   opts.authkey)
+        elif opts.query:
+            # Answer what-if queries until stdin is closed.
+            import electobot.query as query
+            query.serve(elect, sys.stdin, sys.stdout, opts.engine, opts.seed)
+        elif opts.newpolls:
             # Fetch new polling data from the internet and simulate any that 
             # isn't already in our saved data.
             assert opts.savefile is not None,  \
                 "No filename specified for saving results"
-            if opts.iterations == 0:
+            if opts.iterations == 0 and opts.ci_width is not None:
+                logger.info("No number of iterations specified, using at most "
+                            "{0}".format(CI_MAX_ITERATIONS))
+                iter = CI_MAX_ITERATIONS
+            elif opts.iterations == 0:
                 logger.info("No number of iterations specified, using 1000")
                 iter = 1000
             else:
@@ -294,33 +460,79 @@ def run_electobot():
                 logger.info("Loaded {0} saved polls from file".
                             format(len(saved_polls)))
                 pickle_file.close()
+                pollscrape.convert_party_names(saved_polls)
             else:
                 saved_polls = []
                 
             scraper = pollscrape.PollScrape()
             scraper.create_polls_from_table()
             
+            pool = montecarlo.MonteCarloPool(
+                                         elect,
+                                         opts.engine,
+                                         opts.block_size,
+                                         opts.seed,
+                                         checkpoint_file=opts.checkpoint_file,
+                                         sampling=opts.sampling,
+                                         importance=importance,
+                                         adaptive=opts.adaptive)
+            if opts.resume:
+                pool.resume()
+            
             # Calculate only those polls that aren't already in our dataset.
+            # Use the same set of processes for all of them, rather than
+            # starting new ones for each poll, and run several polls at once
+            # so that none of the processes sit idle while one finishes.
             polls_to_calculate = set(scraper.polls) - set(saved_polls)
-            for index, poll in enumerate(polls_to_calculate, start=1):
-                logger.info("Running poll {0} of {1}".
-                                                format(index, 
-                                                       len(polls_to_calculate)))
-                logger.debug("Running poll with following support:")
-                logger.debug(str(poll.support))
-                elect.predicted_support = poll.support
-                poll.result = montecarlo.run_multithreaded_montecarlo(elect, 
-                                                                      iter)
-                saved_polls.append(poll)
+            jobs = {}
+            for poll in polls_to_calculate:
+                logger.debug("Queueing poll with following support:")
+                logger.debug(str(utils.by_party_name(poll.support)))
+                job = montecarlo.MonteCarloJob(iter,
+                                               poll.support,
+                                               elect.regional_support,
+                                               opts.ci_width)
+                jobs[job] = poll
                 
-                # Update the saved polls list after every run in case it gets
-                # interrupted.
-                if not opts.savefile.endswith(".gz"):
-                    savefile = opts.savefile + ".gz"
-                else:
-                    savefile = opts.savefile
-                with gzip.open(savefile, "wb") as pickle_file:
-                    pickle.dump(saved_polls, pickle_file)
+            # If asked, top up any saved polls that have too few results.
+            # Results saved by older versions, or sampled differently from
+            # this run, can't be topped up, as we'd be reusing random numbers
+            # or mixing different kinds of results.
+            if opts.topup:
+                for poll in saved_polls:
+                    if not pool.can_carry_on(poll.result):
+                        logger.warning("Can't top up poll from {0}".format(
+                                                                    poll.date))
+                    elif poll.result.num_of_results < iter:
+                        job = montecarlo.MonteCarloJob(iter,
+                                                       poll.support,
+                                                       elect.regional_support,
+                                                       opts.ci_width,
+                                                       previous=poll.result)
+                        jobs[job] = poll
+            pool.start()
+            try:
+                for index, job in enumerate(pool.run_jobs(jobs.keys()),
+                                            start=1):
+                    logger.info("Completed poll {0} of {1}".
+                                                format(index, len(jobs)))
+                    poll = jobs[job]
+                    poll.result = job.result
+                    if poll not in saved_polls:
+                        saved_polls.append(poll)
+                    
+                    # Update the saved polls list after every run in case it
+                    # gets interrupted.
+                    if not opts.savefile.endswith(".gz"):
+                        savefile = opts.savefile + ".gz"
+                    else:
+                        savefile = opts.savefile
+                    with gzip.open(savefile, "wb") as pickle_file:
+                        pickle.dump(saved_polls, pickle_file)
+                pool.close()
+            finally:
+                # Make sure we kill all the processes if we're interrupted.
+                pool.terminate()
             
             logger.info("Completed generating from new polls")
         else:    
@@ -355,7 +567,10 @@ def run_electobot():
                     
             if opts.single_election:
                 assert elect is not None, "No election data to work with"
-                elect.run()
+                rng = None
+                if opts.seed is not None:
+                    rng = utils.make_rng(opts.seed, 0, opts.engine)
+                elect.run(opts.engine, rng)
                 print elect.result.summary
                 if len(elect.result.ukip_stealth_targets) > 0:
                     # Some UKIP stealth targets have been found - print them
@@ -371,10 +586,39 @@ def run_electobot():
                     import electobot.electoplot as plot
                     plot.create_pie_chart(elect.result.seats, opts.chartloc)
                     
-            elif opts.iterations > 0:
+            elif opts.iterations > 0 or opts.ci_width is not None:
                 assert elect is not None, "No election data to work with"
-                mc_result = montecarlo.run_multithreaded_montecarlo(elect,
-                                                                opts.iterations)
+                if opts.iterations == 0:
+                    iterations = CI_MAX_ITERATIONS
+                else:
+                    iterations = opts.iterations
+                if opts.coordinator is not None:
+                    import electobot.distributed as distributed
+                    mc_result = distributed.run_distributed_montecarlo(
+                                   elect,
+                                   iterations,
+                                   distributed.parse_address(opts.coordinator),
+                                   opts.authkey,
+                                   opts.engine,
+                                   opts.block_size,
+                                   opts.seed,
+                                   opts.ci_width,
+                                   opts.sampling,
+                                   importance,
+                                   opts.adaptive)
+                else:
+                    mc_result = montecarlo.run_multithreaded_montecarlo(
+                                                           elect,
+                                                           iterations,
+                                                           opts.engine,
+                                                           opts.block_size,
+                                                           opts.seed,
+                                                           opts.ci_width,
+                                                           opts.checkpoint_file,
+                                                           opts.resume,
+                                                           opts.sampling,
+                                                           importance,
+                                                           opts.adaptive)
                 mc_result.report(opts.summary_file)
                 
                 if opts.charttype == "bar":
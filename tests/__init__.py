@@ -0,0 +1,47 @@
+#!/usr/bin/python
+"""
+Electobot
+by Philip Brien (http://github.com/ZsigE)
+
+Analysis and prediction tool based on the 2010 UK General Election results
+
+Tests.  Run them from the top of the repository with
+python -m unittest discover -s tests -t .
+"""
+
+# Python imports
+import logging
+
+# Electobot imports
+import electobot.election as election
+from electobot.constants import *
+
+# The tests don't set up logging, so keep quiet about the warnings they
+# provoke on purpose.
+logging.getLogger("electobot").addHandler(logging.NullHandler())
+
+# The election data only needs loading once for all the tests.
+_election = None
+
+# Functions
+def load_election():
+    """Return an Election populated from the CSV data, loading it the first
+    time it's asked for.
+    """
+    
+    global _election
+    if _election is None:
+        _election = election.Election()
+        _election.populate_from_csv()
+        _election.add_total_2010_votes()
+    
+    return _election
+
+def make_support(elect):
+    """Return some predicted support figures for the tests to run with."""
+    
+    return elect.prepare_predicted_support({CON: 34.0,
+                                            LAB: 33.0,
+                                            LD: 10.0,
+                                            UKP: 14.0,
+                                            GRN: 5.0})
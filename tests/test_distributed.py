@@ -0,0 +1,104 @@
+#!/usr/bin/python
+"""
+Electobot
+by Philip Brien (http://github.com/ZsigE)
+
+Analysis and prediction tool based on the 2010 UK General Election results
+
+Tests for distributed Monte Carlo runs
+"""
+
+# Python imports
+import unittest
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+# Electobot imports
+import electobot.distributed as distributed
+import electobot.montecarlo as montecarlo
+from electobot.constants import *
+from tests import load_election, make_support
+from tests.test_montecarlo import TEST_ITERATIONS, TEST_BLOCK_SIZE, TEST_SEED
+
+# Hand out small tasks, so that the run needs several of them and has to run
+# the last one again to stop at the right number of elections.
+TEST_BLOCKS_PER_TASK = 3
+TEST_AUTHKEY = "test"
+
+# Classes
+class TestDistributed(unittest.TestCase):
+    """A coordinator and workers talking over TCP on this machine."""
+    
+    def test_same_as_local(self):
+        """Workers on a coordinator give the same result as a local run with
+        the same seed.  A worker with the wrong key is turned away without
+        stopping the others from connecting.
+        """
+        
+        elect = load_election()
+        elect.predicted_support = make_support(elect)
+        elect.regional_support = {}
+        
+        pool = montecarlo.MonteCarloPool(elect,
+                                         PYTHON_ENGINE,
+                                         TEST_BLOCK_SIZE,
+                                         TEST_SEED,
+                                         num_of_workers=1)
+        pool.start()
+        try:
+            expected = pool.run(TEST_ITERATIONS)
+            pool.close()
+        finally:
+            pool.terminate()
+        
+        # Let the system pick a free port for the coordinator.
+        coordinator = distributed.Coordinator(
+                                        elect,
+                                        ("localhost", 0),
+                                        TEST_AUTHKEY,
+                                        PYTHON_ENGINE,
+                                        TEST_BLOCK_SIZE,
+                                        TEST_SEED,
+                                        blocks_per_task=TEST_BLOCKS_PER_TASK)
+        coordinator.start()
+        workers = []
+        try:
+            self.assertRaises(AuthenticationError,
+                              Client,
+                              coordinator.listener.address,
+                              authkey="wrong")
+            for ii in range(2):
+                worker = threading.Thread(
+                                   target=distributed.run_worker,
+                                   args=(elect,
+                                         coordinator.listener.address,
+                                         TEST_AUTHKEY))
+                worker.daemon = True
+                worker.start()
+                workers.append(worker)
+            result = coordinator.run(TEST_ITERATIONS)
+        finally:
+            coordinator.close()
+        for worker in workers:
+            worker.join()
+        
+        self.assertEqual(result.num_of_results, TEST_ITERATIONS)
+        self.assertEqual(result.num_of_rejected, expected.num_of_rejected)
+        self.assertEqual(result.win_counts, expected.win_counts)
+        self.assertEqual(result.possible_coalitions,
+                         expected.possible_coalitions)
+        self.assertEqual(result.const_wins, expected.const_wins)
+        
+        # The partial results are added up in a different order, so the
+        # statistics can be a rounding error out.
+        for party in PARTIES:
+            self.assertAlmostEqual(result.mean_seats[party],
+                                   expected.mean_seats[party])
+            self.assertAlmostEqual(result.stddev_seats[party],
+                                   expected.stddev_seats[party])
+        
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+"""
+Electobot
+by Philip Brien (http://github.com/ZsigE)
+
+Analysis and prediction tool based on the 2010 UK General Election results
+
+Tests that the Python and NumPy engines run the same model
+"""
+
+# Python imports
+import unittest
+
+# Third-party imports
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Electobot imports
+from electobot.constants import *
+
+# Seed for the made-up records.
+TEST_SEED = 3
+from tests import load_election, make_support
+
+# Classes
+class MeanRNG(object):
+    """Stand-in for a random number generator that always picks the mean of
+    a normal distribution, so that the Python engine predicts the mean votes.
+    """
+    
+    def normalvariate(self, mean, stdev):
+        return mean
+
+@unittest.skipIf(np is None, "NumPy isn't installed")
+class TestVoteMeans(unittest.TestCase):
+    """The NumPy engine predicts the same mean votes in every constituency as
+    the Python engine does.
+    """
+    
+    def assert_same_means(self, predicted_support, regional_support):
+        """Compare the two engines' mean votes for the given support."""
+        
+        import electobot.vectorized as vectorized
+        
+        elect = load_election()
+        elect.reset()
+        elect.predicted_support = predicted_support
+        elect.regional_support = regional_support
+        elect.predict_votes(MeanRNG())
+        
+        vector = elect.vectorize()
+        support, present = vectorized.support_to_array(predicted_support)
+        mean_votes = vector.vote_distribution(support[np.newaxis, :],
+                                              present,
+                                              regional_support)[0][0]
+        
+        for ii, const_name in enumerate(vector.names):
+            sim_votes = elect.constituencies[const_name].sim_votes
+            for party in PARTIES:
+                # The two engines add up the swing in different orders, so
+                # rounding down can be a vote out either way.
+                self.assertLessEqual(abs(sim_votes.get(party, 0) -
+                                         mean_votes[ii, party]),
+                                     1,
+                                     "{0} votes in {1}".format(
+                                                            PARTY_NAMES[party],
+                                                            const_name))
+        
+        return
+    
+    def test_national(self):
+        """National support only."""
+        
+        elect = load_election()
+        self.assert_same_means(make_support(elect), {})
+        
+        return
+    
+    def test_regional(self):
+        """Different support in Scotland."""
+        
+        elect = load_election()
+        scotland = elect.prepare_predicted_support({CON: 15.0,
+                                                    LAB: 35.0,
+                                                    LD: 8.0,
+                                                    SNP: 32.0})
+        self.assert_same_means(make_support(elect), {"Scotland": scotland})
+        
+        return
+
+@unittest.skipIf(np is None, "NumPy isn't installed")
+class TestRecordOutcomes(unittest.TestCase):
+    """Adding up a block of compact records all at once gives the same totals
+    as adding the Result built from each record one by one.
+    """
+    
+    def make_records(self, vector, count):
+        """Return an array of made-up records, with a good mix of majorities
+        and hung parliaments.
+        """
+        
+        rng = np.random.RandomState(TEST_SEED)
+        records = np.zeros(count, dtype=vector.record_dtype)
+        for record in records:
+            shares = rng.dirichlet([4.0, 4.0, 1.0] + [0.2] * 6)
+            record["seats"] = rng.multinomial(NUM_OF_CONSTITUENCIES, shares)
+        records["winners"] = rng.randint(0, NUM_OF_PARTIES,
+                                         records["winners"].shape)
+        records["most_votes_party"] = rng.randint(0, 3, count)
+        records["flags"] = ((rng.uniform(size=count) < 0.5) *
+                            RECORD_GREENS_HOLD_BRIGHTON)
+        records["weight"] = 1
+        
+        return records
+    
+    def test_record_outcomes(self):
+        """Vectorized totals match the per-record ones."""
+        
+        import electobot.montecarlo as montecarlo
+        
+        vector = load_election().vectorize()
+        records = self.make_records(vector, 200)
+        
+        together = montecarlo.MonteCarloResult()
+        together.analyze_records(records, vector)
+        together.calculate_statistics()
+        
+        one_by_one = montecarlo.MonteCarloResult()
+        for record in records:
+            one_by_one.add_outcome(vector.record_outcome(record))
+            for const_name, winner in zip(vector.names,
+                                          record["winners"].tolist()):
+                montecarlo.add_counts(one_by_one.const_wins.setdefault(
+                                                                const_name, {}),
+                                      {winner: 1})
+        one_by_one.calculate_statistics()
+        
+        self.assertIn(None, one_by_one.win_counts)
+        self.assertEqual(together.num_of_results, one_by_one.num_of_results)
+        self.assertEqual(together.win_counts, one_by_one.win_counts)
+        self.assertEqual(together.largest_party_counts,
+                         one_by_one.largest_party_counts)
+        self.assertEqual(together.possible_coalitions,
+                         one_by_one.possible_coalitions)
+        self.assertEqual(together.most_seats_won, one_by_one.most_seats_won)
+        self.assertEqual(together.most_seats_won_party,
+                         one_by_one.most_seats_won_party)
+        self.assertEqual(together.greens_hold_brighton_count,
+                         one_by_one.greens_hold_brighton_count)
+        self.assertEqual(together.seat_winner_is_pop_winner_count,
+                         one_by_one.seat_winner_is_pop_winner_count)
+        self.assertEqual(together.const_wins, one_by_one.const_wins)
+        for party in PARTIES:
+            self.assertAlmostEqual(together.mean_seats[party],
+                                   one_by_one.mean_seats[party])
+            self.assertAlmostEqual(together.stddev_seats[party],
+                                   one_by_one.stddev_seats[party])
+        self.assertAlmostEqual(together.mean_margin_of_victory,
+                               one_by_one.mean_margin_of_victory)
+        self.assertAlmostEqual(together.stddev_margin_of_victory,
+                               one_by_one.stddev_margin_of_victory)
+        
+        return
+    
+    def test_target_hits(self):
+        """Weighted records aimed at a national target count its hits and
+        their effective sample size the same way as the Results do.
+        """
+        
+        import electobot.montecarlo as montecarlo
+        
+        vector = load_election().vectorize()
+        records = self.make_records(vector, 200)
+        records["weight"] = np.random.RandomState(TEST_SEED).uniform(0.5,
+                                                                     2.0,
+                                                                     200)
+        target = (LAB, NEEDED_FOR_MAJORITY)
+        
+        together = montecarlo.MonteCarloResult()
+        together.importance_target = target
+        together.analyze_records(records, vector)
+        
+        one_by_one = montecarlo.MonteCarloResult()
+        one_by_one.importance_target = target
+        for record in records:
+            one_by_one.add_outcome(vector.record_outcome(record),
+                                   record["weight"].item())
+            
+        weights = records["weight"].astype(float)
+        hits = (records["seats"][:, LAB] >= NEEDED_FOR_MAJORITY)
+        self.assertTrue(hits.any())
+        self.assertFalse(hits.all())
+        self.assertAlmostEqual(together.target_hits, weights[hits].sum())
+        self.assertAlmostEqual(one_by_one.target_hits, weights[hits].sum())
+        self.assertAlmostEqual(together.effective_sample_size(),
+                               weights.sum() ** 2 / (weights ** 2).sum())
+        self.assertAlmostEqual(one_by_one.effective_sample_size(),
+                               together.effective_sample_size())
+        
+        return
+
+if __name__ == "__main__":
+    unittest.main()
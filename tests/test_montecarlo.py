@@ -0,0 +1,382 @@
+#!/usr/bin/python
+"""
+Electobot
+by Philip Brien (http://github.com/ZsigE)
+
+Analysis and prediction tool based on the 2010 UK General Election results
+
+Tests that Monte Carlo runs can be repeated exactly
+"""
+
+# Python imports
+import unittest
+import os
+import shutil
+import tempfile
+import time
+
+# Third-party imports
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Electobot imports
+import electobot.montecarlo as montecarlo
+from electobot.constants import *
+from tests import load_election, make_support
+
+# Keep the runs small, but with several blocks each.
+TEST_ITERATIONS = 20
+TEST_BLOCK_SIZE = 5
+TEST_SEED = 3
+
+# Classes
+class MonteCarloTests(object):
+    """Tests that run Monte Carlo simulations, with the engine given by the
+    TestCase they're mixed into.
+    """
+    
+    def run_pool(self,
+                 job,
+                 num_of_workers=1,
+                 checkpoint_file=None,
+                 adaptive=False,
+                 importance=None):
+        """Run a job on a new pool and return it once it's finished."""
+        
+        return self.run_pool_jobs([job],
+                                  num_of_workers,
+                                  checkpoint_file,
+                                  adaptive,
+                                  importance)[0]
+    
+    def run_pool_jobs(self,
+                      jobs,
+                      num_of_workers=1,
+                      checkpoint_file=None,
+                      adaptive=False,
+                      importance=None):
+        """Run several jobs side by side on a new pool and return them in the
+        order they finished.
+        """
+        
+        finished = []
+        pool = montecarlo.MonteCarloPool(load_election(),
+                                         self.engine,
+                                         TEST_BLOCK_SIZE,
+                                         TEST_SEED,
+                                         num_of_workers=num_of_workers,
+                                         checkpoint_file=checkpoint_file,
+                                         importance=importance,
+                                         adaptive=adaptive)
+        if checkpoint_file is not None:
+            pool.resume()
+        pool.start()
+        try:
+            for job in pool.run_jobs(jobs):
+                finished.append(job)
+            pool.close()
+        finally:
+            pool.terminate()
+        
+        return finished
+    
+    def make_job(self,
+                 iterations=TEST_ITERATIONS,
+                 num_of_blocks=None,
+                 ci_width=None,
+                 predicted_support=None,
+                 first_block=0,
+                 previous=None):
+        """Return a new job for the test support figures, or for the given
+        ones.
+        """
+        
+        if predicted_support is None:
+            predicted_support = make_support(load_election())
+        
+        return montecarlo.MonteCarloJob(iterations,
+                                        predicted_support,
+                                        {},
+                                        ci_width,
+                                        first_block=first_block,
+                                        num_of_blocks=num_of_blocks,
+                                        previous=previous)
+    
+    def assert_same_results(self, result, expected, exact=True):
+        """Check two MonteCarloResults are the same.  Unless 'exact' is set,
+        the statistics only have to be the same to within rounding errors,
+        as they are when the results were added up in a different order.
+        """
+        
+        self.assertEqual(result.num_of_results, expected.num_of_results)
+        self.assertEqual(result.num_of_rejected, expected.num_of_rejected)
+        self.assertEqual(result.win_counts, expected.win_counts)
+        if exact:
+            self.assertEqual(result.mean_seats, expected.mean_seats)
+            self.assertEqual(result.stddev_seats, expected.stddev_seats)
+            self.assertEqual(result.mean_margin_of_victory,
+                             expected.mean_margin_of_victory)
+        else:
+            for party in expected.mean_seats:
+                self.assertAlmostEqual(result.mean_seats[party],
+                                       expected.mean_seats[party])
+                self.assertAlmostEqual(result.stddev_seats[party],
+                                       expected.stddev_seats[party])
+            self.assertAlmostEqual(result.mean_margin_of_victory,
+                                   expected.mean_margin_of_victory)
+        self.assertEqual(result.possible_coalitions,
+                         expected.possible_coalitions)
+        self.assertEqual(result.const_wins, expected.const_wins)
+        self.assertEqual(result.next_block, expected.next_block)
+        
+        return
+    
+    def test_workers(self):
+        """The same seed gives the same result on one process or several."""
+        
+        one = self.run_pool(self.make_job(), num_of_workers=1)
+        several = self.run_pool(self.make_job(), num_of_workers=3)
+        self.assertEqual(one.result.num_of_results, TEST_ITERATIONS)
+        self.assert_same_results(several.result, one.result)
+        
+        return
+    
+    def test_several_jobs(self):
+        """Jobs run side by side on one pool give the same results as each
+        one run on its own.
+        """
+        
+        other_support = load_election().prepare_predicted_support({CON: 30.0,
+                                                                   LAB: 38.0,
+                                                                   LD: 12.0,
+                                                                   UKP: 11.0,
+                                                                   GRN: 4.0})
+        first = self.make_job()
+        second = self.make_job(TEST_ITERATIONS,
+                               predicted_support=other_support)
+        third = self.make_job(TEST_ITERATIONS / 2)
+        finished = self.run_pool_jobs([first, second, third], num_of_workers=3)
+        self.assertEqual(sorted(finished), sorted([first, second, third]))
+        
+        for job in finished:
+            alone = self.run_pool(self.make_job(
+                                       job.iterations,
+                                       predicted_support=job.predicted_support))
+            self.assertEqual(job.result.num_of_results, job.iterations)
+            self.assert_same_results(job.result, alone.result)
+        
+        return
+    
+    def test_resume(self):
+        """Carrying on from a checkpoint gives the same result as running
+        without a break.
+        """
+        
+        uninterrupted = self.run_pool(self.make_job())
+        
+        # Run the first couple of blocks and save them as a checkpoint, as if
+        # the run had been interrupted there.
+        temp_dir = tempfile.mkdtemp()
+        try:
+            checkpoint_file = os.path.join(temp_dir, "checkpoint.pickle.gz")
+            first_part = self.run_pool(self.make_job(None, num_of_blocks=2))
+            self.assertLess(first_part.result.num_of_results, TEST_ITERATIONS)
+            montecarlo.save_checkpoint(checkpoint_file,
+                                       {first_part.key():
+                                        first_part.snapshot()})
+            
+            resumed = self.run_pool(self.make_job(),
+                                    checkpoint_file=checkpoint_file)
+            self.assertTrue(resumed.resumed)
+            self.assertFalse(os.path.exists(checkpoint_file))
+        finally:
+            shutil.rmtree(temp_dir)
+        
+        self.assert_same_results(resumed.result, uninterrupted.result)
+        
+        return
+
+    def test_merge(self):
+        """Merging the results of two runs over different blocks gives the
+        same result as one run over all of them.
+        """
+        
+        whole = self.run_pool(self.make_job(None, num_of_blocks=4))
+        first = self.run_pool(self.make_job(None, num_of_blocks=2))
+        second = self.run_pool(self.make_job(None,
+                                             num_of_blocks=2,
+                                             first_block=2))
+        
+        merged = montecarlo.MonteCarloResult()
+        merged.merge(first.result)
+        merged.merge(second.result)
+        merged.calculate_statistics()
+        self.assert_same_results(merged, whole.result, exact=False)
+        self.assertEqual(merged.seed, whole.result.seed)
+        self.assertEqual(merged.engine, self.engine)
+        
+        return
+    
+    def test_carry_on(self):
+        """Topping up an earlier result gives the same result as running
+        that many elections in the first place, but only if the earlier
+        result was sampled in the same way.
+        """
+        
+        uninterrupted = self.run_pool(self.make_job())
+        earlier = self.run_pool(self.make_job(TEST_ITERATIONS / 2))
+        topped_up = self.run_pool(self.make_job(previous=earlier.result))
+        self.assertTrue(topped_up.resumed)
+        self.assert_same_results(topped_up.result, uninterrupted.result)
+        
+        # The earlier result is left as it was.
+        self.assertEqual(earlier.result.num_of_results, TEST_ITERATIONS / 2)
+        
+        earlier.result.sampling = SAMPLING_HALTON
+        self.assertRaises(AssertionError,
+                          self.run_pool,
+                          self.make_job(previous=earlier.result))
+        
+        return
+    
+    def test_ci_width(self):
+        """A run stops as soon as it has enough results if its confidence
+        intervals are narrow enough, and runs in full if they never are.
+        """
+        
+        min_results = montecarlo.CI_MIN_RESULTS
+        montecarlo.CI_MIN_RESULTS = 2 * TEST_BLOCK_SIZE
+        try:
+            wide = self.run_pool(self.make_job(ci_width=float("inf")))
+            narrow = self.run_pool(self.make_job(ci_width=0.0))
+        finally:
+            montecarlo.CI_MIN_RESULTS = min_results
+        
+        # Whole blocks are added at a time, so the run stops at the end of
+        # the block that takes it to the fewest results allowed.
+        self.assertGreaterEqual(wide.result.num_of_results,
+                                2 * TEST_BLOCK_SIZE)
+        self.assertLess(wide.result.num_of_results, 3 * TEST_BLOCK_SIZE)
+        self.assertEqual(narrow.result.num_of_results, TEST_ITERATIONS)
+        self.assertGreater(narrow.result.ci_width(), 0)
+        
+        return
+    
+    def test_adaptive(self):
+        """An adaptive proposal is fitted to the pilot blocks and the results
+        after them are weighted, the same way however many processes there
+        are.
+        """
+        
+        # Keep the pilot short enough to leave some blocks after it.
+        pilot_sizes = montecarlo.ADAPTIVE_PILOT_SIZES
+        montecarlo.ADAPTIVE_PILOT_SIZES = {self.engine: 2 * TEST_BLOCK_SIZE}
+        try:
+            one = self.run_pool(self.make_job(), adaptive=True)
+            several = self.run_pool(self.make_job(),
+                                    num_of_workers=3,
+                                    adaptive=True)
+        finally:
+            montecarlo.ADAPTIVE_PILOT_SIZES = pilot_sizes
+        
+        self.assertEqual(one.result.num_of_results, TEST_ITERATIONS)
+        self.assertEqual(sorted(one.result.proposal_tilts.keys()),
+                         sorted(make_support(load_election()).keys()))
+        self.assertNotAlmostEqual(one.result.total_weight,
+                                  one.result.num_of_results)
+        self.assert_same_results(several.result, one.result)
+        self.assertEqual(several.result.total_weight, one.result.total_weight)
+        
+        return
+    
+    def test_importance(self):
+        """Runs aimed at a seat or at a number of seats nationally are
+        weighted, the same way however many processes there are.
+        """
+        
+        for target in [(LAB, "Bolton West"), (LAB, 300)]:
+            one = self.run_pool(self.make_job(), importance=target)
+            several = self.run_pool(self.make_job(),
+                                    num_of_workers=3,
+                                    importance=target)
+            
+            self.assertEqual(one.result.importance_target, target)
+            self.assertEqual(one.result.num_of_results, TEST_ITERATIONS)
+            self.assertLess(one.result.effective_sample_size(),
+                            one.result.num_of_results)
+            self.assert_same_results(several.result, one.result)
+            self.assertEqual(several.result.total_weight,
+                             one.result.total_weight)
+            self.assertEqual(several.result.target_hits,
+                             one.result.target_hits)
+            
+        # Only a national target has its hits counted separately.
+        self.assertGreater(one.result.target_hits, 0)
+        self.assertLessEqual(one.result.target_hits, one.result.total_weight)
+        
+        return
+
+class LiveProcess(object):
+    """Stand-in for a Monte Carlo process that never dies."""
+    
+    exitcode = None
+    
+    def is_alive(self):
+        return True
+
+class TestGetResults(unittest.TestCase):
+    """The pool gives up on a process that stops finishing blocks, even
+    though its heartbeats keep coming.
+    """
+    
+    def make_pool(self, blocks_done, seconds_ago):
+        """Return a pool with one pretend process, which had finished the
+        given number of blocks the given number of seconds ago.
+        """
+        
+        pool = montecarlo.MonteCarloPool(load_election(), num_of_workers=1)
+        pool.processes = [LiveProcess()]
+        pool.blocks_done = [blocks_done]
+        pool.last_progress = [time.time() - seconds_ago]
+        
+        return pool
+    
+    def test_hung(self):
+        """A busy process that hasn't finished a block for too long."""
+        
+        pool = self.make_pool(3, WORKER_TIMEOUT + 1)
+        pool.results.put((0, [], 3, True))
+        self.assertRaises(RuntimeError, pool.get_results)
+        
+        return
+    
+    def test_progress(self):
+        """A process that has just finished a block, or has nothing to do."""
+        
+        batch = [(0, 4, "results")]
+        pool = self.make_pool(3, WORKER_TIMEOUT + 1)
+        pool.results.put((0, batch, 4, True))
+        self.assertEqual(pool.get_results(), batch)
+        
+        pool = self.make_pool(3, WORKER_TIMEOUT + 1)
+        pool.results.put((0, [], 3, False))
+        pool.results.put((0, batch, 4, True))
+        self.assertEqual(pool.get_results(), batch)
+        
+        return
+
+class TestPythonEngine(MonteCarloTests, unittest.TestCase):
+    """Repeatability with the Python engine."""
+    
+    engine = PYTHON_ENGINE
+
+@unittest.skipIf(np is None, "NumPy isn't installed")
+class TestNumpyEngine(MonteCarloTests, unittest.TestCase):
+    """Repeatability with the NumPy engine."""
+    
+    engine = NUMPY_ENGINE
+
+if __name__ == "__main__":
+    unittest.main()
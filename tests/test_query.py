@@ -0,0 +1,79 @@
+#!/usr/bin/python
+"""
+Electobot
+by Philip Brien (http://github.com/ZsigE)
+
+Analysis and prediction tool based on the 2010 UK General Election results
+
+Tests for answering single-election queries
+"""
+
+# Python imports
+import unittest
+import copy
+import json
+from StringIO import StringIO
+
+# Electobot imports
+import electobot.query as query
+from electobot.constants import *
+from tests import load_election
+
+# Seed for the random number generators.
+TEST_SEED = 3
+
+# Classes
+class TestServe(unittest.TestCase):
+    """Queries sent to the server, one JSON object per line."""
+    
+    def serve(self, lines):
+        """Send the given lines as queries and return the answers."""
+        
+        outstream = StringIO()
+        query.serve(copy.deepcopy(load_election()),
+                    StringIO("".join(line + "\n" for line in lines)),
+                    outstream,
+                    PYTHON_ENGINE,
+                    TEST_SEED)
+        
+        return [json.loads(line) for line in outstream.getvalue().splitlines()]
+    
+    def test_bad_queries(self):
+        """Queries that can't be answered get an error back, and the queries
+        after them are still answered.
+        """
+        
+        bad_queries = ['{"support": {"Foo": 30}}',
+                       '{"support": {"Other": 30}}',
+                       '{"support": [34, 33]}',
+                       '{"support": {"Labour": "lots"}}',
+                       '{"support": {"Labour": 33}, "seed": "three"}',
+                       '{"scotland": {"SNP": 40}}',
+                       '"support"',
+                       'not JSON']
+        good_query = '{"support": {"Conservative": 34, "Labour": 33}}'
+        answers = self.serve(bad_queries + [good_query])
+        
+        self.assertEqual(len(answers), len(bad_queries) + 1)
+        for answer in answers[:-1]:
+            self.assertEqual(answer.keys(), ["error"])
+        self.assertIn("Foo", answers[0]["error"])
+        self.assertNotIn("error", answers[-1])
+        
+        return
+    
+    def test_repeatable(self):
+        """The same query with the same seed gets the same answer."""
+        
+        good_query = ('{"support": {"Conservative": 34, "Labour": 33, '
+                      '"UKIP": 14}, "seed": 7}')
+        answers = self.serve([good_query, good_query])
+        
+        self.assertEqual(answers[0], answers[1])
+        self.assertEqual(sum(answers[0]["seats"].values()),
+                         len(load_election().constituencies))
+        
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,257 @@
+#!/usr/bin/python
+"""
+Electobot
+by Philip Brien (http://github.com/ZsigE)
+
+Analysis and prediction tool based on the 2010 UK General Election results
+
+Tests for the Monte Carlo sampling strategies
+"""
+
+# Python imports
+import unittest
+import math
+import random
+
+# Third-party imports
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Electobot imports
+import electobot.samplers as samplers
+import electobot.utils as utils
+from electobot.constants import *
+
+# Seed for the random number generators.
+TEST_SEED = 3
+
+# Classes
+class TestMirroredRandom(unittest.TestCase):
+    """Mirrored generators give the antithetic of each draw."""
+    
+    def test_python(self):
+        """Mirroring a random.Random."""
+        
+        plain = random.Random(TEST_SEED)
+        mirrored = samplers.MirroredRandom(random.Random(TEST_SEED))
+        for ii in range(10):
+            self.assertAlmostEqual(mirrored.uniform(-1, 3),
+                                   2 - plain.uniform(-1, 3))
+            self.assertAlmostEqual(mirrored.normalvariate(5, 2),
+                                   10 - plain.normalvariate(5, 2))
+            
+            # Anything else is passed straight through.
+            self.assertEqual(mirrored.random(), plain.random())
+        
+        return
+    
+    @unittest.skipIf(np is None, "NumPy isn't installed")
+    def test_numpy(self):
+        """Mirroring a NumPy RandomState."""
+        
+        plain = np.random.RandomState(TEST_SEED)
+        mirrored = samplers.MirroredRandomState(
+                                           np.random.RandomState(TEST_SEED))
+        self.assertTrue(np.allclose(mirrored.uniform(-1, 3, 10),
+                                    2 - plain.uniform(-1, 3, 10)))
+        self.assertTrue(np.allclose(mirrored.normal(5, 2, 10),
+                                    10 - plain.normal(5, 2, 10)))
+        self.assertTrue(np.allclose(mirrored.random_sample(10),
+                                    plain.random_sample(10)))
+        
+        return
+    
+    def test_block_rng(self):
+        """Antithetic blocks go in pairs, each odd block mirroring the block
+        before it, and random blocks all have streams of their own.
+        """
+        
+        draws = {}
+        for sampling in [SAMPLING_RANDOM, SAMPLING_ANTITHETIC]:
+            draws[sampling] = [samplers.block_rng(TEST_SEED,
+                                                  block,
+                                                  PYTHON_ENGINE,
+                                                  sampling).uniform(0, 1) for
+                               block in range(4)]
+        
+        antithetic = draws[SAMPLING_ANTITHETIC]
+        self.assertAlmostEqual(antithetic[1], 1 - antithetic[0])
+        self.assertAlmostEqual(antithetic[3], 1 - antithetic[2])
+        self.assertNotAlmostEqual(antithetic[2], antithetic[0])
+        self.assertEqual(len(set(draws[SAMPLING_RANDOM])), 4)
+        
+        return
+
+class TestHalton(unittest.TestCase):
+    """Halton points for the support modifiers."""
+    
+    def test_radical_inverse(self):
+        """The first few points of the van der Corput sequences."""
+        
+        self.assertEqual([samplers.radical_inverse(index, 2) for
+                          index in range(1, 8)],
+                         [0.5, 0.25, 0.75, 0.125, 0.625, 0.375, 0.875])
+        self.assertAlmostEqual(samplers.radical_inverse(1, 3), 1.0 / 3)
+        self.assertAlmostEqual(samplers.radical_inverse(5, 3), 7.0 / 9)
+        
+        return
+    
+    def test_modifiers(self):
+        """The modifiers stay within SUPPORT_VARIATION, carry on where the
+        last block left off, and spread out evenly.
+        """
+        
+        shift = samplers.halton_shift(TEST_SEED)
+        self.assertEqual(len(shift), NUM_OF_PARTIES)
+        self.assertEqual(shift, samplers.halton_shift(TEST_SEED))
+        
+        modifiers = samplers.halton_modifiers(0, 1000, shift)
+        self.assertEqual(len(modifiers), 1000)
+        self.assertEqual(modifiers[600:610],
+                         samplers.halton_modifiers(600, 10, shift))
+        
+        for party in PARTIES:
+            party_modifiers = [election_modifiers[party] for
+                               election_modifiers in modifiers]
+            self.assertLessEqual(max(party_modifiers), SUPPORT_VARIATION)
+            self.assertGreaterEqual(min(party_modifiers), -SUPPORT_VARIATION)
+            
+            # Far closer to the middle of the range than random draws would
+            # be expected to get.
+            self.assertLess(abs(sum(party_modifiers) / len(party_modifiers)),
+                            0.02 * SUPPORT_VARIATION)
+        
+        return
+
+class TestAdaptiveProposal(unittest.TestCase):
+    """Fitting and using the tilts for an adaptive proposal."""
+    
+    def test_fit_tilts(self):
+        """The fitted tilts give the modifiers the means they were fitted to,
+        unless that would take a tilt past ADAPTIVE_MAX_TILT.
+        """
+        
+        modifiers = {}
+        for party, mean in [(CON, 0.3), (LAB, -0.1), (LD, 0.0), (UKP, 0.99)]:
+            modifiers[party] = utils.RunningStats()
+            modifiers[party].add(mean * SUPPORT_VARIATION)
+        tilts = samplers.fit_tilts(modifiers, [CON, LAB, LD, UKP, GRN])
+        
+        self.assertAlmostEqual(samplers.tilted_mean(tilts[CON]), 0.3)
+        self.assertAlmostEqual(samplers.tilted_mean(tilts[LAB]), -0.1)
+        self.assertAlmostEqual(tilts[LD], 0.0)
+        self.assertAlmostEqual(tilts[UKP], ADAPTIVE_MAX_TILT)
+        self.assertEqual(tilts[GRN], 0.0)
+        
+        return
+    
+    def test_tilted_modifiers(self):
+        """Tilted modifiers have the mean they're tilted to, and weighting
+        them makes up for the tilt.
+        """
+        
+        rng = random.Random(TEST_SEED)
+        modifiers = samplers.random_modifiers(rng, 20000, PYTHON_ENGINE)
+        log_weights = samplers.tilt_modifiers(modifiers, {CON: 1.0, LAB: -1.5})
+        
+        tilted = dict((party, utils.RunningStats()) for party in [CON, LAB])
+        weighted = dict((party, utils.RunningStats()) for party in [CON, LAB])
+        for election_modifiers, log_weight in zip(modifiers, log_weights):
+            for party in [CON, LAB]:
+                modifier = election_modifiers[party] / SUPPORT_VARIATION
+                self.assertLessEqual(abs(modifier), 1)
+                tilted[party].add(modifier)
+                weighted[party].add(modifier, math.exp(log_weight))
+                
+        self.assertAlmostEqual(tilted[CON].mean, samplers.tilted_mean(1.0),
+                               places=2)
+        self.assertAlmostEqual(tilted[LAB].mean, samplers.tilted_mean(-1.5),
+                               places=2)
+        for party in [CON, LAB]:
+            self.assertLess(abs(weighted[party].mean), 0.02)
+        
+        return
+
+class TestImportance(unittest.TestCase):
+    """Importance sampling towards a seat or a national target."""
+    
+    def test_targets(self):
+        """Seat targets shift the noise in one seat, and national ones shift
+        it in every seat by less.
+        """
+        
+        const_names = ["Bolton West", "Thurrock", "Brighton Pavilion"]
+        
+        self.assertIsNone(samplers.target_seats((UKP, "Thurrock")))
+        self.assertEqual(samplers.noise_tilts((UKP, "Thurrock"), const_names),
+                         {"Thurrock": {UKP: IMPORTANCE_NOISE_TILT}})
+        
+        self.assertEqual(samplers.target_seats((LAB, NEEDED_FOR_MAJORITY)),
+                         NEEDED_FOR_MAJORITY)
+        tilts = samplers.noise_tilts((LAB, NEEDED_FOR_MAJORITY), const_names)
+        self.assertEqual(sorted(tilts.keys()), sorted(const_names))
+        for const_name in const_names:
+            self.assertEqual(tilts[const_name],
+                             {LAB: IMPORTANCE_NATIONAL_NOISE_TILT})
+        self.assertLess(IMPORTANCE_NATIONAL_NOISE_TILT, IMPORTANCE_NOISE_TILT)
+        
+        return
+    
+    def test_support_weights(self):
+        """The weights for tilted support modifiers average out at one, and
+        give the effective sample size expected for the tilt.
+        """
+        
+        tilt = IMPORTANCE_SUPPORT_TILT
+        rng = random.Random(TEST_SEED)
+        modifiers = samplers.random_modifiers(rng, 20000, PYTHON_ENGINE)
+        weights = [math.exp(log_weight) for log_weight in
+                   samplers.tilt_modifiers(modifiers, {UKP: tilt})]
+        
+        total_weight = sum(weights)
+        sq_weights = sum(weight * weight for weight in weights)
+        self.assertAlmostEqual(total_weight / len(weights), 1.0, places=2)
+        
+        # For an exponential tilt of uniform modifiers, the effective
+        # fraction of the sample is (tilt / sinh(tilt)) squared.
+        self.assertAlmostEqual(utils.effective_sample_size(total_weight,
+                                                           sq_weights) /
+                               len(weights),
+                               (tilt / math.sinh(tilt)) ** 2,
+                               places=2)
+        
+        return
+    
+    def test_noise_weights(self):
+        """The weights for shifted noise average out at one, and give the
+        effective sample size expected for the shift.
+        """
+        
+        tilt = 0.5
+        rng = random.Random(TEST_SEED)
+        weights = []
+        for ii in range(20000):
+            value = rng.normalvariate(50.0 + (tilt * 4.0), 4.0)
+            weights.append(math.exp(utils.normal_tilt_log_weight(value,
+                                                                 50.0,
+                                                                 4.0,
+                                                                 tilt)))
+        
+        total_weight = sum(weights)
+        sq_weights = sum(weight * weight for weight in weights)
+        self.assertAlmostEqual(total_weight / len(weights), 1.0, delta=0.02)
+        
+        # For a shifted normal, the effective fraction of the sample is
+        # exp(-tilt squared).
+        self.assertAlmostEqual(utils.effective_sample_size(total_weight,
+                                                           sq_weights) /
+                               len(weights),
+                               math.exp(-tilt * tilt),
+                               delta=0.02)
+        
+        return
+
+if __name__ == "__main__":
+    unittest.main()
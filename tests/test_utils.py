@@ -0,0 +1,142 @@
+#!/usr/bin/python
+"""
+Electobot
+by Philip Brien (http://github.com/ZsigE)
+
+Analysis and prediction tool based on the 2010 UK General Election results
+
+Tests for the utility functions
+"""
+
+# Python imports
+import unittest
+import random
+
+# Third-party imports
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Electobot imports
+import electobot.utils as utils
+
+# Classes
+class TestCalculateSwing(unittest.TestCase):
+    """calculate_swing() gives the same swing matrices as the original,
+    dictionary-based version did.
+    """
+    
+    def assert_same_matrix(self, matrix, expected):
+        """Check two swing matrices have the same entries."""
+        
+        self.assertEqual(sorted(matrix.keys()), sorted(expected.keys()))
+        for to_party in expected:
+            self.assertEqual(sorted(matrix[to_party].keys()),
+                             sorted(expected[to_party].keys()))
+            for from_party in expected[to_party]:
+                self.assertAlmostEqual(matrix[to_party][from_party],
+                                       expected[to_party][from_party])
+        
+        return
+    
+    def test_new_and_unchanged_parties(self):
+        """A party that's new, and one whose support doesn't change."""
+        
+        matrix = utils.calculate_swing({"A": 0.4, "B": 0.35, "C": 0.25},
+                                       {"A": 0.3, "B": 0.4, "C": 0.25,
+                                        "D": 0.05})
+        self.assert_same_matrix(matrix,
+                                {"A": {"B": -0.05, "C": 0, "D": -0.05},
+                                 "B": {"A": 0.05, "C": 0},
+                                 "C": {"A": 0, "B": 0, "C": 0, "D": 0},
+                                 "D": {"A": 0.05, "C": 0}})
+        
+        return
+    
+    def test_missing_party(self):
+        """A party with no support figure is treated as not swinging."""
+        
+        matrix = utils.calculate_swing({"A": 0.5, "B": 0.3, "C": 0.2},
+                                       {"A": 0.45, "C": 0.3})
+        self.assert_same_matrix(matrix,
+                                {"A": {"B": 0, "C": -0.05},
+                                 "B": {"A": 0, "B": 0, "C": 0},
+                                 "C": {"A": 0.1, "B": 0}})
+        
+        return
+
+class TestRunningStats(unittest.TestCase):
+    """RunningStats gives the same answers however the values are added."""
+    
+    def setUp(self):
+        """Make up some weighted values."""
+        
+        rng = random.Random(1)
+        self.values = [rng.gauss(300, 20) for ii in range(200)]
+        self.weights = [rng.uniform(0.1, 2) for ii in range(200)]
+        
+        return
+    
+    def assert_same_stats(self, stats, expected):
+        """Check two RunningStats have the same totals."""
+        
+        self.assertAlmostEqual(stats.count, expected.count)
+        self.assertAlmostEqual(stats.sq_weights, expected.sq_weights)
+        self.assertAlmostEqual(stats.mean, expected.mean)
+        self.assertAlmostEqual(stats.std_dev(), expected.std_dev())
+        
+        return
+    
+    def test_merge(self):
+        """Merging the stats of two halves is the same as one pass."""
+        
+        one_pass = utils.RunningStats()
+        first = utils.RunningStats()
+        second = utils.RunningStats()
+        for ii, (value, weight) in enumerate(zip(self.values, self.weights)):
+            one_pass.add(value, weight)
+            if ii < 70:
+                first.add(value, weight)
+            else:
+                second.add(value, weight)
+        first.merge(second)
+        self.assert_same_stats(first, one_pass)
+        
+        # Merging into nothing, or merging nothing in, changes nothing.
+        empty = utils.RunningStats()
+        empty.merge(one_pass)
+        self.assert_same_stats(empty, one_pass)
+        first.merge(utils.RunningStats())
+        self.assert_same_stats(first, one_pass)
+        
+        return
+    
+    def test_unweighted(self):
+        """Unweighted values give the usual mean and standard deviation."""
+        
+        stats = utils.RunningStats()
+        for value in self.values:
+            stats.add(value)
+        self.assertEqual(stats.count, len(self.values))
+        self.assertAlmostEqual(stats.mean, sum(self.values) / len(self.values))
+        self.assertAlmostEqual(stats.std_dev(), utils.std_dev(self.values))
+        
+        return
+    
+    @unittest.skipIf(np is None, "NumPy isn't installed")
+    def test_add_array(self):
+        """Adding arrays of values is the same as one pass."""
+        
+        one_pass = utils.RunningStats()
+        for value, weight in zip(self.values, self.weights):
+            one_pass.add(value, weight)
+        stats = utils.RunningStats()
+        stats.add_array(np.array(self.values[:70]), np.array(self.weights[:70]))
+        stats.add_array(np.array(self.values[70:]), np.array(self.weights[70:]))
+        self.assert_same_stats(stats, one_pass)
+        
+        return
+
+if __name__ == "__main__":
+    unittest.main()